@@ -0,0 +1,34 @@
+"""
+Throughput of the JSON codec backend against the standard library on a saved document.
+
+    python -m benchmarks.bench_codec [pins]
+"""
+from benchmarks.bench_models import make_raw_pin
+from files.model_methods import Pin
+from files import codec_methods as codec
+
+import json, sys, time
+
+
+def measure(label: str, function, size: int):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<32} {elapsed * 1000:9.1f} ms {size / elapsed / (1024 * 1024):9.1f} MB/s')
+
+
+def main(count: int = 50000):
+    document = {'username': 'bench', 'created': [Pin.from_raw(make_raw_pin(index)).to_dict() for index in range(count)], 'boards': []}
+    indented = json.dumps(document, indent=4, ensure_ascii=False)
+    size = len(indented.encode('utf-8'))
+    print(f'----# {count} pins, {size / (1024 * 1024):.1f} MB document, backend: {codec.BACKEND}')
+
+    measure('json.dumps (indent=4)', lambda: json.dumps(document, indent=4, ensure_ascii=False), size)
+    measure('codec.dump_bytes (indent)', lambda: codec.dump_bytes(document, indent=True), size)
+    measure('codec.dump_bytes (compact)', lambda: codec.dump_bytes(document), size)
+    measure('json.loads', lambda: json.loads(indented), size)
+    measure('codec.loads', lambda: codec.loads(indented), size)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
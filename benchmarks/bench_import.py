@@ -0,0 +1,57 @@
+"""
+Import time of the CLI, measured in fresh interpreters with `-X importtime`.
+
+Fails (exit code 1) when the median time to `import main` or the time spent in this repo's own modules
+goes over its budget, so slow work creeping back into module level is caught.
+
+    python -m benchmarks.bench_import [--runs 5] [--budget-ms 300] [--own-budget-ms 30] [--module main]
+"""
+import argparse, os, re, statistics, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+OWN_PACKAGES = ('files', 'main')
+
+
+def measure(module: str):
+    """Returns `{module: (self_us, cumulative_us)}` of one import of `module`."""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True
+    ).stderr
+    timings = {}
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            timings[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the import time of the CLI against a budget.')
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=300.0, help='budget of the whole import, third party packages included')
+    parser.add_argument('--own-budget-ms', type=float, default=30.0, help='budget of the time spent in this repo\'s own modules')
+    parser.add_argument('--top', type=int, default=8, help='slowest modules to list')
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.module) for _ in range(max(1, args.runs))]
+    total = statistics.median(run[args.module][1] for run in runs) / 1000
+    own = statistics.median(
+        sum(self_us for name, (self_us, _) in run.items() if name.split('.')[0] in OWN_PACKAGES) for run in runs
+    ) / 1000
+
+    print(f'----# import {args.module}: {total:.1f} ms (budget {args.budget_ms:.0f} ms), own modules {own:.1f} ms (budget {args.own_budget_ms:.0f} ms)')
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in slowest:
+        print(f'\t{name:<40} {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms cumulative'.expandtabs(4))
+
+    over = total > args.budget_ms or own > args.own_budget_ms
+    if over:
+        print('----$ Over budget!')
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
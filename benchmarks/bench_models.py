@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the typed models against the DotDict access patterns they replaced.
+
+    python -m benchmarks.bench_models [pins]
+"""
+from files.parser_methods import DotDict
+from files.model_methods import Pin
+
+import sys, time, tracemalloc
+
+
+def make_raw_pin(index: int):
+    pin = {
+        'id': str(index), 'title': f'Pin {index}', 'name': None, 'auto_alt_text': 'alt', 'created_at': 'Mon, 01 Jan 2024 00:00:00 +0000',
+        'description': 'description ' * 10,
+        'images': {size: {'url': f'https://i.pinimg.com/{size}/{index}.jpg', 'width': 736, 'height': 1104} for size in ('60x60', '170x', '236x', '474x', '736x', 'orig')},
+    }
+    if index % 5 == 0:
+        pin['story_pin_data'] = {
+            'total_video_duration': 12,
+            'pages': [{'blocks': [{'block_type': 3, 'video': {'video_list': {
+                key: {'url': f'https://v1.pinimg.com/{key}/{index}.m3u8', 'width': 720, 'height': 1280, 'thumbnail': 'thumb'}
+                for key in ('V_HLSV3_MOBILE', 'V_EXP7', 'V_720P')
+            }}}]} for _ in range(3)]
+        }
+    return pin
+
+
+def dotdict_convert(raw: dict):
+    """The pre-model conversion: every attribute access re-wraps nested dicts and lists."""
+    pin = DotDict(raw, mode='saving')
+    videos = []
+    story_pin_data = pin.story_pin_data
+    if story_pin_data and story_pin_data.total_video_duration != 0:
+        for page in story_pin_data.pages or []:
+            for block in page.blocks or []:
+                if block.block_type != 3:
+                    continue
+                for value in (block.video.video_list or {}).values():
+                    value = DotDict(value)
+                    videos.append({'width': value.width, 'height': value.height, 'thumbnail': value.thumbnail,
+                                   'url': value.url, 'duration': story_pin_data.total_video_duration})
+    return {'name': pin.name, 'title': pin.title, 'id': pin.id, 'alt_text': pin.auto_alt_text, 'created_at': pin.created_at,
+            'description': pin.description, 'images': pin.images, 'videos': videos, 'has_videos': bool(videos)}
+
+
+def dotdict_download_access(saved: dict):
+    pin = DotDict(saved)
+    name = pin.title or pin.name or str(pin.id)
+    if pin.videos:
+        return name, [video.url for video in pin.videos]
+    return name, pin.images.orig.url
+
+
+def model_convert(raw: dict):
+    return Pin.from_raw(raw).to_dict()
+
+
+def model_download_access(saved: dict):
+    pin = Pin.from_saved(saved)
+    name = pin.title or pin.name or str(pin.id)
+    if pin.videos:
+        return name, [video.url for video in pin.videos]
+    return name, pin.image('orig').url
+
+
+def measure(label: str, function, items: list):
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<28} {elapsed * 1000:9.1f} ms {len(items) / elapsed:12.0f} pins/s {peak / (1024 * 1024):8.1f} MB peak')
+    return results
+
+
+def main(count: int = 20000):
+    raw_pins = [make_raw_pin(index) for index in range(count)]
+    print(f'----# {count} pins')
+
+    saved = measure('DotDict convert', dotdict_convert, raw_pins)
+    measure('Model convert', model_convert, raw_pins)
+    measure('DotDict download access', dotdict_download_access, saved)
+    measure('Model download access', model_download_access, saved)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
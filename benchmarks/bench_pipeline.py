@@ -0,0 +1,196 @@
+"""
+End to end benchmark of the scrape, save and download stages against benchmarks/mock_server.py.
+
+The mock server runs in its own process so it does not compete with the scraper for the GIL. Every option
+the bench does not know is passed on to the server (see `python -m benchmarks.mock_server --help`).
+
+    python -m benchmarks.bench_pipeline [--concurrency 8] [--workers 50] [--rate 1000] [--json results.json]
+                                        [--boards 20 --pins-per-board 250 --latency 0.05 --throttle-rate 0.01 ...]
+"""
+from contextlib import redirect_stdout
+from urllib.request import urlopen
+
+import argparse, json, os, subprocess, sys, tempfile, time, shutil
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+API_ENDPOINTS = ('UserResource', 'UserActivityPinsResource', 'BoardsResource', 'BoardFeedResource')
+
+
+def peak_rss_mb():
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def server_stats(base: str):
+    with urlopen(f'{base}/__stats') as response:
+        return json.loads(response.read())
+
+
+def start_server(server_argv: list):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.mock_server', '--port', '0', *server_argv],
+        stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    base = process.stdout.readline().strip()
+    if not base.startswith('http'):
+        process.kill()
+        raise RuntimeError(f'mock server did not start: {base!r}')
+    return process, base
+
+
+class Stage:
+    __slots__ = ('name', 'seconds', 'requests', 'throttled', 'errors', 'items', 'bytes', 'peak_rss')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.items = 0
+        self.bytes = 0
+        self.peak_rss = 0.0
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def measure(name: str, base: str, function):
+    stage = Stage(name)
+    before = server_stats(base)
+    start = time.perf_counter()
+    function(stage)
+    stage.seconds = time.perf_counter() - start
+    after = server_stats(base)
+
+    delta = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+    stage.requests = sum(value for key, value in delta.items() if key in API_ENDPOINTS or key == 'cdn')
+    stage.throttled = delta.get('429', 0)
+    stage.errors = delta.get('5xx', 0)
+    stage.peak_rss = peak_rss_mb()
+    return stage
+
+
+def report(stage: Stage, unit: str):
+    rate = stage.items / stage.seconds if stage.seconds else 0
+    mb = stage.bytes / (1024 * 1024)
+    print(
+        f'{stage.name:<10} {stage.seconds:8.2f} s {stage.requests:7d} req {stage.requests / stage.seconds if stage.seconds else 0:8.1f} req/s '
+        f'{rate:9.1f} {unit}/s {mb / stage.seconds if stage.seconds else 0:8.1f} MB/s '
+        f'{stage.throttled:5d} 429 {stage.errors:5d} 5xx {stage.peak_rss:8.1f} MB peak RSS'
+    )
+
+
+def run(args, base: str):
+    # The scraper reads these when it is imported
+    from files.commons import RATE_LIMITER, LOG_PATH, DOWNLOAD_PATH
+    from files.http_methods import get_user, get_user_pins_and_boards
+    from files.parser_methods import pretty_save_with_correct_data
+    from files.download_methods import PinterestDownloader
+    from files.pipeline_methods import DownloadSink
+    from files.quality_methods import QualityPolicy
+    from files import codec_methods as codec
+    from benchmarks.mock_server import USERNAME
+
+    RATE_LIMITER.set_budget('127.0.0.1', args.rate, max(1, int(args.rate)))
+    RATE_LIMITER.set_budget('localhost', args.cdn_rate, max(1, int(args.cdn_rate)))
+    os.makedirs(os.path.join(LOG_PATH, USERNAME), exist_ok=True)
+
+    document = {}
+    json_path = os.path.join(os.environ['PINTEREST_SCRAPPER_PATH'], f'{USERNAME}.json')
+    stages = []
+
+    def scrape(stage: Stage):
+        userinfo = get_user(USERNAME, verbose=False)
+        created_pins, boards = get_user_pins_and_boards(userinfo, args.concurrency, verbose=False)
+        document.update({key: value for key, value in userinfo.items()}, created_pins=created_pins, boards=boards)
+        stage.items = len(created_pins) + sum(len(board['pins']) for board in boards)
+
+    def save(stage: Stage):
+        if not pretty_save_with_correct_data(document, json_path, compact=args.compact):
+            raise RuntimeError(f'unable to save {json_path}')
+        stage.items = 1
+        stage.bytes = os.path.getsize(json_path)
+
+    def download(stage: Stage):
+        downloader = PinterestDownloader(QualityPolicy(args.quality))
+        downloader.max_workers = args.workers
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            stage.bytes = downloader.download(codec.load_file(json_path)) or 0
+        # Every linked file reserved its name
+        stage.items = sum(len(names) for names in downloader.names.taken.values())
+
+    def pipeline(stage: Stage):
+        downloader = PinterestDownloader(QualityPolicy(args.quality))
+        downloader.max_workers = args.workers
+        sink = DownloadSink(downloader)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            userinfo = get_user(USERNAME, verbose=False)
+            try:
+                created_pins, boards = get_user_pins_and_boards(userinfo, args.concurrency, sink=sink, verbose=False, collect=True)
+            finally:
+                stage.bytes = sink.close()
+        document.update({key: value for key, value in userinfo.items()}, created_pins=created_pins, boards=boards)
+        stage.items = sink.queued
+
+    for name, function, unit in (('scrape', scrape, 'pins'), ('save', save, 'docs'), ('download', download, 'files'), ('pipeline', pipeline, 'pins')):
+        if name not in args.stages:
+            continue
+        if name == 'pipeline':
+            # Otherwise everything is already in the blob store of the download stage
+            shutil.rmtree(os.path.join(DOWNLOAD_PATH, USERNAME, 'downloads'), ignore_errors=True)
+        stage = measure(name, base, function)
+        stages.append(stage)
+        report(stage, unit)
+    return stages
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the scraper against the local mock server.')
+    parser.add_argument('--concurrency', type=int, default=8, help='crawl requests in flight')
+    parser.add_argument('--workers', type=int, default=50, help='download workers')
+    parser.add_argument('--rate', type=float, default=1000.0, help='API requests/s allowed by the rate limiter')
+    parser.add_argument('--cdn-rate', type=float, default=1000.0, help='CDN requests/s allowed by the rate limiter')
+    parser.add_argument('--quality', default='orig')
+    parser.add_argument('--compact', action='store_true', help='save the document without indentation')
+    parser.add_argument('--stages', nargs='+', default=['scrape', 'save', 'download'], choices=['scrape', 'save', 'download', 'pipeline'],
+                        help='pipeline scrapes and downloads at the same time, compare it with scrape + download')
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary download directory')
+    return parser.parse_known_args(argv)
+
+
+def main(argv=None):
+    args, server_argv = parse_args(argv)
+    process, base = start_server(server_argv)
+    work_path = tempfile.mkdtemp(prefix='pinterest-bench-')
+    os.environ['PINTEREST_BASE'] = base
+    os.environ['PINTEREST_SCRAPPER_PATH'] = work_path
+
+    try:
+        print(f'----# Mock server at {base} {" ".join(server_argv)}, working in {work_path}')
+        stages = run(args, base)
+        totals = server_stats(base)
+        from files.metrics_methods import METRICS
+        print(f'----# Server: {json.dumps(totals, sort_keys=True)}')
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as file:
+                json.dump({'args': vars(args), 'server': server_argv, 'stages': [stage.to_dict() for stage in stages], 'requests': totals,
+                           'metrics': METRICS.snapshot()}, file, indent=4)
+    finally:
+        process.terminate()
+        process.wait()
+        if not args.keep:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+"""
+Scaling of the crawl job queue (files/queue_methods.py) with the number of worker processes, against
+benchmarks/mock_server.py. Every run crawls the whole mock account again and checks that the exported
+document has every pin exactly once. `--kill-after` SIGKILLs one worker mid-run to check that its jobs are
+reclaimed once their lease expires.
+
+    python -m benchmarks.bench_queue [--workers 1 2 4] [--lease 5] [--kill-after 2]
+                                     [--boards 16 --pins-per-board 200 --latency 0.05 ...]
+"""
+import argparse, json, os, signal, sys, tempfile, time, shutil
+
+from benchmarks.bench_pipeline import start_server
+from benchmarks.mock_server import parse_args as parse_server_args, config_from_args
+
+
+def run(args, base: str, expected: int):
+    # The scraper reads these when it is imported, the workers inherit them
+    from files.commons import DOWNLOAD_PATH
+    from files.queue_methods import JobQueue, start_workers, QUEUE_PATH
+    from files.index_methods import MetadataIndex
+    from files import codec_methods as codec
+    from benchmarks.mock_server import USERNAME
+
+    budgets = {'127.0.0.1': args.rate, 'localhost': args.rate}
+    results = []
+    for workers in args.workers:
+        with JobQueue(QUEUE_PATH) as queue:
+            queue.add_account(USERNAME)
+
+        start = time.perf_counter()
+        processes = start_workers(workers, QUEUE_PATH, args.lease, args.concurrency, budgets)
+        killed = None
+        if args.kill_after and workers > 1:
+            time.sleep(args.kill_after)
+            killed = processes[0].pid
+            os.kill(killed, signal.SIGKILL)
+        for process in processes:
+            process.join()
+        seconds = time.perf_counter() - start
+
+        with JobQueue(QUEUE_PATH) as queue:
+            counts = queue.counts()
+        document = codec.load_file(os.path.join(DOWNLOAD_PATH, USERNAME, f'{USERNAME}.json'))
+        pin_ids = [pin['id'] for pin in document['created']] + [pin['id'] for board in document['boards'] for pin in board['pins']]
+        with MetadataIndex.for_user(USERNAME) as index:
+            indexed = index.counts()['pins']
+
+        ok = len(pin_ids) == indexed and len(pin_ids) == expected and not counts['failed']
+        results.append({'workers': workers, 'seconds': seconds, 'pins': len(pin_ids), 'expected': expected, 'killed': killed, 'jobs': counts, 'ok': ok})
+        print(f'{workers:3d} workers {seconds:8.2f} s {len(pin_ids) / seconds:9.1f} pins/s {len(pin_ids):7d} pins '
+              f'{"killed " + str(killed) if killed else "":<14} {"ok" if ok else "MISMATCH " + json.dumps(counts)}')
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the crawl job queue against the local mock server.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=2, help='crawl requests in flight per worker')
+    parser.add_argument('--rate', type=float, default=1000.0, help='requests/s allowed by the rate limiter of every worker')
+    parser.add_argument('--lease', type=float, default=5.0)
+    parser.add_argument('--kill-after', type=float, default=0, help='SIGKILL one worker after this many seconds')
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE')
+    args, server_argv = parser.parse_known_args(argv)
+
+    process, base = start_server(server_argv)
+    work_path = tempfile.mkdtemp(prefix='pinterest-queue-bench-')
+    os.environ['PINTEREST_BASE'] = base
+    os.environ['PINTEREST_SCRAPPER_PATH'] = work_path
+    try:
+        print(f'----# Mock server at {base} {" ".join(server_argv)}, working in {work_path}')
+        results = run(args, base, config_from_args(parse_server_args(server_argv)).total_pins)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as file:
+                json.dump({'args': vars(args), 'server': server_argv, 'results': results}, file, indent=4)
+        return 0 if all(result['ok'] for result in results) else 1
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(work_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
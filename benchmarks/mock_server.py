@@ -0,0 +1,306 @@
+"""
+Local stand-in for the Pinterest resource endpoints and the pinimg CDN.
+
+Serves a generated account (created pins and boards with pins) through UserResource, UserActivityPinsResource,
+BoardsResource and BoardFeedResource with bookmark paging like the real site, and images, mp4s and HLS
+playlists under /cdn/. Latency, 429s and 5xx can be injected. `GET /__stats` returns the request counts.
+
+    python -m benchmarks.mock_server [--port 8080] [--boards 20] [--pins-per-board 250] [--latency 0.05] ...
+
+Point the scraper at it with `PINTEREST_BASE=http://127.0.0.1:8080`.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import argparse, json, random, sys, threading, time
+
+USERNAME = 'benchuser'
+PAGE_SIZE = 25
+END_BOOKMARK = '-end-'
+BOARD_ID_BASE = 10 ** 6
+# Pin ids of board `b` start at (b + 1) * PIN_ID_STRIDE, created pins at 1
+PIN_ID_STRIDE = 10 ** 6
+SEGMENTS = 6
+
+JPEG_MAGIC = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+MP4_MAGIC = b'\x00\x00\x00\x18ftypmp42'
+TS_MAGIC = b'\x47\x40\x00\x10'
+
+
+class MockConfig:
+    __slots__ = ('boards', 'pins_per_board', 'created', 'video_every', 'image_bytes', 'video_bytes', 'latency', 'cdn_latency',
+                 'throttle_rate', 'error_rate', 'retry_after', 'seed', 'cdn_host')
+
+    def __init__(self, boards: int = 20, pins_per_board: int = 250, created: int = 500, video_every: int = 10,
+                 image_bytes: int = 200 * 1024, video_bytes: int = 2 * 1024 * 1024, latency: float = 0.0, cdn_latency: float = 0.0,
+                 throttle_rate: float = 0.0, error_rate: float = 0.0, retry_after: float = 1, seed: int = 0, cdn_host: str = 'localhost'):
+        self.boards = boards
+        self.pins_per_board = pins_per_board
+        self.created = created
+        self.video_every = video_every
+        self.image_bytes = image_bytes
+        self.video_bytes = video_bytes
+        self.latency = latency
+        self.cdn_latency = cdn_latency
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        # Another name for the same server, so the CDN is a separate host for the rate limiter and scheduler
+        self.cdn_host = cdn_host
+
+    @property
+    def total_pins(self):
+        return self.created + self.boards * self.pins_per_board
+
+
+class MockPinterest:
+    """The generated account. Every page is built on demand from the pin ids, nothing is kept in memory."""
+
+    def __init__(self, config: MockConfig, cdn_base: str):
+        self.config = config
+        self.cdn_base = cdn_base
+        self.filler = random.Random(config.seed).randbytes(max(config.image_bytes, config.video_bytes, 1024))
+
+    def user(self):
+        config = self.config
+        return {
+            'id': '1', 'username': USERNAME, 'full_name': 'Bench User', 'pin_count': config.total_pins,
+            'board_count': config.boards, 'follower_count': 42, 'following_count': 7,
+            'image_xlarge_url': f'{self.cdn_base}/cdn/avatar/{USERNAME}.jpg',
+            'image_large_url': f'{self.cdn_base}/cdn/avatar/{USERNAME}.jpg',
+            'profile_cover': {'images': {'originals': {'url': f'{self.cdn_base}/cdn/banner/{USERNAME}.jpg'}}},
+        }
+
+    def board(self, index: int):
+        return {
+            'type': 'board', 'id': str(BOARD_ID_BASE + index), 'name': f'Board {index}', 'url': f'/{USERNAME}/board-{index}/',
+            'pin_count': self.config.pins_per_board, 'created_at': 'Mon, 01 Jan 2024 00:00:00 +0000',
+            'board_order_modified_at': 'Tue, 02 Jan 2024 00:00:00 +0000', 'follower_count': index,
+            'image_cover_hd_url': f'{self.cdn_base}/cdn/736x/{BOARD_ID_BASE + index}.jpg',
+        }
+
+    def pin(self, pin_id: int):
+        cdn = self.cdn_base
+        pin = {
+            'id': str(pin_id), 'title': f'Pin {pin_id}', 'name': None, 'auto_alt_text': 'alt text',
+            'created_at': 'Mon, 01 Jan 2024 00:00:00 +0000', 'description': 'A generated pin. ' * 4,
+            'images': {
+                size: {'url': f'{cdn}/cdn/{size}/{pin_id}.jpg', 'width': width, 'height': width * 3 // 2}
+                for size, width in (('170x', 170), ('236x', 236), ('474x', 474), ('736x', 736), ('orig', 1200))
+            },
+        }
+        if self.config.video_every and pin_id % self.config.video_every == 0:
+            pin['story_pin_data'] = {
+                'total_video_duration': 12000,
+                'pages': [{'blocks': [{'block_type': 3, 'video': {'video_list': {
+                    'V_HLSV3_MOBILE': {'url': f'{cdn}/cdn/hls/{pin_id}/master.m3u8', 'width': 240, 'height': 426, 'thumbnail': None},
+                    'V_720P': {'url': f'{cdn}/cdn/mp4/{pin_id}.mp4', 'width': 720, 'height': 1280, 'thumbnail': None},
+                }}}]}]
+            }
+        return pin
+
+    @staticmethod
+    def page(ids: range, bookmark: str | None):
+        """One page of `ids` after `bookmark`, and the next bookmark (`-end-` after the last page, like Pinterest)."""
+        if bookmark == END_BOOKMARK:
+            return [], END_BOOKMARK
+        offset = int(bookmark[3:]) if bookmark and bookmark.startswith('bm-') else 0
+        page_ids = ids[offset:offset + PAGE_SIZE]
+        next_offset = offset + PAGE_SIZE
+        return page_ids, f'bm-{next_offset}' if next_offset < len(ids) else END_BOOKMARK
+
+    def created_ids(self):
+        return range(1, self.config.created + 1)
+
+    def board_ids(self, board_id: int):
+        start = (board_id - BOARD_ID_BASE + 1) * PIN_ID_STRIDE
+        return range(start, start + self.config.pins_per_board)
+
+    def resource(self, name: str, options: dict):
+        bookmark = (options.get('bookmarks') or [None])[0]
+        if name == 'UserResource':
+            return self.user(), None
+        if name == 'UserActivityPinsResource':
+            ids, bookmark = self.page(self.created_ids(), bookmark)
+            return [self.pin(pin_id) for pin_id in ids], bookmark
+        if name == 'BoardsResource':
+            indexes, bookmark = self.page(range(self.config.boards), bookmark)
+            return [self.board(index) for index in indexes], bookmark
+        if name == 'BoardFeedResource':
+            ids, bookmark = self.page(self.board_ids(int(options.get('board_id') or BOARD_ID_BASE)), bookmark)
+            return [self.pin(pin_id) for pin_id in ids], bookmark
+        return None, None
+
+    def media(self, path: str):
+        """Body and content type of a CDN path, None for unknown paths."""
+        parts = path.strip('/').split('/')[1:]
+        if len(parts) < 2:
+            return None
+        kind, name = parts[0], parts[-1]
+        key = name.encode('utf-8')
+
+        if kind == 'hls':
+            pin_id = parts[1]
+            if name == 'master.m3u8':
+                return (
+                    '#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=400000,RESOLUTION=240x426\nlow.m3u8\n'
+                    '#EXT-X-STREAM-INF:BANDWIDTH=2400000,RESOLUTION=720x1280\nhigh.m3u8\n'
+                ).encode('utf-8'), 'application/vnd.apple.mpegurl'
+            if name.endswith('.m3u8'):
+                segments = ''.join(f'#EXTINF:2.0,\n{name[:-5]}-{index}.ts\n' for index in range(SEGMENTS))
+                return f'#EXTM3U\n#EXT-X-TARGETDURATION:2\n{segments}#EXT-X-ENDLIST\n'.encode('utf-8'), 'application/vnd.apple.mpegurl'
+            size = self.config.video_bytes // SEGMENTS // (4 if name.startswith('low') else 1)
+            return TS_MAGIC + f'{pin_id}/{name}'.encode('utf-8') + self.filler[:size], 'video/mp2t'
+        if kind == 'mp4':
+            return MP4_MAGIC + key + self.filler[:self.config.video_bytes], 'video/mp4'
+
+        # Images, smaller tiers are smaller files
+        width = {'170x': 170, '236x': 236, '474x': 474, '736x': 736}.get(kind, 1200)
+        size = max(1024, self.config.image_bytes * width * width // (1200 * 1200))
+        return JPEG_MAGIC + key + self.filler[:size], 'image/jpeg'
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockPinterest/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: dict | None = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        is_cdn = parts.path.startswith('/cdn/')
+        category = 'cdn' if is_cdn else parts.path.strip('/').split('/')[1] if parts.path.startswith('/resource/') else parts.path
+
+        if parts.path == '/__stats':
+            self.send_body(200, json.dumps(server.stats()).encode('utf-8'), 'application/json')
+            return
+
+        server.count(category)
+        latency = server.config.cdn_latency if is_cdn else server.config.latency
+        if latency:
+            time.sleep(latency)
+
+        fault = server.fault()
+        if fault == 429:
+            server.count('429')
+            self.send_body(429, b'{}', 'application/json', {'Retry-After': str(server.config.retry_after)})
+            return
+        if fault == 503:
+            server.count('5xx')
+            self.send_body(503, b'{}', 'application/json')
+            return
+
+        if is_cdn:
+            media = server.pinterest.media(parts.path)
+            if media is None:
+                self.send_body(404, b'', 'text/plain')
+                return
+            body, content_type = media
+            server.count('cdn_bytes', len(body))
+            self.send_body(200, body, content_type)
+            return
+
+        try:
+            options = json.loads(parse_qs(parts.query).get('data', ['{}'])[0]).get('options', {})
+        except ValueError:
+            options = {}
+        data, bookmark = server.pinterest.resource(category, options)
+        if data is None:
+            self.send_body(404, b'{}', 'application/json')
+            return
+        response = {'resource_response': {'status': 'success', 'data': data, 'bookmark': bookmark}}
+        self.send_body(200, json.dumps(response).encode('utf-8'), 'application/json')
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), MockHandler)
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.counts = {}
+        self.pinterest = MockPinterest(config, f'http://{config.cdn_host}:{self.server_port}')
+
+    @property
+    def base(self):
+        return f'http://{self.server_address[0]}:{self.server_port}'
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def fault(self):
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.config.throttle_rate:
+            return 429
+        if roll < self.config.throttle_rate + self.config.error_rate:
+            return 503
+        return None
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='mock-server', daemon=True).start()
+        return self
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local mock of the Pinterest API and CDN.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help='0 picks a free port, printed on stdout')
+    parser.add_argument('--boards', type=int, default=20)
+    parser.add_argument('--pins-per-board', type=int, default=250)
+    parser.add_argument('--created', type=int, default=500)
+    parser.add_argument('--video-every', type=int, default=10, help='every n-th pin is a video pin, 0 for none')
+    parser.add_argument('--image-kb', type=int, default=200, help='size of an original image')
+    parser.add_argument('--video-kb', type=int, default=2048)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API response')
+    parser.add_argument('--cdn-latency', type=float, default=0.0, help='seconds added to every CDN response')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of responses that are 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of responses that are 503')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After of the injected 429s')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cdn-host', default='localhost', help='host name put into media urls')
+    return parser.parse_args(argv)
+
+
+def config_from_args(args):
+    return MockConfig(
+        boards=args.boards, pins_per_board=args.pins_per_board, created=args.created, video_every=args.video_every,
+        image_bytes=args.image_kb * 1024, video_bytes=args.video_kb * 1024, latency=args.latency, cdn_latency=args.cdn_latency,
+        throttle_rate=args.throttle_rate, error_rate=args.error_rate, retry_after=args.retry_after, seed=args.seed,
+        cdn_host=args.cdn_host
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = MockServer(config_from_args(args), args.host, args.port)
+    print(server.base, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,216 @@
+from .commons import DOWNLOAD_PATH
+from .stream_methods import CREATED_BOARD
+from .metrics_methods import endpoint_of
+from . import codec_methods as codec
+from urllib.parse import urlparse, parse_qs
+
+import os, gzip, json, time, uuid, logging, threading, zlib
+
+ARCHIVE_SUFFIX = '_responses.jsonl.gz'
+COMPRESS_LEVEL = 6
+# The bookmark Pinterest gives the last page of a feed
+END_BOOKMARK = '-end-'
+
+
+def archive_path(username: str):
+    return os.path.join(DOWNLOAD_PATH, username, username + ARCHIVE_SUFFIX)
+
+
+def describe(url: str):
+    """`(endpoint, source_url, options)` of a resource url."""
+    query = parse_qs(urlparse(url).query)
+    try:
+        options = json.loads(query.get('data', ['{}'])[0]).get('options') or {}
+    except ValueError:
+        options = {}
+    return endpoint_of(url), query.get('source_url', [None])[0], options
+
+
+def feed_key(endpoint: str, options: dict):
+    """The crawler's name of the feed a response belongs to, like the checkpoint keys."""
+    if endpoint == 'UserResource':
+        return 'user'
+    if endpoint == 'UserActivityPinsResource':
+        return CREATED_BOARD
+    if endpoint == 'BoardsResource':
+        return 'boards'
+    if endpoint == 'BoardFeedResource' and options.get('board_id'):
+        return f'board:{options["board_id"]}'
+    return None
+
+
+class ResponseArchive:
+    """
+    Appends every raw resource response of a crawl to a gzip-compressed JSON Lines file, with the
+    endpoint, the source url, the request options and the bookmark the page was requested with.
+
+    Every run appends a new gzip member, so the archive of a resumed or repeated crawl keeps growing,
+    and every record carries the id of the run that wrote it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.run = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = gzip.open(path, 'at', encoding='utf-8', compresslevel=COMPRESS_LEVEL)
+        self.count = 0
+
+    @classmethod
+    def for_user(cls, username: str):
+        return cls(archive_path(username))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, url: str, status: int, resource: dict):
+        endpoint, source_url, options = describe(url)
+        bookmarks = options.get('bookmarks') or [None]
+        try:
+            line = codec.dumps({
+                'time': int(time.time()), 'run': self.run, 'endpoint': endpoint, 'source_url': source_url, 'options': options,
+                'bookmark': bookmarks[0], 'status': status, 'resource': resource
+            })
+            with self.lock:
+                self.file.write(line + '\n')
+                self.count += 1
+        except Exception as e:
+            logging.error(f'Unable to archive the response of {url}: {e} [{e.__class__.__name__}]')
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def iter_archive(path: str):
+    """Yields the archived responses, stopping quietly at the torn end of an interrupted run."""
+    with gzip.open(path, 'rt', encoding='utf-8', errors='ignore') as file:
+        try:
+            for line in file:
+                try:
+                    yield codec.loads(line)
+                except ValueError:
+                    continue
+        except (EOFError, zlib.error) as e:
+            logging.warning(f'{path} ends early: {e}')
+
+
+class ArchiveReplay:
+    """
+    Rebuilds what `get_user` and `get_user_pins_and_boards` return from an archive, without any request.
+
+    Pages are chained the way the crawler followed them: from the first page of a feed through the bookmark
+    of every page to the next one. Responses without data or with an error status are ignored, and within
+    one run the last response of a page wins, so retries and resumed crawls do not duplicate pins.
+    Every feed is taken from the newest run that followed it to the end, pins only newer runs saw (delta
+    scrapes, interrupted crawls) are put in front. A feed no run finished comes from the newest run that has it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.user = None
+        self.runs = []
+        self.feeds = {}
+        self.responses = 0
+        self.loaded = False
+
+    def load(self):
+        for record in iter_archive(self.path):
+            resource = record.get('resource') or {}
+            key = feed_key(record.get('endpoint'), record.get('options') or {})
+            if key is None or record.get('status', 200) != 200 or resource.get('data') is None:
+                continue
+            self.responses += 1
+            if key == 'user':
+                self.user = resource['data']
+                continue
+            # Archives written before runs were tagged count as one run
+            run = record.get('run')
+            if run not in self.feeds:
+                self.runs.append(run)
+                self.feeds[run] = {}
+            self.feeds[run].setdefault(key, {})[record.get('bookmark')] = (resource['data'], resource.get('bookmark'))
+        self.loaded = True
+        return self
+
+    def chain(self, run, key: str):
+        """
+        `(pages, complete)` of one feed as `run` followed it, `complete` when the chain reaches the end of the feed.
+        Pages the run does not have come from the newest run that does, which is how a crawl resumed from a
+        checkpoint in a later run continues the chain of the interrupted one.
+        """
+        feeds = [self.feeds[run].get(key, {})] + [self.feeds[other].get(key, {}) for other in reversed(self.runs) if other != run]
+        if None not in feeds[0]:
+            return [], False
+        bookmark, seen, chain = None, set(), []
+        while bookmark not in seen:
+            pages = next((pages for pages in feeds if bookmark in pages), None)
+            if pages is None:
+                break
+            seen.add(bookmark)
+            page, next_bookmark = pages[bookmark]
+            chain.append(page)
+            if not next_bookmark or next_bookmark in (END_BOOKMARK, bookmark):
+                return chain, True
+            bookmark = next_bookmark
+        return chain, False
+
+    def pages(self, key: str):
+        """The pages of one feed in crawl order."""
+        chains = [(run, *self.chain(run, key)) for run in reversed(self.runs)]
+        chains = [entry for entry in chains if entry[1]]
+        if not chains:
+            return
+        chosen = next((number for number, (_, _, complete) in enumerate(chains) if complete), 0)
+
+        pages = chains[chosen][1]
+        known = {item.get('id') for page in pages for item in page if isinstance(item, dict)}
+        newer = []
+        for _, chain, _ in chains[:chosen]:
+            for item in (item for page in chain for item in page):
+                if isinstance(item, dict) and item.get('id') not in known:
+                    known.add(item.get('id'))
+                    newer.append(item)
+
+        for page in ([newer] if newer else []) + pages:
+            yield page
+
+    def rebuild(self, sink=None, collect: bool = True):
+        """
+        Returns `(userinfo, created_pins, boards)` like a crawl does, handing everything to `sink` on the way
+        (see PinterestCrawler), with `collect=False` the pins are only given to the sink.
+        """
+        if not self.loaded:
+            self.load()
+        if self.user is None:
+            raise LookupError(f'{self.path} does not have the user response')
+
+        userinfo = dict(self.user)
+        if sink:
+            sink.user(userinfo)
+
+        created_pins = []
+        for page in self.pages(CREATED_BOARD):
+            if sink:
+                sink.pins(CREATED_BOARD, page)
+            if collect:
+                created_pins.extend(page)
+
+        boards = []
+        listed = [board for page in self.pages('boards') for board in page if isinstance(board, dict) and board.get('type') == 'board']
+        for board in listed:
+            orig_board = {key: value for key, value in board.items()}
+            orig_board['pins'] = []
+            boards.append(orig_board)
+            if sink:
+                sink.board(orig_board)
+            for page in self.pages(f'board:{board["id"]}'):
+                if sink:
+                    sink.pins(board['id'], page)
+                if collect:
+                    orig_board['pins'].extend(page)
+        return userinfo, created_pins, boards
@@ -0,0 +1,274 @@
+from .commons import DOWNLOAD_PATH, LOG_PATH
+from .http_methods import get_user, get_user_pins_and_boards
+from .parser_methods import get_username, pretty_save_with_correct_data
+from .checkpoint_methods import CrawlCheckpoint
+from .delta_methods import load_previous_document
+from .stream_methods import JsonlWriter, StreamSink, STREAM_PIN_THRESHOLD
+from .pipeline_methods import DownloadSink, TeeSink
+from .index_methods import MetadataIndex, IndexSink
+from .archive_methods import ResponseArchive
+from .download_methods import PinterestDownloader
+from .quality_methods import QualityPolicy
+from .crawl_methods import DEFAULT_CONCURRENCY
+from . import codec_methods as codec
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import os, re, sys, time, logging, threading
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+USERNAME_RE = re.compile(r'^[\w.-]+$')
+
+
+class AccountResult:
+    __slots__ = ('source', 'username', 'status', 'created_pins', 'boards', 'pins', 'downloaded', 'seconds', 'output', 'error')
+
+    def __init__(self, source: str, username: str | None = None):
+        self.source = source
+        self.username = username
+        self.status = 'pending'
+        self.created_pins = 0
+        self.boards = 0
+        self.pins = 0
+        self.downloaded = 0
+        self.seconds = 0.0
+        self.output = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.status == 'ok'
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def read_sources(path: str):
+    """Profile/board urls or bare usernames, one per line, from `path` or stdin for `-`. `#` starts a comment."""
+    file = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        return [line.split('#', 1)[0].strip() for line in file if line.split('#', 1)[0].strip()]
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def resolve_username(source: str):
+    if USERNAME_RE.match(source):
+        return source
+    if not source.startswith(('http://', 'https://')):
+        return None
+    username, _ = get_username(source)
+    return username or None
+
+
+class BatchScraper:
+    """
+    Scrapes many accounts without ever prompting.
+
+    Up to `accounts` accounts are scraped at once. They share the `concurrency` crawl requests and, through
+    the session's rate limiter, one request rate per host. Every account is scraped like main.py does it
+    (checkpoint, metadata index, optional raw response archive and delta against the last scrape, JSON Lines for huge accounts) and optionally downloaded while it is crawled.
+    """
+
+    def __init__(self, accounts: int = 4, concurrency: int = DEFAULT_CONCURRENCY * 2, download: bool = False, delta: bool = True,
+                 policy: QualityPolicy | None = None, download_workers: int = 50, stream_threshold: int = STREAM_PIN_THRESHOLD,
+                 archive: bool = False, shard_bytes: int | None = None, compact: bool = False):
+        self.accounts = max(1, accounts)
+        self.concurrency = max(1, concurrency // self.accounts)
+        self.download = download
+        self.delta = delta
+        self.policy = policy
+        self.download_workers = max(1, download_workers // self.accounts)
+        self.stream_threshold = stream_threshold
+        self.archive = archive
+        self.shard_bytes = shard_bytes
+        self.compact = compact
+        self.stopped = threading.Event()
+        self.print_lock = threading.Lock()
+
+    def log(self, message: str):
+        with self.print_lock:
+            print(message.expandtabs(4), flush=True)
+
+    def scrape(self, result: AccountResult):
+        archive = ResponseArchive.for_user(result.username) if self.archive else None
+        try:
+            return self.scrape_account(result, archive)
+        finally:
+            if archive:
+                archive.close()
+
+    def scrape_account(self, result: AccountResult, archive: ResponseArchive | None = None):
+        username = result.username
+        os.makedirs(os.path.join(LOG_PATH, username), exist_ok=True)
+
+        userinfo = get_user(username, verbose=False, archive=archive)
+        if not userinfo.get('username'):
+            raise LookupError(f'no such user {username}')
+
+        download_dir = os.path.join(DOWNLOAD_PATH, userinfo['username'])
+        os.makedirs(download_dir, exist_ok=True)
+        json_path = os.path.join(download_dir, userinfo['username'] + '.json')
+        previous = load_previous_document(json_path) if self.delta else None
+
+        writer = sink = None
+        if not previous and (userinfo.get('pin_count') or 0) >= self.stream_threshold:
+            json_path = os.path.join(download_dir, userinfo['username'] + '.jsonl.gz')
+            writer = JsonlWriter(json_path)
+            sink = StreamSink(writer)
+
+        index = MetadataIndex.for_user(userinfo['username'])
+        index_sink = IndexSink(index, full=previous is None)
+
+        download_sink = None
+        if self.download:
+            # Media is downloaded while the account is crawled
+            downloader = PinterestDownloader(self.policy, shard_bytes=self.shard_bytes)
+            downloader.max_workers = self.download_workers
+            downloader.index = index
+            download_sink = DownloadSink(downloader)
+
+        checkpoint = CrawlCheckpoint.for_user(username)
+        try:
+            try:
+                created_pins, boards = get_user_pins_and_boards(
+                    userinfo, self.concurrency, checkpoint=checkpoint, previous=previous,
+                    sink=TeeSink(index_sink, sink, download_sink), verbose=False, collect=writer is None, archive=archive
+                )
+            finally:
+                if download_sink:
+                    result.downloaded = download_sink.close()
+                index_sink.close(checkpoint.is_done('user'))
+
+            if writer:
+                writer.close()
+                saved = True
+                result.created_pins, result.pins = sink.created_count, sink.pin_count
+            else:
+                massive_dict = {key: value for key, value in userinfo.items()}
+                massive_dict['created_pins'] = created_pins
+                massive_dict['boards'] = boards
+                saved = pretty_save_with_correct_data(massive_dict, json_path, previous, self.compact)
+                result.created_pins = len(created_pins)
+                result.pins = len(created_pins) + sum(len(board.get('pins') or []) for board in boards)
+            result.boards = len(boards)
+
+            complete = checkpoint.is_done('user')
+            if saved and complete:
+                checkpoint.clear()
+        finally:
+            if writer:
+                writer.close()
+            checkpoint.close()
+            index.close()
+
+        if not saved:
+            raise IOError(f'unable to save {json_path}')
+        result.output = json_path
+        return complete
+
+    def run_account(self, result: AccountResult):
+        started = time.monotonic()
+        try:
+            if self.stopped.is_set():
+                result.status = 'skipped'
+                return result
+
+            complete = self.scrape(result)
+            result.status = 'ok' if complete else 'incomplete'
+        except Exception as e:
+            result.status = 'failed'
+            result.error = f'{e} [{e.__class__.__name__}]'
+            logging.error(f'[{result.username}] Batch scrape failed: {result.error}')
+        finally:
+            result.seconds = round(time.monotonic() - started, 2)
+
+        self.log(f'----# {result.username}: {result.status} [{result.pins} pins, {result.boards} boards, {result.seconds:.1f}s]'
+                 + (f' {result.error}' if result.error else ''))
+        return result
+
+    def run(self, sources: list):
+        """Scrapes every source and returns the results in input order."""
+        results, seen = [], set()
+        for source in sources:
+            try:
+                username = resolve_username(source)
+            except Exception as e:
+                logging.error(f'Unable to resolve {source}: {e} [{e.__class__.__name__}]')
+                username = None
+            result = AccountResult(source, username)
+            if not username:
+                result.status, result.error = 'failed', 'not a pinterest profile or board url'
+            elif username in seen:
+                # Board urls of an account already in the batch, the whole account is scraped once
+                result.status = 'duplicate'
+            seen.add(username)
+            results.append(result)
+
+        pending = [result for result in results if result.status == 'pending']
+        self.log(f'----# Scraping {len(pending)} accounts, {self.accounts} at a time...')
+
+        executor = ThreadPoolExecutor(max_workers=self.accounts, thread_name_prefix='account')
+        try:
+            for future in as_completed([executor.submit(self.run_account, result) for result in pending]):
+                future.result()
+        except KeyboardInterrupt:
+            self.stopped.set()
+            self.log('----$ Interrupted, finishing the accounts in progress...')
+            executor.shutdown(wait=False, cancel_futures=True)
+        finally:
+            executor.shutdown(wait=True)
+
+        for result in pending:
+            if result.status == 'pending':
+                result.status = 'skipped'
+        return results
+
+
+def print_summary(results: list):
+    width = max([len(result.username or result.source) for result in results] + [8])
+    print(f'{"account":<{width}}  {"status":<10}  {"pins":>8}  {"boards":>6}  {"MB":>9}  {"seconds":>8}')
+    for result in results:
+        print(
+            f'{(result.username or result.source):<{width}}  {result.status:<10}  {result.pins:>8}  {result.boards:>6}  '
+            f'{result.downloaded / (1024 * 1024):>9.2f}  {result.seconds:>8.1f}' + (f'  {result.error}' if result.error else '')
+        )
+
+
+def exit_code(results: list):
+    counted = [result for result in results if result.status != 'duplicate']
+    if not counted:
+        return EXIT_USAGE
+    return EXIT_OK if all(result.ok for result in counted) else EXIT_FAILED
+
+
+def run_batch(source_path: str, summary_path: str | None = None, **options):
+    """Entry point of `main.py --batch`, returns the process exit code."""
+    try:
+        sources = read_sources(source_path)
+    except OSError as e:
+        print(f'Unable to read {source_path}: {e}', file=sys.stderr)
+        return EXIT_USAGE
+    if not sources:
+        print('No accounts given.', file=sys.stderr)
+        return EXIT_USAGE
+
+    # One log for the whole batch instead of the first account's log catching everything
+    os.makedirs(LOG_PATH, exist_ok=True)
+    logging.basicConfig(
+        filename=os.path.join(LOG_PATH, 'batch.log'),
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(threadName)s %(filename)s:%(lineno)d - %(message)s'
+    )
+
+    scraper = BatchScraper(**options)
+    results = scraper.run(sources)
+
+    print_summary(results)
+    if summary_path:
+        codec.dump_file([result.to_dict() for result in results], summary_path)
+    return EXIT_INTERRUPTED if scraper.stopped.is_set() else exit_code(results)
@@ -0,0 +1,205 @@
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from . import codec_methods as codec
+from .metrics_methods import METRICS
+
+import os, hashlib, sqlite3, threading, time
+
+DEFAULT_TTL = 60 * 60
+# Pinterest API responses change with every new pin, they are always revalidated whatever the ttl
+API_PATH = '/resource/'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Query parameters that only bust caches
+IGNORED_PARAMS = ('_',)
+# Access times kept in memory before they are written at once
+ACCESS_FLUSH_SIZE = 1000
+
+
+def cache_key(url: str):
+    parts = urlsplit(url)
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key not in IGNORED_PARAMS])
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+
+
+class CacheEntry:
+    __slots__ = ('key', 'status', 'headers', 'etag', 'last_modified', 'body_path', 'size', 'stored_at')
+
+    def __init__(self, key, status, headers, etag, last_modified, body_path, size, stored_at):
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body_path = body_path
+        self.size = size
+        self.stored_at = stored_at
+
+    @property
+    def has_body(self):
+        return bool(self.body_path) and os.path.exists(self.body_path)
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    On-disk HTTP cache with conditional revalidation.
+
+    Bodies of regular responses are stored next to their ETag/Last-Modified and served without a request
+    while younger than `ttl`, afterwards they are revalidated with If-None-Match/If-Modified-Since.
+    API responses (`/resource/` urls) are always revalidated, a re-scrape must see the pins added meanwhile.
+    Streamed responses (media) only have their validators stored, the body lives in the download store.
+    Bodies are evicted least recently used first once they take more than `max_bytes`. Lookups only note
+    their access time in memory, the times are written in one transaction by the next store (before it
+    evicts), by close or once `ACCESS_FLUSH_SIZE` are pending, so a hit never waits for a commit.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bodies_path = os.path.join(path, 'bodies')
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+        self.accessed = {}
+
+        os.makedirs(self.bodies_path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, 'cache.sqlite'), check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, status INTEGER, headers TEXT, etag TEXT, last_modified TEXT, '
+                'body_path TEXT, size INTEGER NOT NULL DEFAULT 0, stored_at REAL, accessed_at REAL)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+            self.total_size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def count(self, stat: str):
+        with self.lock:
+            self.stats[stat] += 1
+        METRICS.inc('http_cache_total', result=stat)
+
+    def lookup(self, url: str):
+        key = cache_key(url)
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT status, headers, etag, last_modified, body_path, size, stored_at FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row:
+                self.accessed[key] = time.time()
+                if len(self.accessed) >= ACCESS_FLUSH_SIZE:
+                    with self.connection:
+                        self._flush_accessed()
+        if not row:
+            return None
+        status, headers, etag, last_modified, body_path, size, stored_at = row
+        return CacheEntry(key, status, codec.loads(headers) if headers else {}, etag, last_modified, body_path, size, stored_at)
+
+    def _flush_accessed(self):
+        """Writes the noted access times, the caller holds the lock and commits."""
+        if self.accessed:
+            self.connection.executemany('UPDATE entries SET accessed_at = ? WHERE key = ?', [(at, key) for key, at in self.accessed.items()])
+            self.accessed.clear()
+
+    def is_fresh(self, entry: CacheEntry, url: str | None = None):
+        if url and API_PATH in urlsplit(url).path:
+            return False
+        return entry.has_body and time.time() - entry.stored_at < self.ttl
+
+    def validators(self, url: str):
+        """Conditional request headers for `url`, empty when nothing is known about it."""
+        entry = self.lookup(url)
+        return entry.conditional_headers() if entry else {}
+
+    def store(self, url: str, response, body: bytes | None = None):
+        """Stores the validators of `response`, and its body when given."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if body is None and not (etag or last_modified):
+            return
+
+        key = cache_key(url)
+        body_path = None
+        if body is not None:
+            body_path = os.path.join(self.bodies_path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+            with open(body_path + '.tmp', 'wb') as file:
+                file.write(body)
+            os.replace(body_path + '.tmp', body_path)
+
+        headers = {key: value for key, value in response.headers.items() if key.lower() not in ('content-encoding', 'transfer-encoding', 'content-length')}
+        size = len(body) if body is not None else 0
+        now = time.time()
+        with self.lock, self.connection:
+            self.accessed.pop(key, None)
+            self._flush_accessed()
+            old = self.connection.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO entries (key, status, headers, etag, last_modified, body_path, size, stored_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, response.status_code, codec.dumps(headers), etag, last_modified, body_path, size, now, now)
+            )
+            self.total_size += size - (old[0] if old else 0)
+            self.stats['stored'] += 1
+        self.evict()
+
+    def refresh(self, entry: CacheEntry):
+        """Marks an entry fresh again after the server answered 304."""
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE entries SET stored_at = ? WHERE key = ?', (time.time(), entry.key))
+
+    def evict(self):
+        with self.lock:
+            if self.total_size <= self.max_bytes:
+                return
+            target = self.max_bytes * 0.9
+            rows = self.connection.execute('SELECT key, body_path, size FROM entries WHERE size > 0 ORDER BY accessed_at').fetchall()
+            with self.connection:
+                for key, body_path, size in rows:
+                    if self.total_size <= target:
+                        break
+                    self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    if body_path and os.path.exists(body_path):
+                        os.remove(body_path)
+                    self.total_size -= size
+                    self.stats['evicted'] += 1
+
+    def build_response(self, entry: CacheEntry, request, connection=None):
+        with open(entry.body_path, 'rb') as file:
+            body = file.read()
+        response = Response()
+        response.status_code = entry.status
+        response.headers = CaseInsensitiveDict(entry.headers)
+        response.headers['Content-Length'] = str(len(body))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = 'OK'
+        response.url = request.url
+        response.request = request
+        response.connection = connection
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['revalidated'] + stats['misses']
+        ratio = (stats['hits'] + stats['revalidated']) / lookups * 100 if lookups else 0
+        return (
+            f"{stats['hits']} hits, {stats['revalidated']} revalidated (304), {stats['misses']} misses "
+            f"[{ratio:.1f}% served from cache], {stats['stored']} stored, {stats['evicted']} evicted"
+        )
+
+    def close(self):
+        with self.lock:
+            with self.connection:
+                self._flush_accessed()
+            self.connection.close()
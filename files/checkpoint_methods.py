@@ -0,0 +1,105 @@
+from .commons import LOG_PATH
+from . import codec_methods as codec
+
+import os, sqlite3, threading, time
+
+
+class CrawlCheckpoint:
+    """
+    On-disk progress of a crawl, one row per received page.
+
+    Every feed (the created pins, the board listing and each board) is stored under its own key
+    together with the bookmark that follows its last page, so an interrupted crawl can resume
+    each feed exactly where it stopped. A checkpoint of a finished crawl starts over when it is opened again.
+    With `shared` the rollback journal is used instead of WAL, which needs shared memory and so does not
+    work for processes on several hosts using the file over a network file system (see queue_methods).
+    """
+
+    def __init__(self, path: str, shared: bool = False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60 if shared else 5)
+        with self.lock, self.connection:
+            self.connection.execute(f'PRAGMA journal_mode={"DELETE" if shared else "WAL"}')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS feeds ('
+                'key TEXT PRIMARY KEY, bookmark TEXT, pages INTEGER NOT NULL DEFAULT 0, '
+                'done INTEGER NOT NULL DEFAULT 0, updated_at INTEGER)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                'key TEXT NOT NULL, page INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (key, page))'
+            )
+            # Only interrupted crawls resume. A finished one whose checkpoint was not cleared (its save failed
+            # or was skipped) would otherwise be replayed by every later run without a single request.
+            if self.connection.execute("SELECT 1 FROM feeds WHERE key = 'user' AND done = 1").fetchone():
+                self.connection.execute('DELETE FROM pages')
+                self.connection.execute('DELETE FROM feeds')
+
+    @classmethod
+    def for_user(cls, username: str, shared: bool = False):
+        path = os.path.join(LOG_PATH, username)
+        os.makedirs(path, exist_ok=True)
+        return cls(os.path.join(path, username + '_checkpoint.sqlite'), shared)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def state(self, key: str):
+        """Returns `(bookmark, pages, done)` for a feed, empty if it was never started."""
+        with self.lock:
+            row = self.connection.execute('SELECT bookmark, pages, done FROM feeds WHERE key = ?', (key,)).fetchone()
+        if not row:
+            return None, 0, False
+        bookmark, pages, done = row
+        return bookmark, pages, bool(done)
+
+    def iter_pages(self, key: str):
+        """The stored pages of a feed in order, read one at a time so a resumed feed is never all in memory."""
+        page = 0
+        while True:
+            with self.lock:
+                row = self.connection.execute(
+                    'SELECT page, data FROM pages WHERE key = ? AND page > ? ORDER BY page LIMIT 1', (key, page)
+                ).fetchone()
+            if not row:
+                return
+            page, data = row
+            yield codec.loads(data)
+
+    def save_page(self, key: str, page: int, items: list, bookmark: str | None, done: bool = False):
+        """Stores one page and the bookmark of the next one in a single transaction."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO pages (key, page, data) VALUES (?, ?, ?)',
+                (key, page, codec.dumps(items))
+            )
+            self.connection.execute(
+                'INSERT OR REPLACE INTO feeds (key, bookmark, pages, done, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (key, bookmark, page, int(done), int(time.time()))
+            )
+
+    def mark_done(self, key: str):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO feeds (key, done, updated_at) VALUES (?, 1, ?) '
+                'ON CONFLICT(key) DO UPDATE SET done = 1, updated_at = excluded.updated_at',
+                (key, int(time.time()))
+            )
+
+    def is_done(self, key: str):
+        with self.lock:
+            row = self.connection.execute('SELECT done FROM feeds WHERE key = ?', (key,)).fetchone()
+        return bool(row and row[0])
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM pages')
+            self.connection.execute('DELETE FROM feeds')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,55 @@
+"""
+JSON codec used for API responses, saved documents, streams and checkpoints.
+
+orjson or msgspec are used when installed (both are several times faster than the standard
+library), otherwise the standard `json` module. Every backend reads what the others write.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+BACKEND = 'orjson' if orjson else 'msgspec' if msgspec else 'json'
+
+
+def loads(data: bytes | str):
+    if orjson:
+        return orjson.loads(data)
+    if msgspec:
+        return msgspec.json.decode(data.encode('utf-8') if isinstance(data, str) else data)
+    return json.loads(data)
+
+
+def dump_bytes(obj, indent: bool = False):
+    """Serializes `obj` to UTF-8 JSON, pretty printed when `indent` is set."""
+    try:
+        if orjson:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0))
+        if msgspec:
+            data = msgspec.json.encode(obj)
+            return msgspec.json.format(data, indent=4) if indent else data
+    except TypeError:
+        # Types the fast backends do not know about, let the standard library have a go
+        pass
+    return json.dumps(obj, indent=4 if indent else None, separators=None if indent else (',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj, indent: bool = False):
+    return dump_bytes(obj, indent).decode('utf-8')
+
+
+def dump_file(obj, path: str, indent: bool = True):
+    with open(path, 'wb') as file:
+        file.write(dump_bytes(obj, indent))
+
+
+def load_file(path: str):
+    with open(path, 'rb') as file:
+        return loads(file.read())
@@ -1,35 +1,237 @@
 from requests import Session as RSession
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
-from fake_useragent import UserAgent
+from urllib.parse import urlparse
+from .limiter_methods import RateLimiter
+from .cache_methods import HttpCache
+from .metrics_methods import METRICS, endpoint_of
 
-import os
+import os, time, threading
 
-BASE = 'https://jp.pinterest.com'
+# Overridable to point the scraper at a mirror or at benchmarks/mock_server.py
+BASE = os.environ.get('PINTEREST_BASE', 'https://jp.pinterest.com').rstrip('/')
 USER_RESOURCE = f'{BASE}/resource/UserResource/get/'
 BOARD_RESOURCE = f'{BASE}/resource/BoardFeedResource/get/'
 USER_PIN_RESOURCE = f'{BASE}/resource/UserActivityPinsResource/get/'
 USER_BOARDS_RESOURCE = f'{BASE}/resource/BoardsResource/get/'
 
-def create_session_with_retries(retries=3, backoff_factor=0.3, status_force_list=(500, 502, 503, 504)):
-    """Creates a session with retries for failed downloads."""
+RATE_LIMITER = RateLimiter()
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that paces every request through a shared RateLimiter.
+    429 and `retry_statuses` responses are retried here (not by urllib3) so the limiter sees each of them
+    and can honor `Retry-After`.
+    With a `cache` (see cache_methods.HttpCache) fresh GET responses are served from disk and stale ones revalidated.
+    """
+
+    def __init__(self, limiter: RateLimiter, retry_statuses=(429, 500, 502, 503, 504), status_retries=3, backoff_factor=0.3,
+                 cache: HttpCache | None = None, **kwargs):
+        self.limiter = limiter
+        self.retry_statuses = tuple(retry_statuses)
+        self.status_retries = status_retries
+        self.backoff_factor = backoff_factor
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if not self.cache or request.method != 'GET' or 'Range' in request.headers:
+            return self._send(request, **kwargs)
+
+        entry = self.cache.lookup(request.url)
+        if entry and self.cache.is_fresh(entry, request.url):
+            self.cache.count('hits')
+            return self.cache.build_response(entry, request, self)
+        if entry and entry.has_body:
+            for key, value in entry.conditional_headers().items():
+                request.headers.setdefault(key, value)
+
+        response = self._send(request, **kwargs)
+
+        if response.status_code == 304 and entry:
+            # Either our revalidation or the caller's own conditional request (media already on disk)
+            self.cache.count('revalidated')
+            self.cache.refresh(entry)
+            if entry.has_body:
+                response.close()
+                return self.cache.build_response(entry, request, self)
+        elif response.status_code == 200:
+            self.cache.count('misses')
+            self.cache.store(request.url, response, None if kwargs.get('stream') else response.content)
+        else:
+            self.cache.count('misses')
+        return response
+
+    def _send(self, request, **kwargs):
+        host = urlparse(request.url).hostname
+        endpoint = endpoint_of(request.url)
+        attempt = 0
+
+        while True:
+            self.limiter.acquire(host)
+            start = time.perf_counter()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception:
+                METRICS.inc('http_requests_total', host=host, endpoint=endpoint, status='error')
+                raise
+            METRICS.observe('http_request_seconds', time.perf_counter() - start, host=host, endpoint=endpoint)
+            METRICS.inc('http_requests_total', host=host, endpoint=endpoint, status=response.status_code)
+            if response.status_code == 429:
+                METRICS.inc('http_throttled_total', host=host)
+            retry = (
+                response.status_code in self.retry_statuses
+                and request.method in ('GET', 'HEAD')
+                and attempt < self.status_retries
+            )
+            self.limiter.update(
+                host, response.status_code,
+                response.headers.get('Retry-After'),
+                self.backoff_factor * (2 ** attempt)
+            )
+            if not retry:
+                return response
+
+            METRICS.inc('http_retries_total', host=host, status=response.status_code)
+            response.close()
+            attempt += 1
+
+# Used when fake-useragent can not load its data
+FALLBACK_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
+_user_agents = None
+_user_agent = None
+_user_agent_lock = threading.Lock()
+
+
+def user_agent(rotate: bool = False):
+    """
+    A browser User-Agent, the same one for the whole run unless `rotate`.
+    The fake-useragent data is only loaded by the first call, not when the module is imported.
+    """
+    global _user_agents, _user_agent
+    with _user_agent_lock:
+        if _user_agents is None:
+            try:
+                from fake_useragent import UserAgent
+                _user_agents = UserAgent()
+            except Exception:
+                _user_agents = False
+        if _user_agent is not None and not rotate:
+            return _user_agent
+        try:
+            agent = _user_agents.random if _user_agents else FALLBACK_USER_AGENT
+        except Exception:
+            agent = FALLBACK_USER_AGENT
+        if _user_agent is None and not rotate:
+            _user_agent = agent
+        return agent
+
+
+def create_session_with_retries(retries=3, backoff_factor=0.3, status_force_list=(500, 502, 503, 504), limiter: RateLimiter | None = None,
+                                cache: HttpCache | None = None, pool_connections: int = 50, pool_maxsize: int = 50, rotate_user_agent: bool = False):
+    """Creates a rate limited (and optionally cached) session with retries for failed downloads."""
     session = RSession()
     retry = Retry(
         total=retries,
         read=retries,
         connect=retries,
         backoff_factor=backoff_factor,
-        status_forcelist=status_force_list,
+        status=0,
         raise_on_status=False
     )
-    adapter = HTTPAdapter(max_retries=retry, pool_connections=50, pool_maxsize=50)
+    adapter = RateLimitedAdapter(
+        RATE_LIMITER if limiter is None else limiter,
+        retry_statuses=(429, *status_force_list),
+        status_retries=retries,
+        backoff_factor=backoff_factor,
+        cache=cache,
+        max_retries=retry, pool_connections=pool_connections, pool_maxsize=pool_maxsize
+    )
     session.mount('https://', adapter)
     session.mount('http://', adapter)
-    session.headers.update({'User-Agent': UserAgent().random, 'Referer': BASE, 'X-Pinterest-AppState': 'Active'})
+    session.headers.update({'User-Agent': user_agent(rotate_user_agent), 'Referer': BASE, 'X-Pinterest-AppState': 'Active'})
 
     return session
 
 
-SESSION = create_session_with_retries()
-DOWNLOAD_PATH = os.path.join(os.path.split(os.path.split(__file__)[0])[0], 'Pintrest Scrapper') 
+def get_cache(session: RSession, url: str = BASE):
+    adapter = session.get_adapter(url)
+    return getattr(adapter, 'cache', None)
+
+
+def enable_cache(session: RSession, cache: HttpCache | None):
+    """Turns the HTTP cache of an existing session on (or off with None)."""
+    for adapter in session.adapters.values():
+        if isinstance(adapter, RateLimitedAdapter):
+            adapter.cache = cache
+
+
+class SessionPool:
+    """
+    One session per thread, created on first use.
+
+    Workers never share a session, its connection pool or cookie jar, so they do not contend on their locks.
+    Every session is small (`pool_maxsize` connections per host) and they all pace through the same
+    RateLimiter. Sessions of threads that ended are closed the next time a session is created.
+    """
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 4, rotate_user_agent: bool = False, **options):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.rotate_user_agent = rotate_user_agent
+        self.options = options
+        self.cache = None
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def get(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = create_session_with_retries(
+                cache=self.cache, pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                rotate_user_agent=self.rotate_user_agent, **self.options
+            )
+            with self.lock:
+                for thread in [thread for thread in self.sessions if not thread.is_alive()]:
+                    self.sessions.pop(thread).close()
+                self.sessions[threading.current_thread()] = session
+        return session
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+    def enable_cache(self, cache: HttpCache | None):
+        """Turns the HTTP cache on (or off with None) for existing and future sessions."""
+        with self.lock:
+            self.cache = cache
+            for session in self.sessions.values():
+                enable_cache(session, cache)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+        self.local = threading.local()
+
+
+SESSIONS = SessionPool()
+
+
+def get_session():
+    """The session of the calling thread."""
+    return SESSIONS.get()
+
+
+def __getattr__(name: str):
+    # `SESSION` used to be built on import, it is now the session of the accessing thread, made on first use
+    if name == 'SESSION':
+        return get_session()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+DOWNLOAD_PATH = os.environ.get('PINTEREST_SCRAPPER_PATH') or os.path.join(os.path.split(os.path.split(__file__)[0])[0], 'Pintrest Scrapper')
 LOG_PATH = os.path.join(DOWNLOAD_PATH, 'Logs')
+CACHE_PATH = os.path.join(DOWNLOAD_PATH, 'Cache')
@@ -0,0 +1,309 @@
+from .commons import USER_BOARDS_RESOURCE, USER_PIN_RESOURCE, BOARD_RESOURCE, get_session
+from .parser_methods import return_resource
+from .checkpoint_methods import CrawlCheckpoint
+from .delta_methods import known_pin_ids, previous_boards, board_unchanged
+from .stream_methods import CREATED_BOARD
+from .metrics_methods import METRICS
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import asyncio, json, time, logging
+
+DEFAULT_CONCURRENCY = 8
+
+
+def created_pins_url(user_info: dict, bookmark: str | None = None):
+    params = {
+        'source_url': f'/{user_info["username"]}/_created',
+        'data': json.dumps({
+            'options': {
+                'exclude_add_pin_rep': True,
+                'field_set_key': 'grid_item',
+                'user_id': str(user_info['id']),
+                'username': user_info['username'],
+                'bookmarks': [bookmark]
+            },
+            'context': {}
+        }),
+        '_': int(time.time())
+    }
+    return f'{USER_PIN_RESOURCE}?{urlencode(params, doseq=True)}'
+
+
+def boards_url(user_info: dict, bookmark: str | None = None):
+    params = {
+        'source_url': f'/{user_info["username"]}/',
+        'data': json.dumps({
+            'options': {
+                'field_set_key': 'profile_grid_item',
+                'filter_stories': False,
+                'sort': 'last_pinned_to',
+                'username': user_info['username'],
+                'bookmarks': [bookmark]
+            },
+            'context': {}
+        }),
+        '_': int(time.time())
+    }
+    return f'{USER_BOARDS_RESOURCE}?{urlencode(params, doseq=True)}'
+
+
+def board_pins_url(board: dict, bookmark: str | None = None):
+    params = {
+        'source_url': board['url'],
+        'data': json.dumps({
+            'options': {
+                'board_id': str(board['id']),
+                'board_url': board['url'],
+                'sort': 'default',
+                'page_size': 25,
+                'currentFilter': -1,
+                'filter_stories': False,
+                'bookmarks': [bookmark]
+            },
+            'context': {}
+        }),
+        '_': int(time.time())
+    }
+    return f'{BOARD_RESOURCE}?{urlencode(params, doseq=True)}'
+
+
+def board_headers(board: dict):
+    headers = {key: value for key, value in get_session().headers.items()}
+    headers.update({
+        'X-Pinterest-PWS-Handler': 'www/[username]/[slug].js',
+        'X-Pinterest-Source-Url': board['url'],
+    })
+    return headers
+
+
+class PinterestCrawler:
+    """
+    Asynchronous crawler for the Pinterest resource endpoints.
+
+    Pages of a single feed are still fetched one after another (every page needs the
+    previous bookmark), but feeds are independent of each other, so the created pins and
+    every board are paged concurrently, at most `concurrency` requests in flight.
+
+    With a `checkpoint` every received page is persisted, and feeds resume from their last bookmark.
+    With `previous` (the last saved document of the user) only the pins newer than it are fetched:
+    unchanged boards are skipped and paging of the created pins, which are newest first, stops at the first
+    already known pin. Board feeds are not sorted by pin time, changed boards are fetched completely.
+    With a `sink` (see stream_methods.StreamSink) boards and pages are handed over as they arrive,
+    and with `collect=False` pins are not kept in memory at all. Sink and checkpoint calls run in order on
+    their own thread (see to_sink), a sink doing I/O or holding back a fast crawl only pauses the feeds
+    waiting for it, never the event loop.
+    With an `archive` (see archive_methods.ResponseArchive) every raw response is archived for replays.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, verbose: bool = True, null_retries: int = 3,
+                 checkpoint: CrawlCheckpoint | None = None, previous: dict | None = None, sink=None, collect: bool = True,
+                 archive=None):
+        self.concurrency = max(1, concurrency)
+        self.verbose = verbose
+        self.null_retries = null_retries
+        self.checkpoint = checkpoint
+        self.previous = previous
+        self.previous_boards = previous_boards(previous)
+        self.sink = sink
+        self.collect = collect
+        self.archive = archive
+        self.incomplete = set()
+        self._executor = None
+        self._sink_executor = None
+        self._semaphore = None
+        self._loop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._sink_executor:
+            # Whatever a sink already got is written before the crawl counts as over
+            self._sink_executor.shutdown(wait=True)
+            self._sink_executor = None
+
+    def log(self, message: str):
+        if self.verbose:
+            print(message.expandtabs(4))
+
+    def run(self, coroutine):
+        """Runs a crawl coroutine to completion from blocking code."""
+        return asyncio.run(coroutine)
+
+    def _get_semaphore(self):
+        # Semaphores bind to the running loop, a new one is needed for every `asyncio.run`
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    async def fetch(self, url: str, headers: dict | None = None):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='crawler')
+
+        async with self._get_semaphore():
+            METRICS.add('crawl_in_flight', 1)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, return_resource, url, headers, self.archive)
+            finally:
+                METRICS.add('crawl_in_flight', -1)
+
+    async def to_sink(self, function, *args):
+        """Runs `function(*args)`, a sink or checkpoint call, on the single sink thread, so the calls keep their order."""
+        if self._sink_executor is None:
+            self._sink_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='crawler-sink')
+        return await asyncio.get_running_loop().run_in_executor(self._sink_executor, function, *args)
+
+    async def paginate(self, make_url, headers: dict | None = None, items: list | None = None, label: str = '', total=None, key: str | None = None, stop_ids: set | None = None, on_page=None, collect: bool = True):
+        """
+        Follows the bookmarks of one feed until it is exhausted, or until a page contains one of `stop_ids`.
+        Every page is appended to `items` (unless `collect` is False) and passed to `on_page` as soon as it
+        arrives, so a cancelled crawl keeps what it already has.
+        `key` identifies the feed in the checkpoint.
+        """
+        items = [] if items is None else items
+        bookmark = None
+        count, null_count, scraped = 1, 0, 0
+
+        if self.checkpoint and key:
+            bookmark, pages, done = await self.to_sink(self.checkpoint.state, key)
+            if pages:
+                scraped += await self.to_sink(self._restore, key, items, on_page, collect)
+            count += pages
+            if done:
+                self.log(f'\t|--------> [{label}] {scraped} restored from checkpoint.')
+                return items
+            if pages:
+                self.log(f'\t|--------> [{label}] Resuming after page {pages} ({scraped} restored)...')
+
+        while True:
+            resource = await self.fetch(make_url(bookmark), headers)
+
+            if not resource:
+                null_count += 1
+                if null_count > self.null_retries:
+                    self.log(f'\t|--------> [{label}] Recieved Null Data, giving up!')
+                    self.incomplete.add(key or label)
+                    break
+                self.log(f'\t|--------> [{label}] Recieved Null Data, Continuing...')
+                continue
+            null_count = 0
+
+            page = resource.get('data') or []
+            reached_known = False
+            if stop_ids:
+                new_page = [item for item in page if not (isinstance(item, dict) and str(item.get('id')) in stop_ids)]
+                reached_known = len(new_page) != len(page)
+                page = new_page
+            if on_page and page:
+                await self.to_sink(on_page, page)
+            if collect:
+                items.extend(page)
+            scraped += len(page)
+            self.log(f'\t|--------> [{label}] {count}. {scraped} scraped out of {total} total...')
+
+            new_bookmark = resource.get('bookmark')
+            done = reached_known or not new_bookmark or new_bookmark == bookmark
+            if self.checkpoint and key:
+                await self.to_sink(self.checkpoint.save_page, key, count, page, None if done else new_bookmark, done)
+            if done:
+                break
+            bookmark = new_bookmark
+            count += 1
+
+        return items
+
+    def _restore(self, key: str, items: list, on_page, collect: bool):
+        """Hands the checkpointed pages of a feed to `on_page` one by one, returns how many items they had."""
+        restored = 0
+        for page in self.checkpoint.iter_pages(key):
+            if on_page and page:
+                on_page(page)
+            if collect:
+                items.extend(page)
+            restored += len(page)
+        return restored
+
+    async def guarded(self, coroutine, key: str, label: str):
+        """Runs the crawl of one feed, a feed that fails is marked incomplete instead of failing the others."""
+        try:
+            return await coroutine
+        except Exception as e:
+            logging.error(f'[{label}] Crawl failed: {e} [{e.__class__.__name__}]')
+            self.log(f'\t|--------> [{label}] Failed: {e} [{e.__class__.__name__}]')
+            self.incomplete.add(key)
+
+    async def crawl_created_pins(self, user_info: dict, pins: list | None = None):
+        self.log(f'----# Scraping created pins for user: {user_info["username"]}...')
+        pins = await self.paginate(
+            lambda bookmark: created_pins_url(user_info, bookmark),
+            items=pins, label='created', total=user_info.get('pin_count'), key='created',
+            stop_ids=known_pin_ids(self.previous.get('created')) if self.previous else None,
+            on_page=(lambda page: self.sink.pins(CREATED_BOARD, page)) if self.sink else None,
+            collect=self.collect
+        )
+        self.log(f'----# Completed scraping created pins for {user_info["username"]}.')
+        return pins
+
+    async def crawl_boards(self, user_info: dict):
+        """Lists the boards of a user without their pins."""
+        self.log(f'----# Scraping boards for user: {user_info["username"]}...')
+        boards = await self.paginate(
+            lambda bookmark: boards_url(user_info, bookmark),
+            label='boards', total=user_info.get('board_count'), key='boards'
+        )
+        return [board for board in boards if isinstance(board, dict) and board.get('type') == 'board']
+
+    async def crawl_board(self, board: dict, boards: list | None = None):
+        """Returns a copy of `board` with all of its pins under the `pins` key."""
+        orig_board = {key: value for key, value in board.items()}
+        orig_board['pins'] = []
+        if boards is not None:
+            boards.append(orig_board)
+        if self.sink:
+            await self.to_sink(self.sink.board, orig_board)
+
+        previous_board = self.previous_boards.get(str(board['id']))
+        if self.previous and board_unchanged(previous_board, board):
+            self.log(f'\t+----$ Board "{board.get("name")}" is unchanged since the last scrape, skipping.')
+            return orig_board
+
+        self.log(f'\t+----$ Adding pins to board "{board.get("name")}"...')
+        await self.paginate(
+            lambda bookmark: board_pins_url(board, bookmark),
+            board_headers(board), items=orig_board['pins'], label=board.get('name'), total=board.get('pin_count'),
+            key=f'board:{board["id"]}',
+            on_page=(lambda page: self.sink.pins(board['id'], page)) if self.sink else None,
+            collect=self.collect
+        )
+        self.log(f'\t+----$ Completed scraping board: {board.get("name")}.')
+        return orig_board
+
+    async def crawl_all_boards(self, user_info: dict, boards: list | None = None):
+        boards = [] if boards is None else boards
+        listed = await self.crawl_boards(user_info)
+        await asyncio.gather(*(self.guarded(self.crawl_board(board, boards), f'board:{board["id"]}', board.get('name')) for board in listed))
+        self.log(f'----# Completed scraping {len(boards)} boards with pins.')
+        return boards
+
+    async def crawl_user(self, user_info: dict, created_pins: list | None = None, boards: list | None = None):
+        """Crawls the created pins and every board of a user at the same time."""
+        created_pins = [] if created_pins is None else created_pins
+        boards = [] if boards is None else boards
+        if self.sink:
+            await self.to_sink(self.sink.user, user_info)
+        await asyncio.gather(
+            self.guarded(self.crawl_created_pins(user_info, created_pins), 'created', 'created'),
+            self.guarded(self.crawl_all_boards(user_info, boards), 'boards', 'boards')
+        )
+        if self.checkpoint and not self.incomplete:
+            await self.to_sink(self.checkpoint.mark_done, 'user')
+        return created_pins, boards
@@ -0,0 +1,63 @@
+from . import codec_methods as codec
+
+import os, logging
+
+
+def load_previous_document(path: str):
+    """Returns the previously saved document of a user or None if there is no usable one."""
+    if not os.path.exists(path):
+        return None
+    try:
+        data = codec.load_file(path)
+    except Exception as e:
+        logging.error(f'Unable to load previous scrape {path}: {e} [{e.__class__.__name__}]')
+        return None
+    return data if isinstance(data, dict) and data.get('scraped_at') else None
+
+
+def known_pin_ids(pins: list):
+    return {str(pin.get('id')) for pin in pins or [] if pin and pin.get('id') is not None}
+
+
+def previous_boards(previous: dict | None):
+    return {str(board.get('id')): board for board in (previous or {}).get('boards') or [] if board}
+
+
+def board_unchanged(previous_board: dict | None, board: dict):
+    """
+    A board is unchanged when its pin count and its modification time are the same as in the previous scrape.
+    Without a modification time on either side (older documents) it counts as changed: the same pin count
+    does not tell a board with one pin added and one removed from an untouched one.
+    """
+    if not previous_board:
+        return False
+    if previous_board.get('total_pins') != board.get('pin_count'):
+        return False
+    modified_at = previous_board.get('modified_at')
+    return bool(modified_at) and modified_at == board.get('board_order_modified_at')
+
+
+def merge_pins(new_pins: list, old_pins: list):
+    """New pins first (the feeds are newest first), then the old ones that were not fetched again."""
+    seen = known_pin_ids(new_pins)
+    return list(new_pins) + [pin for pin in old_pins or [] if pin and str(pin.get('id')) not in seen]
+
+
+def merge_documents(previous: dict, fresh: dict):
+    """
+    Merges a delta scrape into the previous document.
+    Boards that are no longer listed are dropped, pins removed from Pinterest are kept.
+    """
+    merged = dict(fresh)
+    merged['created'] = merge_pins(fresh.get('created') or [], previous.get('created'))
+    merged['total_created_pins'] = len(merged['created'])
+
+    old_boards = previous_boards(previous)
+    boards = []
+    for board in fresh.get('boards') or []:
+        old_board = old_boards.get(str(board.get('id')))
+        if old_board:
+            board = dict(board, pins=merge_pins(board.get('pins') or [], old_board.get('pins')))
+        boards.append(board)
+    merged['boards'] = boards
+    return merged
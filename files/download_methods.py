@@ -1,28 +1,61 @@
 import os
 import logging
-import uuid
-import subprocess as sp
-from .parser_methods import DotDict
-from .util_methods import clear
-from concurrent.futures import ThreadPoolExecutor, as_completed, wait
-from .commons import DOWNLOAD_PATH, SESSION, LOG_PATH
-import time
+import threading
+from .model_methods import User, Board, Pin, as_user, as_board, as_pin
+from .store_methods import BlobStore, STORE_DIRNAME
+from .manifest_methods import DownloadManifest
+from .shard_methods import ShardStore, SHARD_DIRNAME
+from .transfer_methods import stream_download, TooLarge, TIMEOUT, CHUNK_SIZE as TRANSFER_CHUNK_SIZE
+from .hls_methods import download_hls, run_ffmpeg, HlsUnsupported
+from .quality_methods import QualityPolicy, DEFAULT_POLICY, is_hls, sniff_extension
+from .stream_methods import iter_records, CREATED_BOARD
+from .scheduler_methods import DownloadScheduler
+from .util_methods import NameRegistry
+from .metrics_methods import METRICS
+from .global_index_methods import GlobalMediaIndex, shared_media_index
+from .commons import DOWNLOAD_PATH, SESSIONS, LOG_PATH, get_cache
+from urllib.parse import urlparse
 import re
 
 
 class PinterestDownloader:
-    def __init__(self):
-        self.session = None
+    def __init__(self, policy: QualityPolicy | None = None, media_index: GlobalMediaIndex | bool | None = None, shard_bytes: int | None = None,
+                 host_limits: dict | None = None):
+        """
+        `media_index` is the index of media shared between accounts, the process wide one by default, False for none.
+        With `shard_bytes` media is packed into tar shards of about that size (see shard_methods.ShardStore)
+        instead of one file per pin, the manifest then tells where in which shard every pin is.
+        `host_limits` caps the downloads at once per host suffix, scheduler_methods.HOST_LIMITS by default.
+        """
+        self.policy = policy or DEFAULT_POLICY
+        self.media_index = media_index
+        self.shard_bytes = shard_bytes
+        self.host_limits = host_limits
+        self.sessions = SESSIONS
         self.root_path = None
+        self.store = None
+        self.manifest = None
+        self.skipped = 0
+        self.scheduler = None
+        self.names = NameRegistry()
+        self.index = None
         self.is_windows = os.name == 'nt'
         self.max_workers = 50
 
+    @property
+    def session(self):
+        """The session of the calling worker thread."""
+        return self.sessions.get()
+
     def __download_file__(self, url: str, filename: str):
+        """Downloads `url` to `filename` plus the extension of what was actually received."""
+        info = {}
         try:
-            with open(filename, 'wb') as file:
-                content = self.session.get(url).content
-                file.write(content)
-                return len(content)
+            size = stream_download(self.session, url, filename, info=info)
+            if not size:
+                return 0
+            os.replace(filename, filename + sniff_extension(filename, info.get('content_type'), url))
+            return size
         except Exception as e:
             logging.error(f'Error Downlaoding a anoynomus file from \"{url}\" [name: {filename}]: {e.args} [{e.__class__.__name__}]')
             return 0
@@ -35,104 +68,181 @@ class PinterestDownloader:
             datefmt="%Y-%m-%d %H:%M:%S"
         )        
 
+    def __revalidate__(self, url: str, body_path: str | None = None, info: dict | None = None):
+        """
+        With the HTTP cache on, a stored file is only reused after the server confirmed it with a 304.
+        A 200 brings the new content along, with `body_path` it is kept there (and noted in `info`) instead of
+        being requested a second time.
+        """
+        cache = get_cache(self.session, url)
+        headers = cache.validators(url) if cache else {}
+        if not headers:
+            return True
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code == 200 and body_path:
+                    with open(body_path, 'wb') as file:
+                        for chunk in response.iter_content(TRANSFER_CHUNK_SIZE):
+                            file.write(chunk)
+                    if info is not None:
+                        info['revalidated'] = body_path
+                        info['content_type'] = response.headers.get('Content-Type')
+                return response.status_code == 304
+        except Exception as e:
+            logging.warning(f'Unable to revalidate {url}, using the stored file: {e} [{e.__class__.__name__}]')
+            if body_path and os.path.exists(body_path):
+                os.remove(body_path)
+            return True
+
     @staticmethod
-    def __get_title_or_id__(obj):
-        return obj.title or obj.name or str(obj.id)
-
-    def __download_m3u8__(self, m3u8_url: str, filename: str, filepath: str):
-        # make noice filename
-        filename = os.path.splitext(filename)[0]
- 
-        if not os.path.exists(filepath):
-            os.makedirs(filepath)
-        
-        random_filename = str(uuid.uuid4())  + '.mp4' # Use uuid for random unique filenames
-        random_filepath = os.path.join(filepath, random_filename)
-
-        # Downloads temp file
-        def download(url: str, filename: str):
-            cmd = [
-                'ffmpeg',
-                '-i', url,
-                '-codec', 'copy',
-                '-hide_banner', '-y', '-log_level', 'warning', '-f', 'mp4',
-                filename
-            ]
-            output = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
-            if output.returncode != 0:
-                logging.error(f"FFmpeg error: {output.stderr}")
-            return output.returncode == 0
-        
-        if not download(m3u8_url, random_filepath):
-            logging.error(f"Download failed for {m3u8_url}.")
-            if os.path.exists(random_filepath):
-                try:
-                    os.remove(random_filepath)
-                except Exception as e:
-                    logging.error(f'Unable to delete {random_filepath}: {e}')
-            return 0
-    
+    def __get_title_or_id__(obj: Pin | Board):
+        # Boards have no title, only pins do
+        return obj.get('title') or obj.name or str(obj.id)
+
+    def __fetch_hls__(self, m3u8_url: str, temp_path: str):
         try:
-            original_filepath = os.path.join(filepath, self.__get_unique_name__(filepath, filename) + '.mp4')
-            os.rename(random_filepath, original_filepath)
+            return download_hls(self.sessions, m3u8_url, temp_path, max_width=self.policy.max_width)
+        except HlsUnsupported as e:
+            logging.info(f'Letting ffmpeg fetch {m3u8_url}: {e}')
         except Exception as e:
-            logging.error(f'Unable to rename {random_filepath}: {e}')
+            logging.error(f'Unable to fetch the segments of {m3u8_url}: {e} [{e.__class__.__name__}]')
+            return False
+
+        ok, stderr = run_ffmpeg([
+            'ffmpeg',
+            '-i', m3u8_url,
+            '-codec', 'copy',
+            '-hide_banner', '-y', '-loglevel', 'warning', '-f', 'mp4',
+            temp_path
+        ])
+        if not ok:
+            logging.error(f"FFmpeg error: {stderr}")
+        return ok
+
+    def __download_media__(self, candidates: list, filename: str, download_path: str, pin_id=None):
+        """
+        Stores the first of `candidates` (images or videos, best first) that fits the quality policy and
+        links it into `download_path` with the extension of its actual content, packed media is only recorded there.
+        Media another account already downloaded is linked from there instead of being requested again.
+        """
+        if not candidates:
             return 0
-
-        if os.path.exists(original_filepath):
-            return os.path.getsize(original_filepath)
-        else:
+        packed = self.store.packed
+        if not packed:
+            os.makedirs(download_path, exist_ok=True)
+
+        max_bytes = self.policy.max_bytes
+        info = {}
+
+        # Downloads into a temp file of the store
+        def download(temp_path: str):
+            revalidated = info.pop('revalidated', None)
+            if revalidated:
+                os.replace(revalidated, temp_path)
+                info['fetched'] = True
+                return True
+            if self.media_index and self.media_index.link(key, temp_path):
+                return True
+            for media in candidates:
+                if is_hls(media.url):
+                    info['fetched'] = self.__fetch_hls__(media.url, temp_path)
+                    return info['fetched']
+                try:
+                    # The last candidate is the smallest there is, it is taken whatever its size
+                    limit = max_bytes if media is not candidates[-1] else None
+                    info['fetched'] = stream_download(self.session, media.url, temp_path, max_bytes=limit, info=info) is not None
+                    return info['fetched']
+                except TooLarge as e:
+                    logging.info(f'{e}, trying a smaller variant')
+            return False
+
+        url = candidates[0].url
+        key = self.__media_key__(candidates)
+
+        # The body of a 200 is only what is stored for `key` when the key is the plain url, see __media_key__
+        def revalidate(key: str):
+            body_path = f'{self.store.temp_path(key)}.{threading.get_ident()}' if key == url else None
+            return self.__revalidate__(url, body_path, info)
+
+        # Media shared between boards is fetched once and linked into every board folder
+        entry = self.store.get(key, download, None if is_hls(url) else revalidate)
+        # A revalidated body nobody needed, another worker stored the key meanwhile
+        leftover = info.pop('revalidated', None)
+        if leftover and os.path.exists(leftover):
+            os.remove(leftover)
+        if not entry:
+            logging.error(f"Download failed for {url}.")
+            if pin_id is not None:
+                self.manifest.record_failure(download_path, pin_id, key)
             return 0
+        # Also fills the index with what the stores of earlier runs already hold, shards have no file to link from
+        if self.media_index and not packed and (info.get('fetched') or key not in self.media_index):
+            self.media_index.add(key, self.store.blob_path(entry[0]), entry[0], entry[1], pin_id)
 
-    def __download_videos__(self, pin_data: dict, download_path: str):
-        data = pin_data if isinstance(pin_data, DotDict) else DotDict(pin_data)
+        shard = offset = name = None
+        try:
+            extension = self.store.extension(entry[0], info.get('content_type'), url)
+            name = self.__get_unique_name__(download_path, filename, extension)
+            destination = os.path.join(download_path, name + extension)
+            if packed:
+                shard, offset = self.store.locate(entry[0])
+            else:
+                self.store.link(entry[0], destination)
+        except Exception as e:
+            logging.error(f'Unable to link {url} into {download_path}: {e}')
+            # Nothing was written under the name, the next file of the folder gets it
+            if name is not None:
+                self.names.release(download_path, name, extension)
+            return 0
 
-        for video in data.videos:
-            if not video.get('url', '').endswith('.m3u8'):
-                continue
-            return self.__download_m3u8__(video.url, self.__get_title_or_id__(data) + '.mp4', download_path)
+        if pin_id is not None:
+            self.manifest.record(download_path, pin_id, destination, entry[1], entry[0], key, shard, offset)
+        return entry[1]
 
-    def __download_images__(self, pin_data: str, download_path: str):
-        data = pin_data if isinstance(pin_data, DotDict) else DotDict(pin_data)
+    def __media_key__(self, candidates: list):
+        """The store key of what `__download_media__` downloads for `candidates`."""
+        url = candidates[0].url
+        max_bytes = self.policy.max_bytes
+        return f'{url}#max_bytes={max_bytes}' if max_bytes and len(candidates) > 1 else url
 
-        if not os.path.exists(download_path):
-            os.makedirs(download_path)
+    def __download_videos__(self, pin_data: dict, download_path: str):
+        data = as_pin(pin_data)
+        return self.__download_media__(self.policy.video_candidates(data), self.__get_title_or_id__(data), download_path, data.id)
 
-        with open(os.path.join(download_path, self.__get_unique_name__( download_path, self.__get_title_or_id__(data)) + '.png'), 'wb') as file:
-            content = self.session.get(data.images.orig.url).content
-            file.write(content)
-            return len(content)
+    def __download_images__(self, pin_data: dict, download_path: str):
+        data = as_pin(pin_data)
+        return self.__download_media__(self.policy.image_candidates(data), self.__get_title_or_id__(data), download_path, data.id)
 
     def download_profile(self, userinfo: dict):
-        data = userinfo if isinstance(userinfo, DotDict) else DotDict(userinfo)
+        data = as_user(userinfo)
         total_size = 0
 
-        def download_type(type: str, download_path: str, url: str):
+        def download_type(type: str, download_path: str, url: str, name: str):
             nonlocal total_size
             
             print(f'--------> Downloading {type} in {download_path}...')
-            size = self.__download_file__(url, os.path.join(download_path, data.username + '_avatar.png'))
+            size = self.__download_file__(url, os.path.join(download_path, f'{data.username}_{name}'))
             total_size += size
             print(f'--------> Downloaded {type} in {download_path}! [{size/(1024):.2f}KB]')
 
-        print(f"----$ Downloading {data.name if hasattr(data, 'name') else data.username} profile cover (banner/pfp)...")
+        print(f"----$ Downloading {data.name or data.username} profile cover (banner/pfp)...")
         download_path = os.path.join(self.root_path, data.username)
         os.makedirs(download_path, exist_ok=True)
         if data.large_pfp:
-            download_type('pfp', download_path, data.large_pfp)
+            download_type('pfp', download_path, data.large_pfp, 'avatar')
         elif data.pfp:
-            download_type('pfp', download_path, data.pfp)
+            download_type('pfp', download_path, data.pfp, 'avatar')
         
-        if data.profile_cover.images.originals.url:
-            download_type('banner', download_path, data.profile_cover.images.originals.url)
+        if data.banner_url:
+            download_type('banner', download_path, data.banner_url, 'banner')
         
         return total_size
 
     def download_pin(self, pin_data: dict, download_path: str, video: bool = False):
         
-        pin = pin_data if isinstance(pin_data, DotDict) else DotDict(pin_data)
+        pin = as_pin(pin_data)
         pin_size = 0
-        if not os.path.exists(download_path):
+        if not self.store.packed and not os.path.exists(download_path):
             os.makedirs(download_path)        
 
         print(f'\t|---> Downloading {self.__get_title_or_id__(pin)}...'.expandtabs(4), end='\n')
@@ -145,100 +255,167 @@ class PinterestDownloader:
         print(f'\t|---> Downloaded {self.__get_title_or_id__(pin)}! [{pin_size/1024:.2f}KB]'.expandtabs(4), end='\n')
         return pin_size
 
-    def download_board(self, board_data: dict):
-        
-        data = board_data if isinstance(board_data, DotDict) else DotDict(board_data)
-        
+    def __pin_host__(self, pin: Pin, video: bool):
+        media = self.policy.choose_video(pin) if video else self.policy.choose_image(pin)
+        return urlparse(media.url).hostname if media else None
+
+    def __download_indexed_pin__(self, pin: Pin, download_path: str, video: bool, board_id):
+        size = self.download_pin(pin, download_path, video)
+        if size:
+            self.index.mark_downloaded(board_id, pin.id)
+        return size
+
+    def __is_complete__(self, pin: Pin, download_path: str, video: bool):
+        """True if the manifest has the pin's file in `download_path` from the media the policy picks now."""
+        candidates = self.policy.video_candidates(pin) if video else self.policy.image_candidates(pin)
+        return bool(candidates) and self.manifest.completed(download_path, pin.id, self.__media_key__(candidates)) is not None
+
+    def queue_pin(self, pin_data: dict, download_path: str, board_id=None):
+        """
+        Pins the manifest has as completed are skipped, None is returned for them like for pins without media.
+        With a metadata index and the `board_id` the pin is marked as downloaded in the index once it is.
+        """
+        pin = as_pin(pin_data)
+        if (not pin.videos) and (not pin.images):
+            return None
+        video = self.policy.choose_video(pin) is not None
+        if self.__is_complete__(pin, download_path, video):
+            self.skipped += 1
+            if self.index is not None and board_id is not None:
+                self.index.mark_downloaded(board_id, pin.id)
+            return None
+        if self.index is not None and board_id is not None:
+            return self.scheduler.submit(self.__pin_host__(pin, video), self.__download_indexed_pin__, pin, download_path, video, board_id)
+        return self.scheduler.submit(self.__pin_host__(pin, video), self.download_pin, pin, download_path, video)
+
+    def queue_board(self, board_data: dict):
+        """Feeds every pin of a board into the shared scheduler."""
+        data = as_board(board_data)
+
         if not data.pins:
             raise ValueError(f"{self.__get_title_or_id__(data)} doesn't have any pins!")
-        
-        clear()
-
-        download_path = os.path.join(self.root_path, self.__sanitize_filename__(self.__get_title_or_id__(data)) if self.is_windows else (self.__get_title_or_id__(data)))
-        print(f'----$ Downloading {self.__get_title_or_id__(data)} in ./{os.path.split(download_path)[1]}')
-        board_size = 0
 
-        images, videos = [], []
+        download_path = self.__board_path__(data)
+        print(f'----$ Queueing {len(data.pins)} pins of {self.__get_title_or_id__(data)} for ./{os.path.split(download_path)[1]}')
         for pin in data.pins:
-            if pin.videos:
-                videos.append(pin)
-            elif pin.images:
-                images.append(pin)
-
-        # First download images
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future = []
-
-            for image in images:
-                future.append(executor.submit(self.download_pin, image, download_path, False))
-                
-            # Ensure all pins are downloaded!
-            for f in as_completed(future):
-                board_size += f.result()
-
-            time.sleep(2)
-        
-        # 2nd Download Videos
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future = []
-
-            for video in videos:
-                future.append(executor.submit(self.download_pin, video, download_path, True))
-                
-            # Ensure all pins are downloaded!
-            for f in as_completed(future):
-                board_size += f.result()
-
-            time.sleep(2)
-
-        time.sleep(1.3)
+            self.queue_pin(pin, download_path)
 
-        return board_size
+    def download_board(self, board_data: dict):
+        own_scheduler = self.scheduler is None
+        if own_scheduler:
+            self.scheduler = DownloadScheduler(self.max_workers, self.host_limits)
+        try:
+            self.queue_board(board_data)
+            return self.scheduler.join()
+        finally:
+            if own_scheduler:
+                self.scheduler.close()
+                self.scheduler = None
 
     def download(self, user_info: dict):
 
-        if not isinstance(user_info, dict):
+        if not isinstance(user_info, (dict, User)):
             return
 
-        data = user_info if isinstance(user_info, DotDict) else DotDict(user_info)
+        data = as_user(user_info)
         self.initialize(data)
 
-        print(f'----# Downloading {data.name if hasattr(data, 'name') else data.username} in {self.root_path}')
+        print(f'----# Downloading {data.name or data.username} in {self.root_path}')
 
         if (not data.created) and (not data.boards):
-            raise ValueError(f"{data.name if hasattr(data, 'name') else data.username} doesn't have any pins and boards to download.")
-        
-        total_size = 0
+            raise ValueError(f"{data.name or data.username} doesn't have any pins and boards to download.")
 
-        # Section 1: Download Created Pin -------------------------------------------------------------------------------------------
-        fake_board = {
-            'title': 'created',
-            'id': 0,
-            'pins': data.created
-        }
-        try:
-            total_size += self.download_board(fake_board)
-        except Exception as e:
-            logging.error(f'[{self.__get_title_or_id__(fake_board)}] Unable to downlaod: {e.args} [{e.__class__.__name__}]')
+        # Created pins and every board share one work queue, workers stay busy across boards
+        fake_board = Board(id=0, name=CREATED_BOARD, pins=data.created)
+        with METRICS.timer('stage_seconds', stage='download'), DownloadScheduler(self.max_workers, self.host_limits) as self.scheduler:
+            for board in [fake_board, *data.boards]:
+                try:
+                    self.queue_board(board)
+                except Exception as e:
+                    logging.error(f'[{self.__get_title_or_id__(board)}] Unable to downlaod: {e.args} [{e.__class__.__name__}]')
+            self.scheduler.join()
+        self.scheduler = None
+        # Everything downloaded for the user so far, this run or an earlier one
+        total_size = self.manifest.total_size()
+        self.close()
+
+        print(f'----# Downloaded {data.name or data.username} in {self.root_path} [{total_size/(1024*1024):.2f}MB{self.__skipped_note__()}]')
+        return total_size
 
+    def download_stream(self, filepath: str):
+        """
+        Downloads a JSON Lines file written by stream_methods.JsonlWriter record by record,
+        so memory stays flat however many pins the account has.
+        """
+        board_paths = {}
+        data = None
+
+        # `submit` blocks while the queue is full, which bounds the number of pins held in memory
+        with METRICS.timer('stage_seconds', stage='download'), DownloadScheduler(self.max_workers, self.host_limits) as self.scheduler:
+            for record in iter_records(filepath):
+                record_type = record.pop('type', None)
+
+                if record_type == 'user':
+                    data = User.from_saved(record, with_pins=False)
+                    self.initialize(data)
+                    board_paths[CREATED_BOARD] = self.__board_path__(Board(id=0, name=CREATED_BOARD))
+                    print(f'----# Downloading {data.name or data.username} in {self.root_path}')
+
+                elif record_type == 'board' and data is not None:
+                    board_paths[str(record.get('id'))] = self.__board_path__(Board.from_saved(record, with_pins=False))
+
+                elif record_type == 'pin' and data is not None:
+                    download_path = board_paths.get(record.pop('board', None))
+                    if download_path:
+                        self.queue_pin(Pin.from_saved(record), download_path)
+
+            total_size = self.scheduler.join()
+        self.scheduler = None
+        self.close()
+
+        if data is not None:
+            print(f'----# Downloaded {data.name or data.username} in {self.root_path} [{total_size/(1024*1024):.2f}MB{self.__skipped_note__()}]')
+        return total_size
+
+    def download_index(self, index, pending_only: bool = True):
+        """
+        Downloads the work list of a metadata index (see index_methods.MetadataIndex), by default only the
+        board pins it has not recorded as downloaded yet, and records every finished one.
+        """
+        data = index.user()
+        if data is None:
+            raise ValueError(f'{index.path} does not have any user to download.')
 
-        # Section 2: Download Boards -------------------------------------------------------------------------------------------------
-        for board in data.boards:
-            try:
-                total_size += self.download_board(board)
-                time.sleep(2)
-            except Exception as e:
-                logging.error(f'[{self.__get_title_or_id__(board)}] Unable to downlaod: {e.args} [{e.__class__.__name__}]')
+        self.initialize(data)
+        self.index = index
+        board_paths = {CREATED_BOARD: self.__board_path__(Board(id=0, name=CREATED_BOARD))}
+        board_paths.update((str(board.id), self.__board_path__(board)) for board in index.boards())
+        print(f'----# Downloading {data.name or data.username} in {self.root_path}')
 
-        # Section 3: Download userinfo ------------------------------------------------------------------------------------------------
-        total_size = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(self.root_path) for file in files if not file.endswith('.json'))
+        queued = 0
+        try:
+            with METRICS.timer('stage_seconds', stage='download'), DownloadScheduler(self.max_workers, self.host_limits) as self.scheduler:
+                for board_id, pin in index.iter_work(pending_only):
+                    download_path = board_paths.get(board_id)
+                    if download_path and self.queue_pin(pin, download_path, board_id) is not None:
+                        queued += 1
+                total_size = self.scheduler.join()
+        finally:
+            self.scheduler = None
+            self.close()
+            self.index = None
+
+        print(f'----# Downloaded {queued} pins of {data.name or data.username} in {self.root_path} [{total_size/(1024*1024):.2f}MB{self.__skipped_note__()}]')
+        return total_size
 
-        print(f'----# Downloaded {data.name if hasattr(data, 'name') else data.username} in {self.root_path} [{total_size/(1024*1024):.2f}MB]')
+    def __board_path__(self, board: Board):
+        name = self.__get_title_or_id__(board)
+        return os.path.join(self.root_path, self.__sanitize_filename__(name) if self.is_windows else name)
 
     @staticmethod
     def __sanitize_filename__(filename: str, max_length: int = 60):
 
-        if isinstance(filename, DotDict):
+        if not isinstance(filename, str):
             filename = "EmptyFile"
 
         reserved_chars = ['<', '>', ':', '"', '/', '\\', '|', '?', '*']
@@ -261,24 +438,36 @@ class PinterestDownloader:
 
         return filename
 
-    def __get_unique_name__(self, target_dir: str, filename: str, filetype: str = '.png'):
+    def __get_unique_name__(self, target_dir: str, filename: str, filetype: str = ''):
         name = self.__sanitize_filename__(filename) if self.is_windows else filename
-        base_name, ext = os.path.splitext(name)
-        counter = 1
-
-        # Check for existing files and generate a unique name if needed
-        while os.path.exists(os.path.join(target_dir, name + filetype)):
-            name = f"{base_name}_{counter}"
-            counter += 1
-
-        return name + ext
+        return self.names.reserve(target_dir, name, filetype)
 
     def initialize(self, userdata: dict):
-        data = userdata if isinstance(userdata, DotDict) else DotDict(userdata)
+        data = as_user(userdata)
 
-        self.session = SESSION
         self.root_path = os.path.join(DOWNLOAD_PATH, data.username, 'downloads')
         self.set_logger(data.username)
 
         os.makedirs(self.root_path, exist_ok=True)
-
+        if self.shard_bytes:
+            self.store = ShardStore(os.path.join(self.root_path, SHARD_DIRNAME), self.shard_bytes)
+        else:
+            self.store = BlobStore(os.path.join(self.root_path, STORE_DIRNAME))
+        self.manifest = DownloadManifest(self.root_path)
+        # Packed downloads have no files in the board folders, the names taken there are in the manifest
+        self.names = NameRegistry(self.manifest.names if self.store.packed else None)
+        self.skipped = 0
+        if self.media_index is None:
+            self.media_index = shared_media_index()
+
+    def __skipped_note__(self):
+        return f', {self.skipped} already downloaded' if self.skipped else ''
+
+    def close(self):
+        """Closes the store and the manifest and writes pending index marks, after the scheduler finished."""
+        if self.store:
+            self.store.close()
+        if self.manifest:
+            self.manifest.close()
+        if self.index is not None:
+            self.index.flush()
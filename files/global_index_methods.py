@@ -0,0 +1,203 @@
+from .commons import DOWNLOAD_PATH
+from .metrics_methods import METRICS
+
+import os, math, atexit, hashlib, logging, shutil, sqlite3, struct, threading, time
+
+GLOBAL_INDEX_PATH = os.path.join(DOWNLOAD_PATH, 'media_index.sqlite')
+DEFAULT_CAPACITY = 1_000_000
+DEFAULT_ERROR_RATE = 0.001
+
+_HEADER = struct.Struct('<QQQ')
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over strings: `key in bloom` is False for every key never added and True for
+    added ones, with about `error_rate` false positives up to `capacity` keys.
+    """
+
+    __slots__ = ('size', 'hashes', 'count', 'bits')
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, error_rate: float = DEFAULT_ERROR_RATE, size: int | None = None, hashes: int | None = None):
+        capacity = max(1, capacity)
+        self.size = size or max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + number * second) % self.size for number in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+    def save(self, path: str):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(_HEADER.pack(self.size, self.hashes, self.count))
+            file.write(self.bits)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, 'rb') as file:
+            size, hashes, count = _HEADER.unpack(file.read(_HEADER.size))
+            bloom = cls(size=size, hashes=hashes)
+            bits = file.read()
+        if len(bits) != len(bloom.bits):
+            raise ValueError(f'{path} is truncated')
+        bloom.bits[:] = bits
+        bloom.count = count
+        return bloom
+
+
+def copy_or_link(source: str, destination: str):
+    """Hardlinks, or copies across file systems, never a symlink that dies with the other account's folder."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class GlobalMediaIndex:
+    """
+    Media downloaded for any account, shared by every account and run.
+
+    The SQLite table maps a media key (the url, see PinterestDownloader.__download_media__) to the blob
+    that holds it and remembers the pin it was downloaded for. A Bloom filter of the keys is kept in memory
+    (and in a sidecar file between runs), so the common case, media nobody downloaded yet, is answered
+    without a query. Media downloaded by another process after the filter was loaded is not seen until the next run.
+    """
+
+    def __init__(self, path: str = GLOBAL_INDEX_PATH, capacity: int = DEFAULT_CAPACITY):
+        self.path = path
+        self.bloom_path = path + '.bloom'
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS media ('
+                'key TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL, path TEXT NOT NULL, '
+                'pin_id TEXT, added_at INTEGER)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS media_pin ON media (pin_id)')
+        self.bloom = self._load_bloom()
+
+    def _load_bloom(self):
+        with self.lock:
+            count = self.connection.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+        try:
+            bloom = BloomFilter.load(self.bloom_path)
+            # Only trusted when nothing was added since it was saved
+            if bloom.count == count and count <= self.capacity:
+                return bloom
+        except (OSError, ValueError, struct.error):
+            pass
+        return self._rebuild(count)
+
+    def _rebuild(self, count: int):
+        while self.capacity < count * 2:
+            self.capacity *= 2
+        bloom = BloomFilter(self.capacity)
+        with self.lock:
+            for (key,) in self.connection.execute('SELECT key FROM media'):
+                bloom.add(key)
+        self.dirty = True
+        return bloom
+
+    def __contains__(self, key: str):
+        """False only for keys that are certainly not indexed."""
+        return key in self.bloom
+
+    def lookup(self, key: str):
+        """`(path, sha256, size)` of the stored media for `key`, None if there is none (or it was deleted since)."""
+        if key not in self.bloom:
+            METRICS.inc('global_index_total', result='miss')
+            return None
+        with self.lock:
+            row = self.connection.execute('SELECT path, sha256, size FROM media WHERE key = ?', (key,)).fetchone()
+        if row and os.path.exists(row[0]):
+            METRICS.inc('global_index_total', result='hit')
+            return row
+        METRICS.inc('global_index_total', result='false_positive' if not row else 'gone')
+        if row:
+            with self.lock, self.connection:
+                self.connection.execute('DELETE FROM media WHERE key = ?', (key,))
+        return None
+
+    def link(self, key: str, destination: str):
+        """Puts the stored media of `key` at `destination` without any request, returns its size or None."""
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        try:
+            copy_or_link(entry[0], destination)
+        except OSError as e:
+            logging.warning(f'Unable to reuse {entry[0]} for {key}: {e}')
+            return None
+        METRICS.inc('global_index_saved_bytes_total', entry[2])
+        return entry[2]
+
+    def add(self, key: str, path: str, digest: str, size: int, pin_id=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO media (key, sha256, size, path, pin_id, added_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, digest, size, os.path.abspath(path), None if pin_id is None else str(pin_id), int(time.time()))
+            )
+            if key not in self.bloom:
+                self.bloom.add(key)
+            self.dirty = True
+        if len(self.bloom) > self.capacity:
+            with self.lock:
+                count = self.connection.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+            self.bloom = self._rebuild(count)
+
+    def pins_seen(self, pin_id):
+        with self.lock:
+            rows = self.connection.execute('SELECT key FROM media WHERE pin_id = ?', (str(pin_id),)).fetchall()
+        return [key for (key,) in rows]
+
+    def close(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            if self.dirty:
+                try:
+                    # Saved with the row count it covers, see _load_bloom
+                    self.bloom.count = self.connection.execute('SELECT COUNT(*) FROM media').fetchone()[0]
+                    self.bloom.save(self.bloom_path)
+                    self.dirty = False
+                except OSError as e:
+                    logging.warning(f'Unable to save {self.bloom_path}: {e}')
+            self.connection.close()
+            self.connection = None
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_media_index():
+    """The process wide GlobalMediaIndex, opened on first use and closed at exit."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = GlobalMediaIndex()
+            atexit.register(_shared.close)
+        return _shared
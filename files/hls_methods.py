@@ -0,0 +1,201 @@
+from .transfer_methods import stream_download, TIMEOUT
+from .metrics_methods import METRICS
+from .commons import SessionPool
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import os, re, shutil, logging, threading
+import subprocess as sp
+
+SEGMENT_WORKERS = 16
+# ffmpeg only remuxes local files now, one process per core is plenty
+REMUX_SLOTS = threading.BoundedSemaphore(max(1, os.cpu_count() or 1))
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+_segment_executor = None
+_segment_executor_lock = threading.Lock()
+
+
+class HlsUnsupported(Exception):
+    """The playlist uses a feature (encryption, byte ranges) this fetcher does not implement."""
+
+
+def parse_attributes(value: str):
+    return {key: item.strip('"') for key, item in ATTRIBUTE_RE.findall(value)}
+
+
+class Playlist:
+    __slots__ = ('variants', 'segments', 'init', 'audio')
+
+    def __init__(self):
+        self.variants = []  # (bandwidth, width, height, url, audio group)
+        self.segments = []
+        self.init = None
+        self.audio = {}  # audio group -> [(default, url)] of renditions with their own playlist
+
+    @property
+    def is_master(self):
+        return bool(self.variants)
+
+
+def parse_playlist(text: str, base_url: str):
+    if not text.lstrip().startswith('#EXTM3U'):
+        raise ValueError('not an m3u8 playlist')
+
+    playlist = Playlist()
+    stream_info = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            stream_info = parse_attributes(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-MEDIA:'):
+            media = parse_attributes(line.split(':', 1)[1])
+            # Renditions without an URI are muxed into the variant streams
+            if media.get('TYPE') == 'AUDIO' and media.get('URI'):
+                playlist.audio.setdefault(media.get('GROUP-ID', ''), []).append(
+                    (media.get('DEFAULT') == 'YES', urljoin(base_url, media['URI']))
+                )
+        elif line.startswith('#EXT-X-MAP:'):
+            playlist.init = urljoin(base_url, parse_attributes(line.split(':', 1)[1]).get('URI', ''))
+        elif line.startswith('#EXT-X-KEY:'):
+            if parse_attributes(line.split(':', 1)[1]).get('METHOD', 'NONE') != 'NONE':
+                raise HlsUnsupported('encrypted segments')
+        elif line.startswith('#EXT-X-BYTERANGE'):
+            raise HlsUnsupported('byte range segments')
+        elif line.startswith('#'):
+            continue
+        elif stream_info is not None:
+            width, _, height = stream_info.get('RESOLUTION', '').partition('x')
+            playlist.variants.append((
+                int(stream_info.get('BANDWIDTH') or 0),
+                int(width) if width.isdigit() else 0,
+                int(height) if height.isdigit() else 0,
+                urljoin(base_url, line),
+                stream_info.get('AUDIO')
+            ))
+            stream_info = None
+        else:
+            playlist.segments.append(urljoin(base_url, line))
+    return playlist
+
+
+def choose_variant(variants: list, max_width: int | None = None):
+    """Highest bandwidth variant not wider than `max_width`, the narrowest one when none fits."""
+    fitting = [variant for variant in variants if not max_width or not variant[1] or variant[1] <= max_width]
+    if not fitting:
+        return min(variants, key=lambda variant: (variant[1], variant[0]))
+    return max(fitting, key=lambda variant: (variant[0], variant[2]))
+
+
+def choose_audio(playlist: Playlist, variant: tuple):
+    """Url of the separate audio rendition a variant plays with (the default one of its group), None if it has none."""
+    renditions = playlist.audio.get(variant[4]) if variant[4] is not None else None
+    if not renditions:
+        return None
+    return max(renditions, key=lambda rendition: rendition[0])[1]
+
+
+def thread_session(session):
+    """`session` itself, or the calling thread's session when given a SessionPool."""
+    return session.get() if isinstance(session, SessionPool) else session
+
+
+def fetch_playlist(session, url: str):
+    response = thread_session(session).get(url, timeout=TIMEOUT)
+    response.raise_for_status()
+    return parse_playlist(response.text, response.url or url)
+
+
+def segment_executor():
+    global _segment_executor
+    with _segment_executor_lock:
+        if _segment_executor is None:
+            _segment_executor = ThreadPoolExecutor(max_workers=SEGMENT_WORKERS, thread_name_prefix='hls')
+        return _segment_executor
+
+
+def download_segments(session, playlist: Playlist, directory: str, retries: int = 3):
+    """Downloads every segment into `directory` in parallel, each with its own retries. Returns the paths in order."""
+    os.makedirs(directory, exist_ok=True)
+    urls = ([playlist.init] if playlist.init else []) + playlist.segments
+    paths = [os.path.join(directory, f'{index:06d}.seg') for index in range(len(urls))]
+
+    def fetch(url: str, path: str):
+        # Finished segments of an interrupted run are kept
+        if os.path.exists(path):
+            return True
+        return stream_download(thread_session(session), url, path, retries=retries) is not None
+
+    results = list(segment_executor().map(fetch, urls, paths))
+    if not all(results):
+        raise IOError(f'{results.count(False)} of {len(results)} segments failed')
+    return paths
+
+
+def concatenate(paths: list, output_path: str):
+    with open(output_path, 'wb') as output:
+        for path in paths:
+            with open(path, 'rb') as segment:
+                shutil.copyfileobj(segment, output, 1024 * 1024)
+
+
+def run_ffmpeg(cmd: list):
+    """Runs ffmpeg in one of the bounded remux slots, returns `(ok, stderr)`."""
+    with REMUX_SLOTS:
+        try:
+            with METRICS.timer('ffmpeg_seconds'):
+                output = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
+        except FileNotFoundError:
+            METRICS.inc('ffmpeg_runs_total', result='missing')
+            return False, 'ffmpeg is not installed'
+    METRICS.inc('ffmpeg_runs_total', result='ok' if output.returncode == 0 else 'failed')
+    return output.returncode == 0, output.stderr
+
+
+def remux(input_path: str, output_path: str, audio_path: str | None = None):
+    """Remuxes the joined segments into an mp4, taking the audio from `audio_path` when the stream has it separately."""
+    inputs = ['-i', input_path] + (['-i', audio_path, '-map', '0:v', '-map', '1:a'] if audio_path else [])
+    return run_ffmpeg(['ffmpeg', *inputs, '-codec', 'copy', '-hide_banner', '-y', '-loglevel', 'warning', '-f', 'mp4', output_path])
+
+
+def fetch_joined(session, playlist: Playlist, directory: str, joined_path: str, retries: int):
+    if not playlist.segments:
+        raise HlsUnsupported('no segments')
+    concatenate(download_segments(session, playlist, directory, retries), joined_path)
+
+
+def download_hls(session, m3u8_url: str, output_path: str, retries: int = 3, max_width: int | None = None):
+    """
+    Downloads an HLS stream into an mp4 at `output_path`: segments are fetched in parallel over `session`
+    (a session or a SessionPool, whose per-thread sessions the segment workers then use),
+    joined locally and only remuxed by ffmpeg. A separate audio rendition of the chosen variant is fetched
+    the same way and muxed in. Raises HlsUnsupported for playlists it can not handle.
+    """
+    playlist = audio_url = None
+    master = fetch_playlist(session, m3u8_url)
+    if master.is_master:
+        variant = choose_variant(master.variants, max_width)
+        playlist, audio_url = fetch_playlist(session, variant[3]), choose_audio(master, variant)
+    else:
+        playlist = master
+
+    segments_path, audio_segments_path = output_path + '.segments', output_path + '.audio'
+    joined_path, joined_audio_path = output_path + '.joined', output_path + '.joined_audio'
+    try:
+        fetch_joined(session, playlist, segments_path, joined_path, retries)
+        if audio_url:
+            fetch_joined(session, fetch_playlist(session, audio_url), audio_segments_path, joined_audio_path, retries)
+        ok, stderr = remux(joined_path, output_path, joined_audio_path if audio_url else None)
+        if not ok:
+            logging.error(f'FFmpeg error: {stderr}')
+            return False
+        shutil.rmtree(segments_path, ignore_errors=True)
+        shutil.rmtree(audio_segments_path, ignore_errors=True)
+        return True
+    finally:
+        for path in (joined_path, joined_audio_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,208 +1,69 @@
-from .commons import SESSION, USER_BOARDS_RESOURCE, USER_PIN_RESOURCE, USER_RESOURCE, BOARD_RESOURCE
-from .parser_methods import DotDict, return_resource
-from .util_methods import clear
+from .commons import USER_RESOURCE
+from .crawl_methods import PinterestCrawler, DEFAULT_CONCURRENCY
+from .checkpoint_methods import CrawlCheckpoint
+from .parser_methods import return_resource
+from .metrics_methods import METRICS
 from urllib.parse import urlencode
 
-import json, time, random
+import json, time
 
-def get_user(user_name: str):
+def get_user(user_name: str, verbose: bool = True, archive=None):
 
-    print(f"----# Fetching user data for: {user_name}...")  # Add start message
+    if verbose:
+        print(f"----# Fetching user data for: {user_name}...")  # Add start message
     params={
         'source_url': f'/{user_name}/',
         'data': json.dumps({'options': {'username': user_name}, 'context': {}}),
         '_': int(time.time())
     }
-    data = return_resource(f'{USER_RESOURCE}?{urlencode(params, doseq=True)}')
-    print(f"----# User data for {user_name} successfully fetched!")  # Success message
-    return data.data
+    data = return_resource(f'{USER_RESOURCE}?{urlencode(params, doseq=True)}', archive=archive)
+    if verbose:
+        print(f"----# User data for {user_name} successfully fetched!")  # Success message
+    user = data.get('data')
+    return user if isinstance(user, dict) else {}
 
-def get_created_pins(user_info: DotDict):
-    print(f"----# Scraping created pins for user: {user_info.username}...")
-    bookmark = None
+def get_created_pins(user_info: dict, concurrency: int = DEFAULT_CONCURRENCY):
     pins = []
-    scraped, count = 0, 1
-
-    while True:
+    with PinterestCrawler(concurrency) as crawler:
         try:
-            params={
-                'source_url': f'/{user_info.username}/_created',
-                'data': json.dumps({
-                    'options': {
-                        'exclude_add_pin_rep': True,
-                        'field_set_key': 'grid_item',
-                        'user_id': str(user_info.id) if not isinstance(user_info.id, str) else user_info.id,
-                        'username': user_info.username,
-                        'bookmarks': [bookmark]
-                    },
-                    'context': {}
-                }),
-                '_': int(time.time())
-            }
-
-            data = return_resource(
-                f"{USER_PIN_RESOURCE}?{urlencode(params, doseq=True)}"
-            )
-
-            if not data:
-                print("\nRecieved Null Data, Continuing...") 
-                continue
-
-            pins.extend(data.data)
-            scraped += len(data.data)
-            print(f'--------> {count}. {scraped} pins scraped out of {user_info.pin_count} total pins...')  # Progress info
-
-            bookmark_n = data.bookmark
-            if not bookmark_n or bookmark_n == bookmark:
-                break
-            bookmark = bookmark_n
-            count += 1
-            time.sleep(1 + random.random())
-
+            crawler.run(crawler.crawl_created_pins(user_info, pins))
         except KeyboardInterrupt:
             print("\n----$ Scraping interrupted. Saving current data...")  # Graceful exit message
-            break
-
-    print(f"\n----# Completed scraping {scraped} created pins for {user_info.username}.")
     return pins
 
-def get_all_boards(userinfo: DotDict):
-    print(f"----# Scraping boards for user: {userinfo.username}...")
-
-    def get_boards_without_pins():
-        bookmark = None
-        count, scraped = 1, 0
-
-        boards = []
-        while True:
-            try:
-                params={
-                    'source_url': f'/{userinfo.username}/',
-                    'data': json.dumps({
-                        "options": {
-                        "field_set_key": "profile_grid_item",
-                        "filter_stories": False,
-                        "sort": "last_pinned_to",
-                        "username": userinfo.username
-                        },
-                        'context': {}
-                    }),
-                    '_': int(time.time())
-                }
-
-                resource = return_resource(
-                    f'{USER_BOARDS_RESOURCE}?{urlencode(params, doseq=True)}'
-                )
-                
-                if not resource:
-                    print("\nRecieved Null Data, Continuing...") 
-                    continue
-
-                for board in resource.data:
-                    if board.type != 'board':
-                        continue
-                    boards.append(board)
-
-                scraped += len(boards)
-                print(f'{count}. {scraped} boards scraped (without pins)... [{userinfo.board_count} boards total]')
-                bookmark_current = resource.bookmark
-                if not bookmark_current or bookmark_current == bookmark:
-                    break
-                bookmark = bookmark_current
-                count += 1
-                time.sleep(1 + random.random())
-
-            except KeyboardInterrupt:
-                print("\nScraping interrupted. Saving current data...")  # Graceful exit message
-                break
-        
-        return boards
-    
-    def get_board_with_pins(board: DotDict):
-        bookmark = None
-        scraped, count = 0, 1
-
-        new_headers = {key: value for key, value in SESSION.headers.items()}
-        new_headers.update(
-            {
-                "X-Pinterest-PWS-Handler": "www/[username]/[slug].js",
-            }
-        )
+def get_boards_without_pins(userinfo: dict, concurrency: int = DEFAULT_CONCURRENCY):
+    with PinterestCrawler(concurrency) as crawler:
+        return crawler.run(crawler.crawl_boards(userinfo))
 
-        orig_board = {key: value for key, value in board.items()}
-        pins = []
-        while True:
-            try:
+def get_board_with_pins(board: dict, concurrency: int = DEFAULT_CONCURRENCY):
+    with PinterestCrawler(concurrency) as crawler:
+        return crawler.run(crawler.crawl_board(board))
 
-                new_headers['X-Pinterest-Source-Url'] = board.url
-
-                params={
-                    'source_url': board.url,
-                    'data': json.dumps({
-                        'options': {
-                            'board_id': str(board.id),
-                            'board_url': board.url,
-                            'sort': 'default',
-                            'page_size': 25,
-                            'currentFilter': -1,
-                            'filter_stories': False,
-                            'bookmarks': [bookmark]
-                        },
-                        'context': {}
-                    }),
-                    '_': int(time.time())
-                }
-
-                resource = return_resource(
-                    f"{BOARD_RESOURCE}?{urlencode(params, doseq=True)}",
-                    new_headers
-                )
-
-                if not resource:
-                    print("\t|--------> Recieved Null Data!".expandtabs(4)) 
-                    break
-
-                pins.extend(resource.data)
-                scraped += len(resource.data)
-                print(f'\t|--------> {count}. {scraped} pins scraped out of {board.pin_count} pins.'.expandtabs(4))  # Progress info
-
-                count += 1
-                new_bookmark = resource.bookmark
-                if not new_bookmark or new_bookmark == bookmark:
-                    print(f"\t|--------> Completed scraping board: {board.name} with {scraped} pins.".expandtabs(4))  # Completed message
-                    break
-                bookmark = new_bookmark
-                time.sleep(1 + random.random())
-            except KeyboardInterrupt:
-                print("\t|--------> Scraping interrupted. Saving current data...".expandtabs(4))
-                break
-        orig_board['pins'] = pins
-        return orig_board
-
-    boards = get_boards_without_pins()
-    clear()
-    new_boards = []
-    try:
-        for idx, board in enumerate(boards):
-            if board.type != "board":
-                continue
-            front_char = '+' if idx != len(boards) else "-"
-            print(f'\t{front_char}----$ Adding pins to board "{board.name}"...'.expandtabs(4))
-            new_board = get_board_with_pins(board)
-            if new_board:
-                new_boards.append(new_board)
-            new_boards.append(new_board)
-            print(f'\t{front_char}----$ Added pins to board "{board.name}"!'.expandtabs(4), end='\n'*2)
-            time.sleep(1 + random.random())
-    except KeyboardInterrupt:
-        print("\nScraping interrupted. Saving current progress...")
-
-        bs = []
-        for board1, board2 in zip(new_boards, boards):
-            if board1 and board1.get('id') == board2.get('id'):
-                bs.append(board1)
-
-        print(f"Partial progress saved. {len(bs)} boards have been processed.")
-
-    print(f"----# Completed scraping {len(new_boards)} boards with pins.")
-    return new_boards
+def get_all_boards(userinfo: dict, concurrency: int = DEFAULT_CONCURRENCY):
+    boards = []
+    with PinterestCrawler(concurrency) as crawler:
+        try:
+            crawler.run(crawler.crawl_all_boards(userinfo, boards))
+        except KeyboardInterrupt:
+            print("\nScraping interrupted. Saving current progress...")
+            print(f"Partial progress saved. {len(boards)} boards have been processed.")
+    return boards
+
+def get_user_pins_and_boards(userinfo: dict, concurrency: int = DEFAULT_CONCURRENCY, checkpoint: CrawlCheckpoint | None = None, previous: dict | None = None, sink=None,
+                             verbose: bool = True, collect: bool | None = None, archive=None):
+    """
+    Scrapes the created pins and all boards of a user concurrently.
+    With a checkpoint, `checkpoint.is_done('user')` tells whether the crawl finished.
+    With `previous` only pins newer than that document are fetched (see PinterestCrawler).
+    With a `sink` everything is streamed into it and the returned lists hold no pins, unless `collect` is True.
+    With an `archive` every raw response is archived (see archive_methods.ArchiveReplay).
+    """
+    collect = sink is None if collect is None else collect
+    created_pins, boards = [], []
+    with METRICS.timer('stage_seconds', stage='scrape'), \
+            PinterestCrawler(concurrency, verbose, checkpoint=checkpoint, previous=previous, sink=sink, collect=collect, archive=archive) as crawler:
+        try:
+            crawler.run(crawler.crawl_user(userinfo, created_pins, boards))
+        except KeyboardInterrupt:
+            print("\n----$ Scraping interrupted. Saving current data...")
+    return created_pins, boards
@@ -0,0 +1,358 @@
+from .commons import DOWNLOAD_PATH
+from .model_methods import User, Board, Pin
+from .stream_methods import CREATED_BOARD, iter_records
+from . import codec_methods as codec
+
+import os, sqlite3, threading, time
+
+# Downloaded pins are written back in batches of this many
+MARK_BATCH = 256
+# Rows read per query when walking the work list
+WORK_CHUNK = 500
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS users ('
+    'username TEXT PRIMARY KEY, id TEXT, generation INTEGER NOT NULL DEFAULT 0, base_generation INTEGER NOT NULL DEFAULT 0, '
+    'pending_generation INTEGER NOT NULL DEFAULT 0, pending_full INTEGER NOT NULL DEFAULT 0, scraped_at INTEGER, data TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS boards ('
+    'id TEXT PRIMARY KEY, position INTEGER, generation INTEGER NOT NULL, name TEXT, url TEXT, total_pins INTEGER, '
+    'modified_at TEXT, data TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS pins ('
+    'id TEXT PRIMARY KEY, title TEXT, created_at TEXT, has_videos INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL, '
+    'first_seen INTEGER NOT NULL, updated_at INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS media ('
+    'pin_id TEXT NOT NULL, kind TEXT NOT NULL, variant TEXT NOT NULL, url TEXT, width INTEGER, height INTEGER, '
+    'PRIMARY KEY (pin_id, kind, variant)) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS board_pins ('
+    'board_id TEXT NOT NULL, pin_id TEXT NOT NULL, generation INTEGER NOT NULL, position INTEGER NOT NULL, downloaded_at INTEGER, '
+    'UNIQUE (board_id, pin_id))',
+    'CREATE INDEX IF NOT EXISTS board_pins_order ON board_pins (board_id, generation DESC, position)',
+    'CREATE INDEX IF NOT EXISTS board_pins_pin ON board_pins (pin_id)',
+    'CREATE INDEX IF NOT EXISTS media_url ON media (url)',
+    'CREATE INDEX IF NOT EXISTS pins_updated ON pins (updated_at)',
+)
+
+
+def media_rows(pin: Pin):
+    rows = [(str(pin.id), 'image', size, image.url, image.width, image.height) for size, image in pin.images.items()]
+    rows.extend((str(pin.id), 'video', str(number), video.url, video.width, video.height) for number, video in enumerate(pin.videos))
+    return rows
+
+
+class MetadataIndex:
+    """
+    Indexed SQLite copy of everything scraped for one user: the user, the boards, the pins, their media
+    variants and which board holds which pin.
+
+    Every scrape is a new generation. It stays pending until `finish` is called for a scrape that ended
+    without missing feeds, then a full scrape moves the base generation up and a delta scrape keeps it.
+    The current state is every board of the last finished generation or newer and every board pin of the
+    base generation or newer, newest generation first and in feed order within one, so an interrupted
+    scrape only adds to what the last finished one left. `export_document` gives back the document
+    `pretty_save_with_correct_data` writes. `shared` is for indexes written from several hosts, like
+    CrawlCheckpoint's.
+    """
+
+    def __init__(self, path: str, shared: bool = False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60 if shared else 5)
+        self.marks = []
+        with self.lock, self.connection:
+            self.connection.execute(f'PRAGMA journal_mode={"DELETE" if shared else "WAL"}')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(users)')}
+            # Indexes written before scrapes had to finish to count
+            for column in ('pending_generation', 'pending_full'):
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE users ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+
+    @staticmethod
+    def path_for(username: str):
+        return os.path.join(DOWNLOAD_PATH, username, username + '.sqlite')
+
+    @classmethod
+    def for_user(cls, username: str, shared: bool = False):
+        os.makedirs(os.path.join(DOWNLOAD_PATH, username), exist_ok=True)
+        return cls(cls.path_for(username), shared)
+
+    @classmethod
+    def exists(cls, username: str):
+        return os.path.exists(cls.path_for(username))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _state(self):
+        row = self.connection.execute('SELECT username, generation, pending_generation FROM users LIMIT 1').fetchone()
+        return row or (None, 0, 0)
+
+    def begin(self, user: User, full: bool = True):
+        """Starts a new pending generation for `user` (without pins), returns it."""
+        data = user.to_dict(with_pins=False)
+        with self.lock, self.connection:
+            _, generation, pending = self._state()
+            # Never reuses the generation of an unfinished scrape, its rows are not part of this one
+            generation = max(generation, pending) + 1
+            self.connection.execute('DELETE FROM users WHERE username != ?', (user.username,))
+            self.connection.execute(
+                'INSERT INTO users (username, id, pending_generation, pending_full, data) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(username) DO UPDATE SET id = excluded.id, pending_generation = excluded.pending_generation, '
+                'pending_full = excluded.pending_full, data = excluded.data',
+                (user.username, str(user.id), generation, int(full), codec.dumps(data))
+            )
+        return generation
+
+    def finish(self, scraped_at: int | None = None, complete: bool = True, generation: int | None = None):
+        """
+        Makes the pending generation (only if it is `generation`, when given) the current one. Nothing changes
+        unless `complete`, an interrupted or partly failed scrape must not hide what the last one found.
+        """
+        if not complete:
+            return
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE users SET generation = MAX(generation, pending_generation), '
+                'base_generation = CASE WHEN pending_full THEN MAX(base_generation, pending_generation) ELSE base_generation END, '
+                'scraped_at = ? WHERE ? IS NULL OR pending_generation = ?',
+                (scraped_at or int(time.time()), generation, generation)
+            )
+
+    def add_boards(self, boards: list, generation: int):
+        """`boards` are (position, Board) pairs, their pins are added with `add_pins`."""
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO boards (id, position, generation, name, url, total_pins, modified_at, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(str(board.id), position, generation, board.name, board.url, board.total_pins, board.modified_at,
+                  codec.dumps(board.to_dict(with_pins=False))) for position, board in boards]
+            )
+
+    def add_pins(self, board_id, pins: list, generation: int, position: int = 0):
+        """Stores one page of `Pin`s of a board (or the created pins) in a single transaction."""
+        now = int(time.time())
+        board_id = str(board_id)
+        pins = [pin for pin in pins if pin.id is not None]
+        if not pins:
+            return
+        data = {str(pin.id): codec.dumps(pin.to_dict()) for pin in pins}
+        with self.lock, self.connection:
+            stored = dict(self.connection.execute(f'SELECT id, data FROM pins WHERE id IN ({",".join("?" * len(data))})', list(data)))
+            # Only pins that are new or differ from the stored copy count as updated
+            changed = [pin for pin in pins if stored.get(str(pin.id)) != data[str(pin.id)]]
+            if changed:
+                self.connection.executemany(
+                    'INSERT INTO pins (id, title, created_at, has_videos, data, first_seen, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(id) DO UPDATE SET title = excluded.title, created_at = excluded.created_at, '
+                    'has_videos = excluded.has_videos, data = excluded.data, updated_at = excluded.updated_at',
+                    [(str(pin.id), pin.title, pin.created_at, int(pin.has_videos), data[str(pin.id)], now, now) for pin in changed]
+                )
+                self.connection.executemany('DELETE FROM media WHERE pin_id = ?', [(str(pin.id),) for pin in changed])
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO media (pin_id, kind, variant, url, width, height) VALUES (?, ?, ?, ?, ?, ?)',
+                    [row for pin in changed for row in media_rows(pin)]
+                )
+            self.connection.executemany(
+                'INSERT INTO board_pins (board_id, pin_id, generation, position) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(board_id, pin_id) DO UPDATE SET generation = excluded.generation, position = excluded.position',
+                [(board_id, str(pin.id), generation, position + offset) for offset, pin in enumerate(pins)]
+            )
+
+    def mark_downloaded(self, board_id, pin_id):
+        """Records a downloaded board pin, written with the next batch."""
+        with self.lock:
+            self.marks.append((int(time.time()), str(board_id), str(pin_id)))
+            if len(self.marks) >= MARK_BATCH:
+                self._flush_marks()
+
+    def _flush_marks(self):
+        if self.marks:
+            with self.connection:
+                self.connection.executemany('UPDATE board_pins SET downloaded_at = ? WHERE board_id = ? AND pin_id = ?', self.marks)
+            self.marks.clear()
+
+    def flush(self):
+        with self.lock:
+            self._flush_marks()
+
+    # Queries
+
+    def user(self):
+        """The indexed `User` without pins, None for an empty index."""
+        with self.lock:
+            row = self.connection.execute('SELECT data, scraped_at FROM users LIMIT 1').fetchone()
+        if not row:
+            return None
+        user = User.from_saved(codec.loads(row[0]), with_pins=False)
+        user.scraped_at = row[1]
+        return user
+
+    def boards(self):
+        """The boards of the last finished generation or newer without pins, in listing order."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT data FROM boards WHERE generation >= (SELECT generation FROM users) ORDER BY position'
+            ).fetchall()
+        return [Board.from_saved(codec.loads(data), with_pins=False) for (data,) in rows]
+
+    def pin(self, pin_id):
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM pins WHERE id = ?', (str(pin_id),)).fetchone()
+        return Pin.from_saved(codec.loads(row[0])) if row else None
+
+    def board_pins(self, board_id):
+        """The current pins of a board (or of `CREATED_BOARD`), without reading any other board."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT pins.data FROM board_pins JOIN pins ON pins.id = board_pins.pin_id '
+                'WHERE board_id = ? AND board_pins.generation >= (SELECT base_generation FROM users) '
+                'ORDER BY board_pins.generation DESC, board_pins.position',
+                (str(board_id),)
+            ).fetchall()
+        return [Pin.from_saved(codec.loads(data)) for (data,) in rows]
+
+    def boards_of_pin(self, pin_id):
+        """Ids of the boards holding a pin, `CREATED_BOARD` for a created pin."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT board_id FROM board_pins WHERE pin_id = ? AND generation >= (SELECT base_generation FROM users)', (str(pin_id),)
+            ).fetchall()
+        return [board_id for (board_id,) in rows]
+
+    def changed_pins(self, since: int):
+        """Ids of the pins added or changed since the unix time `since`."""
+        with self.lock:
+            rows = self.connection.execute('SELECT id FROM pins WHERE updated_at >= ? ORDER BY updated_at', (since,)).fetchall()
+        return [pin_id for (pin_id,) in rows]
+
+    def pins_with_media(self, url: str):
+        with self.lock:
+            rows = self.connection.execute('SELECT DISTINCT pin_id FROM media WHERE url = ?', (url,)).fetchall()
+        return [pin_id for (pin_id,) in rows]
+
+    def counts(self):
+        """Current board pins, how many of them are downloaded and the number of boards."""
+        with self.lock:
+            pins, downloaded = self.connection.execute(
+                'SELECT COUNT(*), COUNT(downloaded_at) FROM board_pins WHERE generation >= (SELECT base_generation FROM users)'
+            ).fetchone()
+            boards = self.connection.execute('SELECT COUNT(*) FROM boards WHERE generation >= (SELECT generation FROM users)').fetchone()[0]
+        return {'pins': pins, 'downloaded': downloaded, 'boards': boards}
+
+    def iter_work(self, pending_only: bool = True):
+        """
+        Yields `(board_id, Pin)` for every current board pin, only the ones not downloaded yet with `pending_only`.
+        Rows are read in chunks and the lock is released between them, so downloads can be marked meanwhile.
+        """
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    'SELECT board_pins.rowid, board_id, pins.data FROM board_pins JOIN pins ON pins.id = board_pins.pin_id '
+                    'WHERE board_pins.rowid > ? AND board_pins.generation >= (SELECT base_generation FROM users) '
+                    + ('AND downloaded_at IS NULL ' if pending_only else '') +
+                    'ORDER BY board_pins.rowid LIMIT ?',
+                    (last, WORK_CHUNK)
+                ).fetchall()
+            if not rows:
+                return
+            for last, board_id, data in rows:
+                yield board_id, Pin.from_saved(codec.loads(data))
+
+    def missing_downloads(self):
+        return [(board_id, pin.id) for board_id, pin in self.iter_work(pending_only=True)]
+
+    # Import and export
+
+    def export_document(self):
+        """The saved document of the user, like `pretty_save_with_correct_data` writes it."""
+        user = self.user()
+        if user is None:
+            return None
+        user.created = self.board_pins(CREATED_BOARD)
+        user.total_created_pins = len(user.created)
+        user.boards = self.boards()
+        for board in user.boards:
+            board.pins = self.board_pins(board.id)
+        return user.to_dict()
+
+    def export_json(self, path: str, compact: bool = False):
+        document = self.export_document()
+        if document is None:
+            raise LookupError(f'{self.path} is empty')
+        codec.dump_file(document, path, indent=not compact)
+        return document
+
+    def import_document(self, document: dict, full: bool = True):
+        """Indexes a saved document (see `pretty_save_with_correct_data`)."""
+        user = User.from_saved(document)
+        generation = self.begin(user, full)
+        self.add_boards(list(enumerate(user.boards)), generation)
+        for board_id, pins in [(CREATED_BOARD, user.created), *((board.id, board.pins) for board in user.boards)]:
+            for start in range(0, len(pins), WORK_CHUNK):
+                self.add_pins(board_id, pins[start:start + WORK_CHUNK], generation, start)
+        self.finish(user.scraped_at)
+        return user
+
+    def import_stream(self, path: str):
+        """Indexes a JSON Lines file of stream_methods.JsonlWriter record by record."""
+        generation, positions, boards = None, {}, 0
+        for record in iter_records(path):
+            record_type = record.pop('type', None)
+            if record_type == 'user':
+                generation = self.begin(User.from_saved(record, with_pins=False))
+            elif record_type == 'board' and generation is not None:
+                self.add_boards([(boards, Board.from_saved(record, with_pins=False))], generation)
+                boards += 1
+            elif record_type == 'pin' and generation is not None:
+                board_id = record.pop('board', CREATED_BOARD)
+                position = positions.get(board_id, 0)
+                self.add_pins(board_id, [Pin.from_saved(record)], generation, position)
+                positions[board_id] = position + 1
+        if generation is not None:
+            self.finish()
+        return generation
+
+    def import_file(self, path: str):
+        if path.endswith(('.jsonl', '.jsonl.gz')):
+            return self.import_stream(path)
+        return self.import_document(codec.load_file(path))
+
+    def close(self):
+        with self.lock:
+            self._flush_marks()
+            self.connection.close()
+
+
+class IndexSink:
+    """Crawler sink writing every page into a `MetadataIndex` as it arrives, one transaction per page."""
+
+    def __init__(self, index: MetadataIndex, full: bool = True, generation: int | None = None, board_position: int = 0):
+        """With a `generation` the sink adds to one begun elsewhere, e.g. one board of a queued crawl."""
+        self.index = index
+        self.full = full
+        self.generation = generation
+        self.positions = {}
+        self.boards = board_position
+
+    def user(self, raw_user: dict):
+        self.generation = self.index.begin(User.from_raw({key: value for key, value in raw_user.items() if key not in ('created_pins', 'boards')}), self.full)
+
+    def board(self, raw_board: dict):
+        self.index.add_boards([(self.boards, Board.from_raw(raw_board, with_pins=False))], self.generation)
+        self.boards += 1
+
+    def pins(self, board_id, raw_pins: list):
+        pins = [Pin.from_raw(raw_pin) for raw_pin in raw_pins if isinstance(raw_pin, dict)]
+        position = self.positions.get(str(board_id), 0)
+        self.index.add_pins(board_id, pins, self.generation, position)
+        self.positions[str(board_id)] = position + len(pins)
+
+    def close(self, complete: bool = True):
+        """Finishes the generation, pass `complete=False` for a crawl that was interrupted or gave up on a feed."""
+        if self.generation is not None:
+            self.index.finish(complete=complete, generation=self.generation)
@@ -0,0 +1,141 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import threading, time
+
+# Default pacing per host, matched on the end of the hostname.
+HOST_LIMITS = {
+    'pinterest.com': {'rate': 1.0, 'burst': 2, 'min_rate': 0.1, 'max_rate': 8.0},
+    'pinimg.com': {'rate': 20.0, 'burst': 20, 'min_rate': 1.0, 'max_rate': 100.0},
+}
+DEFAULT_LIMITS = {'rate': 2.0, 'burst': 4, 'min_rate': 0.1, 'max_rate': 20.0}
+BACKOFF_STATUSES = (429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value: str | None):
+    """Returns the number of seconds a `Retry-After` header asks us to wait, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Token bucket whose refill rate adapts to the server:
+    every success adds `increase` requests/s, every 429/5xx multiplies the rate by `decrease`.
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float, max_rate: float, increase: float = 0.05, decrease: float = 0.5):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def backoff(self, delay: float | None = None):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = 0.0
+            if delay:
+                self.blocked_until = max(self.blocked_until, now + delay)
+
+
+class RateLimiter:
+    """
+    Shared, thread-safe collection of per-host token buckets.
+    The hosts matching a suffix with a budget (see set_budget) share one bucket instead.
+    """
+
+    def __init__(self, host_limits: dict | None = None, default_limits: dict | None = None):
+        self.host_limits = HOST_LIMITS if host_limits is None else host_limits
+        self.default_limits = DEFAULT_LIMITS if default_limits is None else default_limits
+        self.budgets = set()
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _limits_for(self, host: str):
+        for suffix, limits in self.host_limits.items():
+            if host == suffix or host.endswith('.' + suffix):
+                return limits
+        return self.default_limits
+
+    def bucket(self, host: str):
+        host = (host or '').lower()
+        with self.lock:
+            host = next((suffix for suffix in self.budgets if host == suffix or host.endswith('.' + suffix)), host)
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(**self._limits_for(host))
+            return self.buckets[host]
+
+    def acquire(self, host: str):
+        self.bucket(host).acquire()
+
+    def update(self, host: str, status: int, retry_after: str | None = None, delay: float | None = None):
+        """
+        Feeds a response back into the bucket of `host`.
+        `Retry-After` wins over `delay`, which is the caller's own backoff for the next attempt.
+        """
+        bucket = self.bucket(host)
+        if status in BACKOFF_STATUSES:
+            wait = parse_retry_after(retry_after)
+            bucket.backoff(wait if wait is not None else delay)
+        elif status < 400:
+            bucket.success()
+
+    def set_budget(self, suffix: str, rate: float, burst: int | None = None):
+        """
+        Caps the request rate of all hosts matching `suffix` together at `rate` requests/s, e.g. for a batch job.
+        The budget is for this process, processes sharing one have to split it (see queue_methods.start_workers).
+        """
+        with self.lock:
+            limits = dict(self.host_limits.get(suffix, self.default_limits))
+            limits.update(rate=rate, max_rate=rate, min_rate=min(limits['min_rate'], rate))
+            if burst is not None:
+                limits['burst'] = burst
+            self.host_limits = {**self.host_limits, suffix: limits}
+            self.budgets.add(suffix)
+            for host in [host for host in self.buckets if host == suffix or host.endswith('.' + suffix)]:
+                del self.buckets[host]
+
+    def rates(self):
+        with self.lock:
+            return {host: bucket.rate for host, bucket in self.buckets.items()}
@@ -0,0 +1,145 @@
+from .store_methods import file_digest
+
+import os, sqlite3, threading, time
+
+MANIFEST_NAME = '.manifest.sqlite'
+
+COMPLETE, FAILED = 'complete', 'failed'
+
+
+class DownloadManifest:
+    """
+    What was downloaded where for one user: one row per pin and board folder with the file, its size,
+    the sha256 of its blob, the media it came from and whether it completed.
+
+    Every finished file is recorded in its own transaction, so an interrupted run leaves no half written
+    entries. Paths are relative to the download root, so the tree can be moved. The modification time of
+    every file is recorded too: a file that was touched since is only trusted again once its sha256 matches.
+
+    Packed downloads (see shard_methods.ShardStore) have no file at `path`, their rows hold the shard and
+    the byte offset of the data instead, which makes the manifest the pin -> (shard, offset, size) index.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'folder TEXT NOT NULL, pin_id TEXT NOT NULL, path TEXT, size INTEGER NOT NULL DEFAULT 0, sha256 TEXT, source TEXT, '
+                'status TEXT NOT NULL, updated_at INTEGER, shard TEXT, offset INTEGER, mtime INTEGER, PRIMARY KEY (folder, pin_id))'
+            )
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(files)')}
+            # Manifests written before packed downloads, or modification times, existed
+            for column, kind in (('shard', 'TEXT'), ('offset', 'INTEGER'), ('mtime', 'INTEGER')):
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE files ADD COLUMN {column} {kind}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _relative(self, path: str):
+        return os.path.relpath(path, self.root)
+
+    def record(self, folder: str, pin_id, path: str, size: int, digest: str, source: str, shard: str | None = None, offset: int | None = None):
+        """`shard` and `offset` locate the data of a packed download, which has no file at `path`."""
+        mtime = None
+        if shard is None:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files (folder, pin_id, path, size, sha256, source, status, updated_at, shard, offset, mtime) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self._relative(folder), str(pin_id), self._relative(path), size, digest, source, COMPLETE, int(time.time()),
+                 None if shard is None else self._relative(shard), offset, mtime)
+            )
+
+    def record_failure(self, folder: str, pin_id, source: str):
+        """Marks a pin failed unless it already completed, e.g. with another quality, in an earlier run."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO files (folder, pin_id, source, status, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(folder, pin_id) DO UPDATE SET source = excluded.source, status = excluded.status, '
+                'updated_at = excluded.updated_at WHERE files.status != ?',
+                (self._relative(folder), str(pin_id), source, FAILED, int(time.time()), COMPLETE)
+            )
+
+    def completed(self, folder: str, pin_id, source: str | None = None):
+        """
+        The path of the pin's file in `folder` if it completed from `source` (any source when None) and the
+        file is still there with its recorded size and, when it was modified since, its recorded sha256 (for packed
+        ones: its append-only shard still holds the data), None otherwise.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT path, size, source, shard, offset, sha256, mtime FROM files WHERE folder = ? AND pin_id = ? AND status = ?',
+                (self._relative(folder), str(pin_id), COMPLETE)
+            ).fetchone()
+        if row is None or (source is not None and row[2] != source):
+            return None
+        relative, size, _, shard, offset, digest, mtime = row
+        path = os.path.join(self.root, relative)
+        try:
+            if shard is not None:
+                return path if os.stat(os.path.join(self.root, shard)).st_size >= offset + size else None
+            stat = os.stat(path)
+            if stat.st_size != size:
+                return None
+            if stat.st_mtime_ns == mtime:
+                return path
+            # Touched (or recorded before modification times were), the same size alone proves nothing
+            if not digest or file_digest(path) != digest:
+                return None
+        except OSError:
+            return None
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE files SET mtime = ? WHERE folder = ? AND pin_id = ?', (stat.st_mtime_ns, self._relative(folder), str(pin_id))
+            )
+        return path
+
+    def names(self, folder: str):
+        """File names recorded in `folder`, which is what is taken there for packed downloads."""
+        with self.lock:
+            rows = self.connection.execute('SELECT path FROM files WHERE folder = ? AND path IS NOT NULL', (self._relative(folder),)).fetchall()
+        return [os.path.basename(path) for (path,) in rows]
+
+    def locate(self, folder: str, pin_id):
+        """`(shard_path, offset, size)` of a pin packed into a shard, None if it is not."""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT shard, offset, size FROM files WHERE folder = ? AND pin_id = ? AND status = ? AND shard IS NOT NULL',
+                (self._relative(folder), str(pin_id), COMPLETE)
+            ).fetchone()
+        return None if row is None else (os.path.join(self.root, row[0]), row[1], row[2])
+
+    def packed(self):
+        """`(path, shard_path, offset, size)` of every packed file, paths relative to the download root, in shard order."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT path, shard, offset, size FROM files WHERE status = ? AND shard IS NOT NULL ORDER BY shard, offset', (COMPLETE,)
+            ).fetchall()
+        return [(path, os.path.join(self.root, shard), offset, size) for path, shard, offset, size in rows]
+
+    def total_size(self):
+        with self.lock:
+            return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM files WHERE status = ?', (COMPLETE,)).fetchone()[0]
+
+    def counts(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT status, COUNT(*) FROM files GROUP BY status').fetchall()
+        return {COMPLETE: 0, FAILED: 0, **dict(rows)}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,225 @@
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from . import codec_methods as codec
+
+import math, os, threading, time
+
+PREFIX = 'pinterest_scrapper_'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+DESCRIPTIONS = {
+    'http_requests_total': 'HTTP responses by host, endpoint and status',
+    'http_request_seconds': 'Time until the response headers arrived',
+    'http_retries_total': 'Requests retried after a 429/5xx',
+    'http_throttled_total': '429 responses',
+    'http_cache_total': 'HTTP cache lookups by result',
+    'http_response_bytes_total': 'Response body bytes read',
+    'ffmpeg_runs_total': 'ffmpeg runs by result',
+    'ffmpeg_seconds': 'Duration of ffmpeg runs',
+    'crawl_in_flight': 'Resource requests of the crawler in flight',
+    'download_queue_depth': 'Download jobs queued or running',
+    'download_running': 'Download jobs running',
+    'stage_seconds': 'Duration of the scrape, save and download stages',
+    'pipeline_pending_pages': 'Crawled pages waiting for the download pipeline',
+    'queue_jobs_total': 'Crawl queue jobs by kind and result',
+    'global_index_total': 'Global media index lookups by result',
+    'global_index_saved_bytes_total': 'Bytes reused from media downloaded for another account',
+}
+
+
+def endpoint_of(url: str):
+    """`UserResource` for `/resource/UserResource/get/`, `media` for everything else, to keep label values few."""
+    parts = urlparse(url).path.strip('/').split('/')
+    if len(parts) >= 2 and parts[0] == 'resource':
+        return parts[1]
+    return 'media'
+
+
+def host_of(url: str):
+    return urlparse(url).hostname or ''
+
+
+def _labels_key(labels: dict):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, result = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and latency histograms with labels.
+
+    Metrics are created on first use. `to_prometheus` renders the Prometheus text format and `snapshot`
+    a plain dict for JSON, `dump` writes either depending on the file name.
+    """
+
+    def __init__(self, prefix: str = PREFIX):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.types = {}
+        self.values = {}
+        self.started = time.time()
+
+    def _series(self, name: str, kind: str):
+        if self.types.setdefault(name, kind) != kind:
+            raise TypeError(f'{name} is a {self.types[name]}, not a {kind}')
+        return self.values.setdefault(name, {})
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            series = self._series(name, 'counter')
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self._series(name, 'gauge')[_labels_key(labels)] = value
+
+    def add(self, name: str, delta: float, **labels):
+        """Moves a gauge up or down, e.g. for queue depths."""
+        key = _labels_key(labels)
+        with self.lock:
+            series = self._series(name, 'gauge')
+            series[key] = series.get(key, 0) + delta
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            series = self._series(name, 'histogram')
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name: str, **labels):
+        """Current value of a counter or gauge, the observation count of a histogram."""
+        with self.lock:
+            value = self.values.get(name, {}).get(_labels_key(labels), 0)
+        return value.count if isinstance(value, Histogram) else value
+
+    def snapshot(self):
+        with self.lock:
+            metrics = {}
+            for name, series in self.values.items():
+                entries = []
+                for key, value in series.items():
+                    entry = {'labels': dict(key)}
+                    if isinstance(value, Histogram):
+                        entry.update(count=value.count, sum=value.sum,
+                                     buckets={('+Inf' if math.isinf(bound) else str(bound)): count for bound, count in value.cumulative()})
+                    else:
+                        entry['value'] = value
+                    entries.append(entry)
+                metrics[name] = {'type': self.types[name], 'series': entries}
+        return {'started': self.started, 'time': time.time(), 'metrics': metrics}
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for name in sorted(self.values):
+                full_name = self.prefix + name
+                if name in DESCRIPTIONS:
+                    lines.append(f'# HELP {full_name} {DESCRIPTIONS[name]}')
+                lines.append(f'# TYPE {full_name} {self.types[name]}')
+                for key, value in sorted(self.values[name].items()):
+                    if isinstance(value, Histogram):
+                        for bound, count in value.cumulative():
+                            le = '+Inf' if math.isinf(bound) else repr(bound)
+                            lines.append(f'{full_name}_bucket{_format_labels(key, (("le", le),))} {count}')
+                        lines.append(f'{full_name}_sum{_format_labels(key)} {value.sum}')
+                        lines.append(f'{full_name}_count{_format_labels(key)} {value.count}')
+                    else:
+                        lines.append(f'{full_name}{_format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        """Writes Prometheus text for `.prom`/`.txt` files and a JSON snapshot otherwise."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = path + '.tmp'
+        if path.endswith(('.prom', '.txt')):
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                file.write(self.to_prometheus())
+        else:
+            codec.dump_file(self.snapshot(), temp_path)
+        # Scrapers of the file never see a half written export
+        os.replace(temp_path, path)
+
+    def reset(self):
+        with self.lock:
+            self.types.clear()
+            self.values.clear()
+            self.started = time.time()
+
+
+class PeriodicExporter:
+    """Dumps `registry` to `path` every `interval` seconds from a daemon thread, and once more on `stop`."""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 15.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.registry.dump(self.path)
+
+    def start(self):
+        if self.interval and self.interval > 0:
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.registry.dump(self.path)
+
+
+METRICS = MetricsRegistry()
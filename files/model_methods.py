@@ -0,0 +1,259 @@
+"""
+Compact, slotted models of the Pinterest objects the scraper works with.
+
+Every model is parsed once, either from a raw resource response (`from_raw`) or from a saved
+document (`from_saved`), and `to_dict` gives back the saved document format. Every declared field is
+always set (None when missing), unknown attributes raise AttributeError instead of hiding typos.
+"""
+
+STORY_VIDEO_BLOCK = 3
+
+
+def _dict(value):
+    return value if isinstance(value, dict) else {}
+
+
+def _list(value):
+    return value if isinstance(value, list) else []
+
+
+class Model:
+    __slots__ = ()
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__ if name != 'pins')
+        return f'{self.__class__.__name__}({fields})'
+
+
+class Image(Model):
+    __slots__ = ('url', 'width', 'height')
+
+    def __init__(self, url: str | None = None, width: int | None = None, height: int | None = None):
+        self.url = url
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        data = _dict(data)
+        return cls(data.get('url'), data.get('width'), data.get('height'))
+
+    def to_dict(self):
+        return {'url': self.url, 'width': self.width, 'height': self.height}
+
+
+class Video(Model):
+    __slots__ = ('url', 'width', 'height', 'thumbnail', 'duration')
+
+    def __init__(self, url: str | None = None, width: int | None = None, height: int | None = None,
+                 thumbnail: str | None = None, duration: int | None = None):
+        self.url = url
+        self.width = width
+        self.height = height
+        self.thumbnail = thumbnail
+        self.duration = duration
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        data = _dict(data)
+        return cls(data.get('url'), data.get('width'), data.get('height'), data.get('thumbnail'), data.get('duration'))
+
+    def to_dict(self):
+        return {'width': self.width, 'height': self.height, 'thumbnail': self.thumbnail, 'url': self.url, 'duration': self.duration}
+
+
+class Pin(Model):
+    __slots__ = ('id', 'name', 'title', 'alt_text', 'created_at', 'description', 'images', 'videos')
+
+    def __init__(self, id=None, name=None, title=None, alt_text=None, created_at=None, description=None,
+                 images: dict | None = None, videos: list | None = None):
+        self.id = id
+        self.name = name
+        self.title = title
+        self.alt_text = alt_text
+        self.created_at = created_at
+        self.description = description
+        self.images = images or {}
+        self.videos = videos or []
+
+    @property
+    def has_videos(self):
+        return bool(self.videos)
+
+    def image(self, size: str = 'orig'):
+        return self.images.get(size)
+
+    @staticmethod
+    def extract_videos(raw: dict):
+        """Every video variant of the video blocks of a story pin."""
+        story_pin_data = _dict(raw.get('story_pin_data'))
+        duration = story_pin_data.get('total_video_duration')
+        if not story_pin_data or not duration:
+            return []
+
+        videos = []
+        for page in _list(story_pin_data.get('pages')):
+            for block in _list(_dict(page).get('blocks')):
+                block = _dict(block)
+                if block.get('block_type') != STORY_VIDEO_BLOCK:
+                    continue
+                for value in _dict(_dict(block.get('video')).get('video_list')).values():
+                    value = _dict(value)
+                    videos.append(Video(value.get('url'), value.get('width'), value.get('height'), value.get('thumbnail'), duration))
+        return videos
+
+    @classmethod
+    def from_raw(cls, raw: dict):
+        return cls(
+            raw.get('id'), raw.get('name'), raw.get('title'), raw.get('auto_alt_text'),
+            raw.get('created_at'), raw.get('description'),
+            {size: Image.from_dict(image) for size, image in _dict(raw.get('images')).items()},
+            cls.extract_videos(raw)
+        )
+
+    @classmethod
+    def from_saved(cls, data: dict):
+        return cls(
+            data.get('id'), data.get('name'), data.get('title'), data.get('alt_text'),
+            data.get('created_at'), data.get('description'),
+            {size: Image.from_dict(image) for size, image in _dict(data.get('images')).items()},
+            [Video.from_dict(video) for video in _list(data.get('videos'))]
+        )
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'title': self.title,
+            'id': self.id,
+            'alt_text': self.alt_text,
+            'created_at': self.created_at,
+            'description': self.description,
+            'images': {size: image.to_dict() for size, image in self.images.items()},
+            'videos': [video.to_dict() for video in self.videos],
+            'has_videos': self.has_videos
+        }
+
+
+class Board(Model):
+    __slots__ = ('id', 'name', 'url', 'total_pins', 'created_at', 'modified_at', 'follower', 'cover', 'pins')
+
+    def __init__(self, id=None, name=None, url=None, total_pins=None, created_at=None, modified_at=None,
+                 follower=None, cover=None, pins: list | None = None):
+        self.id = id
+        self.name = name
+        self.url = url
+        self.total_pins = total_pins
+        self.created_at = created_at
+        self.modified_at = modified_at
+        self.follower = follower
+        self.cover = cover
+        self.pins = pins or []
+
+    @classmethod
+    def from_raw(cls, raw: dict, with_pins: bool = True):
+        return cls(
+            raw.get('id'), raw.get('name'), raw.get('url'), raw.get('pin_count'), raw.get('created_at'),
+            raw.get('board_order_modified_at'), raw.get('follower_count'), raw.get('image_cover_hd_url'),
+            [Pin.from_raw(pin) for pin in _list(raw.get('pins')) if isinstance(pin, dict)] if with_pins else None
+        )
+
+    @classmethod
+    def from_saved(cls, data: dict, with_pins: bool = True):
+        return cls(
+            data.get('id'), data.get('name') or data.get('title'), data.get('url'), data.get('total_pins'),
+            data.get('created_at'), data.get('modified_at'), data.get('follower'), data.get('cover'),
+            [Pin.from_saved(pin) for pin in _list(data.get('pins')) if pin] if with_pins else None
+        )
+
+    def to_dict(self, with_pins: bool = True):
+        info = {
+            'name': self.name,
+            'id': self.id,
+            'url': self.url,
+            'total_pins': self.total_pins,
+            'created_at': self.created_at,
+            'modified_at': self.modified_at,
+            'follower': self.follower,
+            'cover': self.cover,
+        }
+        if with_pins:
+            info['pins'] = [pin.to_dict() for pin in self.pins]
+        return info
+
+
+class User(Model):
+    __slots__ = (
+        'id', 'name', 'username', 'profile_cover', 'external_links', 'followers', 'following', 'reach', 'views',
+        'instagram', 'large_pfp', 'default', 'pfp', 'about', 'total_pins', 'total_created_pins', 'total_boards',
+        'created', 'boards', 'scraped_at'
+    )
+
+    # saved key -> raw key
+    RAW_KEYS = {
+        'id': 'id', 'name': 'full_name', 'username': 'username', 'profile_cover': 'profile_cover',
+        'external_links': 'website_url', 'followers': 'follower_count', 'following': 'following_count',
+        'reach': 'reach', 'views': 'profile_views', 'instagram': 'instagram_data', 'large_pfp': 'image_xlarge_url',
+        'default': 'eligible_profile_tabs', 'pfp': 'image_large_url', 'about': 'about', 'total_pins': 'pin_count',
+        'total_boards': 'board_count',
+    }
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+        self.created = self.created or []
+        self.boards = self.boards or []
+
+    @property
+    def banner_url(self):
+        return _dict(_dict(_dict(self.profile_cover).get('images')).get('originals')).get('url')
+
+    @classmethod
+    def from_raw(cls, raw: dict):
+        created = [Pin.from_raw(pin) for pin in _list(raw.get('created_pins')) if isinstance(pin, dict)]
+        return cls(
+            **{name: raw.get(key) for name, key in cls.RAW_KEYS.items()},
+            total_created_pins=len(created),
+            created=created,
+            boards=[Board.from_raw(board) for board in _list(raw.get('boards')) if isinstance(board, dict)],
+        )
+
+    @classmethod
+    def from_saved(cls, data: dict, with_pins: bool = True):
+        return cls(
+            **{name: data.get(name) for name in cls.RAW_KEYS},
+            total_created_pins=data.get('total_created_pins'),
+            scraped_at=data.get('scraped_at'),
+            created=[Pin.from_saved(pin) for pin in _list(data.get('created')) if pin] if with_pins else None,
+            boards=[Board.from_saved(board, with_pins) for board in _list(data.get('boards')) if board],
+        )
+
+    def to_dict(self, with_pins: bool = True):
+        info = {name: getattr(self, name) for name in self.__slots__ if name not in ('created', 'boards', 'scraped_at')}
+        if with_pins:
+            info['created'] = [pin.to_dict() for pin in self.created]
+            info['boards'] = [board.to_dict() for board in self.boards]
+        if self.scraped_at is not None:
+            info['scraped_at'] = self.scraped_at
+        return info
+
+
+def as_pin(data):
+    return data if isinstance(data, Pin) else Pin.from_saved(data)
+
+
+def as_board(data):
+    return data if isinstance(data, Board) else Board.from_saved(data)
+
+
+def as_user(data):
+    return data if isinstance(data, User) else User.from_saved(data)
@@ -1,7 +1,11 @@
 import logging.config
-import time, json, re, os, logging
+import time, re, os, logging
 from sys import exit
-from .commons import SESSION, LOG_PATH
+from .commons import LOG_PATH, get_session
+from .model_methods import User, Board, Pin
+from . import codec_methods as codec
+from .metrics_methods import METRICS, host_of
+from requests import RequestException
 
 class DotDict(dict):
     """
@@ -45,150 +49,116 @@ class DotDict(dict):
 
         return value
 
-def pretty_save_with_correct_data(big_data: dict, name: str):
-    # Initialize logging
-    log_file = os.path.join(LOG_PATH, big_data.get('username'), big_data.get('username') + '_scraping.log')
+def set_logger(username: str):
+    log_file = os.path.join(LOG_PATH, username, username + '_scraping.log')
     logging.basicConfig(
         filename=log_file,
         level=logging.DEBUG, 
         format='%(asctime)s - %(levelname)s: %(message)s'
     )
-    
-    big_data = DotDict(big_data, mode='saving')
-    user_info = None
 
-    def log_and_continue(exception, message):
-        logging.error(f"{message}: {exception}")
-    
+def log_and_continue(exception, message):
+    logging.error(f"{message}: {exception}")
+
+def get_simple_pin_info(big_pin_data: dict):
     try:
-        user_info = {
-            'id': big_data.id,
-            'name': big_data.full_name,
-            'username': big_data.username,
-            'profile_cover': big_data.profile_cover,
-            'external_links': big_data.website_url,
-            'followers': big_data.follower_count,
-            'following': big_data.following_count,
-            'reach': big_data.reach,
-            'views': big_data.profile_views,
-            'instagram': big_data.instagram_data,
-            'large_pfp': big_data.image_xlarge_url,
-            'default': big_data.eligible_profile_tabs,
-            'pfp': big_data.image_large_url,
-            'about': big_data.about,
-            'total_pins': big_data.pin_count,
-            'total_created_pins': len(big_data.created),
-            'total_boards': big_data.board_count,
-            'created': [],
-            'boards': []
-        }
-
-        def get_simple_pin_info(big_pin_data):
-            def extract_videos():
-                """Extract video information from pin data."""
-                story_pin_data = big_pin_data.story_pin_data
-                if not story_pin_data or story_pin_data.total_video_duration == 0:
-                    logging.warning("Story pin data is invalid or has no duration.")
-                    return big_data.get('videos', [])
-
-                videos = []
-                for page in story_pin_data.pages or []:
-                    for block in page.blocks or []:
-                        if block.block_type != 3:
-                            logging.info("Skipping block with unsupported type.")
-                            continue
-
-                        for key, value in (block.video.video_list or {}).items():
-                            value = DotDict(value)
-                            logging.debug(f"Video key: {key}, URL: {value.url}")
-                            videos.append({
-                                'width': value.width,
-                                'height': value.height,
-                                'thumbnail': value.thumbnail,
-                                'url': value.url,
-                                'duration': story_pin_data.total_video_duration
-                            })
-                return videos
-
-            try:
-                videos = extract_videos()
-                logging.info(f"Extracted {len(videos)} video(s) for pin [{big_pin_data.id}].")
-                return {
-                    'name': big_pin_data.name,
-                    'title': big_pin_data.title,
-                    'id': big_pin_data.id,
-                    'alt_text': big_pin_data.auto_alt_text,
-                    'created_at': big_pin_data.created_at,
-                    'description': big_pin_data.description,
-                    'images': big_pin_data.images,
-                    'videos': videos,
-                    'has_videos': bool(videos)
-                }
-            except Exception as e:
-                log_and_continue(e, f"Failed to extract pin info for pin [{big_pin_data.id}]")
-                return {}
-
-        def get_simple_board_info(big_board_info):
-            try:
-                info = {
-                    'name': big_board_info.name,
-                    'id': big_board_info.id,
-                    'url': big_board_info.url,
-                    'total_pins': big_board_info.pin_count,
-                    'created_at': big_board_info.created_at,
-                    'follower': big_board_info.follower_count,
-                    'cover': big_board_info.image_cover_hd_url,
-                    'pins': []
-                }
-
-                for pin in big_board_info.pins or []:
-                    try:
-                        logging.debug(f"Extracting pin info for {pin.title}.")
-                        info['pins'].append(get_simple_pin_info(pin))
-                    except Exception as e:
-                        log_and_continue(e, f"Failed to process pin [{pin.id}] in board [{big_board_info.name}]")
-                return info
-            except Exception as e:
-                log_and_continue(e, f"Failed to process board [{big_board_info.name}]")
-                return {}
-
-        # Process created pins
-        user_info['created'] = [get_simple_pin_info(pin) for pin in big_data.created_pins or []]
-        logging.info(f"Processed {len(user_info['created'])} created pins.")
-
-        # Process boards
-        user_info['boards'] = [get_simple_board_info(board) for board in big_data.boards or []]
-        logging.info(f"Processed {len(user_info['boards'])} boards.")
-
-        user_info['scraped_at'] = int(time.time())
+        pin = Pin.from_raw(big_pin_data)
+        logging.debug(f"Extracted {len(pin.videos)} video(s) for pin [{pin.id}].")
+        return pin.to_dict()
     except Exception as e:
-        log_and_continue(e, "Failed to parse user info")
-        return False
+        log_and_continue(e, f"Failed to extract pin info for pin [{big_pin_data.get('id')}]")
+        return {}
 
-    # Save data to file
-    output_file = name if name.endswith('.json') else f"{name}.json"
+def get_simple_board_info(big_board_info: dict):
+    """The saved board, a pin that can not be converted is left out instead of failing the board."""
     try:
-        with open(output_file, 'w', encoding='utf-8') as file:
-            json.dump(user_info or big_data, file, indent=4, ensure_ascii=False)
-        logging.info(f"Data saved successfully to {output_file}")
-        return True
+        info = Board.from_raw(big_board_info, with_pins=False).to_dict(with_pins=False)
     except Exception as e:
-        log_and_continue(e, "Failed to save data to file")
-        return False
+        log_and_continue(e, f"Failed to process board [{big_board_info.get('name')}]")
+        return {}
+    pins = big_board_info.get('pins')
+    info['pins'] = [pin for pin in (get_simple_pin_info(raw_pin) for raw_pin in pins if isinstance(raw_pin, dict)) if pin] if isinstance(pins, list) else []
+    return info
 
-def return_resource(url: str, headers: dict | None = None):
-    
-    if headers:
-        response = SESSION.get(url, headers=headers)
-    else:
-        response = SESSION.get(url)
+def get_simple_user_info(big_data: dict):
+    return User.from_raw({key: value for key, value in big_data.items() if key not in ('created_pins', 'boards')}).to_dict(with_pins=False)
 
+def convert_user_data(big_data: dict):
+    """
+    Converts the raw scraped user, created pins and boards into the saved document, None when the user itself
+    can not be converted. Pins and boards that can not be converted are logged and left out.
+    """
+    try:
+        user_info = get_simple_user_info(big_data)
+    except Exception as e:
+        log_and_continue(e, "Failed to parse user info")
+        return None
+
+    created_pins, boards = big_data.get('created_pins'), big_data.get('boards')
+    user_info['created'] = [pin for pin in (get_simple_pin_info(raw_pin) for raw_pin in created_pins if isinstance(raw_pin, dict)) if pin] if isinstance(created_pins, list) else []
+    user_info['total_created_pins'] = len(user_info['created'])
+    logging.info(f"Processed {len(user_info['created'])} created pins.")
+
+    user_info['boards'] = [board for board in (get_simple_board_info(raw_board) for raw_board in boards if isinstance(raw_board, dict)) if board] if isinstance(boards, list) else []
+    logging.info(f"Processed {len(user_info['boards'])} boards.")
+
+    user_info['scraped_at'] = int(time.time())
+    return user_info
+
+def pretty_save_with_correct_data(big_data: dict, name: str, previous: dict | None = None, compact: bool = False):
+    """
+    Converts and saves the scraped data.
+    With `previous` (the last saved document of the user) the new pins are merged into it.
+    `compact` writes the document without indentation, which is smaller and faster to write and read.
+    """
+    set_logger(big_data.get('username'))
+
+    with METRICS.timer('stage_seconds', stage='save'):
+        user_info = convert_user_data(big_data)
+        if user_info is None:
+            return False
+
+        if previous:
+            from .delta_methods import merge_documents
+            user_info = merge_documents(previous, user_info)
+            logging.info(f"Merged new pins into the previous scrape from {previous.get('scraped_at')}.")
+
+        # Save data to file
+        output_file = name if name.endswith('.json') else f"{name}.json"
+        try:
+            codec.dump_file(user_info, output_file, indent=not compact)
+            logging.info(f"Data saved successfully to {output_file}")
+            return True
+        except Exception as e:
+            log_and_continue(e, "Failed to save data to file")
+            return False
+
+def return_resource(url: str, headers: dict | None = None, archive=None):
+    """
+    The decoded `resource_response` of a resource url, a plain dict, also appended to `archive` (an
+    archive_methods.ResponseArchive) when given. Connection errors and timeouts give an empty response like
+    unusable data does, the crawler retries those per feed.
+    """
+    try:
+        if headers:
+            response = get_session().get(url, headers=headers)
+        else:
+            response = get_session().get(url)
+    except RequestException as e:
+        logging.error(f'Unable to request {url}: {e} [{e.__class__.__name__}]')
+        return {}
+
+    METRICS.inc('http_response_bytes_total', len(response.content), host=host_of(url))
     try:
         response.raise_for_status()
-        return DotDict(response.json()).resource_response
+        data = codec.loads(response.content)
+        if archive is not None:
+            archive.record(url, response.status_code, data.get('resource_response'))
+        resource = data.get('resource_response')
+        return resource if isinstance(resource, dict) else {}
     except Exception as e:
         logging.error(f'Unable to convert to json: {e} [{e.__class__.__name__}]\nRaw data: {response.text}')
-        return DotDict()
+        return {}
 
 def get_username(string: str):
 
@@ -196,7 +166,7 @@ def get_username(string: str):
         exit(0)
 
     if re.match(r"""https?://[\d\w+]?pin.it/""", string):
-        webpage = SESSION.get(string).text
+        webpage = get_session().get(string).text
         match = re.search(r"""https?://(?:[a-zA-Z0-9-]+\.)?pinterest\.com/(?P<username>[^"/]+)/(?P<board_name>[^"/]+)?(/?invite_code=[\w\d]+)""", webpage)
         if match:
             return match.group('username'), match.groupdict().get('board_name', '')
@@ -0,0 +1,108 @@
+from .model_methods import User, Board, Pin
+from .scheduler_methods import DownloadScheduler
+from .stream_methods import CREATED_BOARD
+from .metrics_methods import METRICS
+
+import logging, queue, threading, time
+
+# Crawled pages waiting to be converted, beyond this the crawler waits for the downloads
+MAX_PENDING_PAGES = 64
+
+
+class TeeSink:
+    """Hands everything the crawler produces to several sinks."""
+
+    def __init__(self, *sinks):
+        self.sinks = [sink for sink in sinks if sink is not None]
+
+    def user(self, raw_user: dict):
+        for sink in self.sinks:
+            sink.user(raw_user)
+
+    def board(self, raw_board: dict):
+        for sink in self.sinks:
+            sink.board(raw_board)
+
+    def pins(self, board_id, raw_pins: list):
+        for sink in self.sinks:
+            sink.pins(board_id, raw_pins)
+
+
+class DownloadSink:
+    """
+    Crawler sink that downloads pins while the crawl is still running.
+
+    The crawl, the conversion of raw pins and the downloads are three stages connected by bounded queues:
+    pages go into a queue of at most `max_pages` pages, a feeder thread converts them and submits every pin
+    to the downloader's scheduler, whose `submit` blocks once enough downloads are pending. A slow stage
+    therefore holds back the ones before it instead of piling up pins in memory.
+    """
+
+    _DONE = object()
+
+    def __init__(self, downloader, max_pages: int = MAX_PENDING_PAGES):
+        self.downloader = downloader
+        self.pages = queue.Queue(maxsize=max_pages)
+        self.board_paths = {}
+        self.feeder = None
+        self.scheduler = None
+        self.user_info = None
+        self.queued = 0
+        self.started = None
+
+    def user(self, raw_user: dict):
+        self.started = time.perf_counter()
+        self.user_info = User.from_raw({key: value for key, value in raw_user.items() if key not in ('created_pins', 'boards')})
+        self.downloader.initialize(self.user_info)
+        self.scheduler = self.downloader.scheduler = DownloadScheduler(self.downloader.max_workers, self.downloader.host_limits)
+        self.board_paths[CREATED_BOARD] = self.downloader.__board_path__(Board(id=0, name=CREATED_BOARD))
+        self.feeder = threading.Thread(target=self._feed, name='pipeline-feeder', daemon=True)
+        self.feeder.start()
+        print(f'----# Downloading {self.user_info.name or self.user_info.username} in {self.downloader.root_path} while scraping')
+
+    def board(self, raw_board: dict):
+        board = Board.from_raw(raw_board, with_pins=False)
+        self.board_paths[str(board.id)] = self.downloader.__board_path__(board)
+
+    def pins(self, board_id, raw_pins: list):
+        if self.feeder is None:
+            return
+        METRICS.add('pipeline_pending_pages', 1)
+        self.pages.put((str(board_id), raw_pins))
+
+    def _feed(self):
+        while True:
+            item = self.pages.get()
+            if item is self._DONE:
+                return
+            METRICS.add('pipeline_pending_pages', -1)
+            board_id, raw_pins = item
+            download_path = self.board_paths.get(board_id)
+            if download_path is None:
+                logging.error(f'Pins of unknown board {board_id} can not be downloaded.')
+                continue
+
+            for raw_pin in raw_pins:
+                try:
+                    if self.downloader.queue_pin(Pin.from_raw(raw_pin), download_path, board_id) is not None:
+                        self.queued += 1
+                except Exception as e:
+                    logging.error(f'Unable to queue pin [{raw_pin.get("id")}]: {e.args} [{e.__class__.__name__}]')
+
+    def close(self):
+        """Waits for the remaining pages and downloads, returns the downloaded bytes."""
+        if self.feeder is None:
+            return 0
+
+        self.pages.put(self._DONE)
+        self.feeder.join()
+        self.feeder = None
+        total_size = self.scheduler.join()
+        self.scheduler.close()
+        self.downloader.scheduler = None
+        self.downloader.close()
+        METRICS.observe('stage_seconds', time.perf_counter() - self.started, stage='download')
+
+        data = self.user_info
+        print(f'----# Downloaded {self.queued} pins of {data.name or data.username} in {self.downloader.root_path} [{total_size/(1024*1024):.2f}MB]')
+        return total_size
@@ -0,0 +1,121 @@
+from .model_methods import Pin
+from urllib.parse import urlparse
+
+import os, re
+
+TIERS = ('orig', '736x', '564x', '474x', '236x', '170x')
+TIER_RE = re.compile(r'^(\d+)x(\d*)$')
+
+# Content-Type -> extension, for bytes that are not recognised
+CONTENT_TYPES = {
+    'image/jpeg': '.jpg', 'image/png': '.png', 'image/gif': '.gif', 'image/webp': '.webp',
+    'image/heic': '.heic', 'image/avif': '.avif', 'video/mp4': '.mp4', 'video/quicktime': '.mov',
+}
+
+
+def tier_width(tier: str):
+    """Maximum width of a Pinterest size key like `736x` or `236x314`, None for `orig`."""
+    match = TIER_RE.match(tier or '')
+    return int(match.group(1)) if match else None
+
+
+class QualityPolicy:
+    """
+    Which media variant of a pin gets downloaded.
+
+    `tier` is a Pinterest image size (`orig`, `736x`, `474x`, ...) and caps the width of images and videos,
+    `max_bytes` skips variants whose announced size is bigger, stepping down to the next smaller one.
+    """
+
+    __slots__ = ('tier', 'max_width', 'max_bytes')
+
+    def __init__(self, tier: str = 'orig', max_width: int | None = None, max_bytes: int | None = None):
+        if tier != 'orig' and tier_width(tier) is None:
+            raise ValueError(f'unknown quality tier {tier!r}, use orig or <width>x (e.g. {", ".join(TIERS[1:])})')
+        self.tier = tier
+        widths = [width for width in (tier_width(tier), max_width) if width]
+        self.max_width = min(widths) if widths else None
+        self.max_bytes = max_bytes
+
+    def __repr__(self):
+        return f'QualityPolicy(tier={self.tier!r}, max_width={self.max_width!r}, max_bytes={self.max_bytes!r})'
+
+    def image_candidates(self, pin: Pin):
+        """Images of `pin` that fit the policy, widest first. The smallest image if none fits."""
+        images = []
+        for size, image in pin.images.items():
+            if image and image.url:
+                # orig without a known width is bigger than every tier
+                width = image.width or tier_width(size) or (float('inf') if size == 'orig' else 0)
+                images.append((width, image))
+        if not images:
+            return []
+
+        images.sort(key=lambda item: item[0], reverse=True)
+        candidates = [image for width, image in images if not self.max_width or width <= self.max_width]
+        return candidates or [images[-1][1]]
+
+    def choose_image(self, pin: Pin):
+        candidates = self.image_candidates(pin)
+        return candidates[0] if candidates else None
+
+    def video_candidates(self, pin: Pin):
+        """
+        Downloadable video variants of `pin` that fit the policy, widest first and direct mp4 files before
+        HLS playlists of the same width. The narrowest variant if none fits.
+        """
+        videos = [video for video in pin.videos if video.url and (is_hls(video.url) or is_direct_video(video.url))]
+        if not videos:
+            return []
+
+        videos.sort(key=lambda video: (video.width or 0, not is_hls(video.url)), reverse=True)
+        candidates = [video for video in videos if not self.max_width or not video.width or video.width <= self.max_width]
+        return candidates or [videos[-1]]
+
+    def choose_video(self, pin: Pin):
+        candidates = self.video_candidates(pin)
+        return candidates[0] if candidates else None
+
+def is_hls(url: str):
+    return urlparse(url or '').path.endswith('.m3u8')
+
+
+def is_direct_video(url: str):
+    return os.path.splitext(urlparse(url or '').path)[1].lower() in ('.mp4', '.mov', '.m4v')
+
+
+def sniff_extension(path: str, content_type: str | None = None, url: str | None = None):
+    """Extension of the file at `path` from its magic bytes, falling back to `content_type` and then to the url."""
+    try:
+        with open(path, 'rb') as file:
+            head = file.read(16)
+    except OSError:
+        head = b''
+
+    if head.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return '.gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'heic', b'heix', b'mif1'):
+            return '.heic'
+        if brand == b'avif':
+            return '.avif'
+        if brand == b'qt  ':
+            return '.mov'
+        return '.mp4'
+
+    if content_type:
+        extension = CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+        if extension:
+            return extension
+    extension = os.path.splitext(urlparse(url or '').path)[1].lower()
+    return extension or '.bin'
+
+
+DEFAULT_POLICY = QualityPolicy()
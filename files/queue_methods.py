@@ -0,0 +1,417 @@
+from .commons import DOWNLOAD_PATH, LOG_PATH
+from .http_methods import get_user
+from .crawl_methods import PinterestCrawler, DEFAULT_CONCURRENCY
+from .checkpoint_methods import CrawlCheckpoint
+from .index_methods import MetadataIndex, IndexSink
+from .model_methods import Board
+from .stream_methods import CREATED_BOARD
+from .metrics_methods import METRICS
+from . import codec_methods as codec
+
+import os, time, socket, logging, sqlite3, threading, multiprocessing
+
+QUEUE_PATH = os.path.join(DOWNLOAD_PATH, 'jobs.sqlite')
+DEFAULT_LEASE = 60.0
+MAX_ATTEMPTS = 5
+POLL_INTERVAL = 1.0
+
+ACCOUNT, CREATED, BOARD, EXPORT = 'account', 'created', 'board', 'export'
+# Exports first so finished accounts are written out, accounts last so boards already listed are crawled first
+PRIORITY = {EXPORT: 0, CREATED: 1, BOARD: 1, ACCOUNT: 2}
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+
+class LeaseLost(Exception):
+    """The lease of a job expired and another worker may have claimed it."""
+
+
+class Job:
+    __slots__ = ('id', 'kind', 'username', 'key', 'payload', 'attempts', 'owner')
+
+    def __init__(self, id, kind, username, key, payload, attempts, owner):
+        self.id = id
+        self.kind = kind
+        self.username = username
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+        self.owner = owner
+
+    def __repr__(self):
+        return f'Job({self.id}, {self.kind}, {self.username}, {self.key})'
+
+
+class JobQueue:
+    """
+    Durable queue of crawl jobs in SQLite, shared by worker processes on one host or, through a shared
+    file system, several.
+
+    The queue (like the indexes and checkpoints the workers write) uses SQLite's rollback journal, not WAL:
+    WAL needs memory shared between the processes and breaks over network file systems. The rollback journal
+    only relies on file locks, so hosts sharing a queue need a file system whose locks work across hosts
+    (NFSv4, or NFSv3 with lockd; not SMB mounts without byte range locks).
+
+    Workers claim a job with a lease and renew it with heartbeats. A job whose lease expired (its worker died
+    or hangs) is claimed again by the next worker, and only the current lease holder can complete it, so a
+    reclaimed job is never finished twice. Claims and completions are serialized by `BEGIN IMMEDIATE`.
+    Leases compare wall clocks, hosts sharing a queue need synchronized clocks.
+    """
+
+    def __init__(self, path: str = QUEUE_PATH, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=DELETE')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY, kind TEXT NOT NULL, username TEXT NOT NULL, key TEXT NOT NULL, priority INTEGER NOT NULL, '
+                'payload TEXT, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, owner TEXT, lease_expires REAL, '
+                'error TEXT, created_at REAL, updated_at REAL, UNIQUE (kind, username, key))'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_user ON jobs (username, kind, status)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self):
+        return _Immediate(self)
+
+    def _put(self, kind: str, username: str, key: str, payload=None):
+        """Adds a job, or queues a finished or failed one again, which is how a later run rescrapes."""
+        now = time.time()
+        self.connection.execute(
+            'INSERT INTO jobs (kind, username, key, priority, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(kind, username, key) DO UPDATE SET payload = excluded.payload, status = excluded.status, attempts = 0, '
+            'owner = NULL, lease_expires = NULL, error = NULL, updated_at = excluded.updated_at WHERE jobs.status IN (?, ?)',
+            (kind, username, key, PRIORITY[kind], None if payload is None else codec.dumps(payload), PENDING, now, now, DONE, FAILED)
+        )
+
+    def add_account(self, username: str):
+        with self._transaction():
+            self._put(ACCOUNT, username, '')
+
+    def claim(self, owner: str, lease: float = DEFAULT_LEASE):
+        """Leases the next pending (or expired) job to `owner`, None when there is nothing to do right now."""
+        now = time.time()
+        with self._transaction():
+            while True:
+                row = self.connection.execute(
+                    'SELECT id, kind, username, key, payload, attempts FROM jobs '
+                    'WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY priority, id LIMIT 1',
+                    (PENDING, LEASED, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[5] < self.max_attempts:
+                    break
+                # Its workers kept dying, give up on it instead of taking the next worker down too
+                self.connection.execute('UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?', (FAILED, 'lease expired too often', now, row[0]))
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                (LEASED, owner, now + lease, now, row[0])
+            )
+        METRICS.inc('queue_jobs_total', kind=row[1], result='claimed')
+        return Job(row[0], row[1], row[2], row[3], codec.loads(row[4]) if row[4] else {}, row[5] + 1, owner)
+
+    def heartbeat(self, job: Job, lease: float = DEFAULT_LEASE):
+        """Extends the lease, False if the job is no longer leased to its owner."""
+        with self._transaction():
+            updated = self.connection.execute(
+                'UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = ?',
+                (time.time() + lease, time.time(), job.id, job.owner, LEASED)
+            ).rowcount
+        return updated == 1
+
+    def complete(self, job: Job, children: list = ()):
+        """
+        Marks a job done and queues its `children` (`(kind, key, payload)` tuples) in the same transaction.
+        Queues the export of the account once its last created/board job is done. Raises LeaseLost if the
+        job was reclaimed meanwhile, in which case nothing is changed.
+        """
+        with self._transaction():
+            updated = self.connection.execute(
+                'UPDATE jobs SET status = ?, lease_expires = NULL, error = NULL, updated_at = ? WHERE id = ? AND owner = ? AND status = ?',
+                (DONE, time.time(), job.id, job.owner, LEASED)
+            ).rowcount
+            if updated != 1:
+                raise LeaseLost(f'{job} is no longer leased to {job.owner}')
+            if job.kind == ACCOUNT:
+                # Boards of an earlier run that are no longer listed must not hold back the export
+                self.connection.execute(
+                    'DELETE FROM jobs WHERE username = ? AND kind IN (?, ?) AND status IN (?, ?)', (job.username, CREATED, BOARD, DONE, FAILED)
+                )
+            for kind, key, payload in children:
+                self._put(kind, job.username, key, payload)
+            if job.kind in (CREATED, BOARD):
+                remaining = self.connection.execute(
+                    'SELECT COUNT(*) FROM jobs WHERE username = ? AND kind IN (?, ?) AND status != ?', (job.username, CREATED, BOARD, DONE)
+                ).fetchone()[0]
+                if not remaining:
+                    self._put(EXPORT, job.username, '', {'generation': job.payload.get('generation')})
+        METRICS.inc('queue_jobs_total', kind=job.kind, result='done')
+
+    def fail(self, job: Job, error: str):
+        """Gives the job back for another attempt, or fails it for good after `max_attempts`."""
+        status = FAILED if job.attempts >= self.max_attempts else PENDING
+        with self._transaction():
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL, error = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = ?',
+                (status, error, time.time(), job.id, job.owner, LEASED)
+            )
+        METRICS.inc('queue_jobs_total', kind=job.kind, result='failed' if status == FAILED else 'retried')
+
+    def counts(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def failures(self):
+        with self.lock:
+            return self.connection.execute('SELECT kind, username, key, attempts, error FROM jobs WHERE status = ? ORDER BY id', (FAILED,)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class _Immediate:
+    """Write transaction taking the database lock up front, so two claims never pick the same row."""
+
+    def __init__(self, queue: JobQueue):
+        self.queue = queue
+
+    def __enter__(self):
+        self.queue.lock.acquire()
+        try:
+            self.queue.connection.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self.queue.lock.release()
+            raise
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            self.queue.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.queue.lock.release()
+
+
+class Heartbeat:
+    """Renews the lease of a job every third of the lease from a daemon thread while the job runs."""
+
+    def __init__(self, queue: JobQueue, job: Job, lease: float):
+        self.queue = queue
+        self.job = job
+        self.lease = lease
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f'heartbeat-{job.id}', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.lease / 3):
+            try:
+                if not self.queue.heartbeat(self.job, self.lease):
+                    logging.warning(f'Lost the lease of {self.job}')
+                    self.lost.set()
+                    return
+            except sqlite3.Error as e:
+                logging.warning(f'Heartbeat of {self.job} failed: {e}')
+
+
+class CrawlWorker:
+    """
+    Claims and runs jobs until the queue is drained.
+
+    An account job lists the boards and queues one created job and one job per board, which crawl into the
+    account's metadata index through its checkpoint. A reclaimed job resumes from the pages its dead worker
+    already checkpointed, and pins are written as upserts, so crawling a board twice never duplicates it.
+    The export job writes `<username>.json` from the index once every board is done.
+    """
+
+    def __init__(self, queue: JobQueue, name: str | None = None, lease: float = DEFAULT_LEASE,
+                 concurrency: int = DEFAULT_CONCURRENCY, verbose: bool = True, compact: bool = False):
+        self.queue = queue
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease = lease
+        self.concurrency = concurrency
+        self.verbose = verbose
+        self.compact = compact
+        self.done = 0
+
+    def log(self, message: str):
+        if self.verbose:
+            print(f'[{self.name}] {message}'.expandtabs(4), flush=True)
+
+    def run(self, wait: bool = True):
+        """Runs jobs until none is pending or leased, with `wait=False` until none can be claimed right now."""
+        while True:
+            job = self.queue.claim(self.name, self.lease)
+            if job is None:
+                counts = self.queue.counts()
+                if not wait or not (counts[PENDING] or counts[LEASED]):
+                    return self.done
+                # Others still work on jobs that may queue more, or may die and leave them to us
+                time.sleep(POLL_INTERVAL)
+                continue
+            self.run_job(job)
+
+    def run_job(self, job: Job):
+        started = time.perf_counter()
+        try:
+            with Heartbeat(self.queue, job, self.lease) as heartbeat:
+                children = getattr(self, f'run_{job.kind}')(job)
+            if heartbeat.lost.is_set():
+                raise LeaseLost(f'{job} was reclaimed while it ran')
+            self.queue.complete(job, children or ())
+            self.done += 1
+            self.log(f'{job.kind} {job.username} {job.key} done in {time.perf_counter() - started:.1f}s')
+        except LeaseLost as e:
+            # Whoever holds it now finishes it
+            self.log(f'{e}, dropping it')
+        except Exception as e:
+            logging.error(f'{job} failed: {e} [{e.__class__.__name__}]')
+            self.log(f'{job.kind} {job.username} {job.key} failed: {e} [{e.__class__.__name__}]')
+            self.queue.fail(job, f'{e} [{e.__class__.__name__}]')
+
+    def _crawler(self, checkpoint: CrawlCheckpoint, sink=None):
+        return PinterestCrawler(self.concurrency, verbose=False, checkpoint=checkpoint, sink=sink, collect=False)
+
+    @staticmethod
+    def _open(username: str):
+        os.makedirs(os.path.join(LOG_PATH, username), exist_ok=True)
+        return MetadataIndex.for_user(username, shared=True), CrawlCheckpoint.for_user(username, shared=True)
+
+    def run_account(self, job: Job):
+        userinfo = get_user(job.username, verbose=False)
+        if not userinfo.get('username'):
+            raise LookupError(f'no such user {job.username}')
+
+        index, checkpoint = self._open(job.username)
+        try:
+            sink = IndexSink(index)
+            sink.user(userinfo)
+            with self._crawler(checkpoint) as crawler:
+                listed = crawler.run(crawler.crawl_boards(userinfo))
+                if crawler.incomplete:
+                    raise IOError(f'incomplete board listing of {job.username}')
+            index.add_boards([(position, Board.from_raw(board, with_pins=False)) for position, board in enumerate(listed)], sink.generation)
+        finally:
+            checkpoint.close()
+            index.close()
+
+        return [(CREATED, CREATED_BOARD, {'generation': sink.generation, 'user': userinfo})] + [
+            (BOARD, str(board['id']), {'generation': sink.generation, 'position': position, 'board': dict(board)})
+            for position, board in enumerate(listed)
+        ]
+
+    def _crawl_feed(self, job: Job, crawl):
+        index, checkpoint = self._open(job.username)
+        try:
+            sink = IndexSink(index, generation=job.payload['generation'], board_position=job.payload.get('position', 0))
+            with self._crawler(checkpoint, sink) as crawler:
+                crawler.run(crawl(crawler))
+                if crawler.incomplete:
+                    raise IOError(f'gave up on {", ".join(sorted(crawler.incomplete))}')
+        finally:
+            checkpoint.close()
+            index.close()
+
+    def run_created(self, job: Job):
+        self._crawl_feed(job, lambda crawler: crawler.crawl_created_pins(job.payload['user']))
+
+    def run_board(self, job: Job):
+        self._crawl_feed(job, lambda crawler: crawler.crawl_board(job.payload['board']))
+
+    def run_export(self, job: Job):
+        index, checkpoint = self._open(job.username)
+        try:
+            # The scrape counts only now that all of its feeds are in
+            index.finish(generation=job.payload.get('generation'))
+            document = index.export_json(os.path.join(DOWNLOAD_PATH, job.username, job.username + '.json'), self.compact)
+            # The next run of the account starts from scratch
+            checkpoint.clear()
+        finally:
+            checkpoint.close()
+            index.close()
+        self.log(f'{job.username}: {document["total_created_pins"]} created pins and {len(document["boards"])} boards exported')
+
+
+def enqueue_accounts(sources: list, path: str = QUEUE_PATH):
+    """Queues an account job for every profile/board url or username, returns the usernames."""
+    from .batch_methods import resolve_username
+
+    usernames = []
+    with JobQueue(path) as queue:
+        for source in sources:
+            username = resolve_username(source)
+            if not username:
+                print(f'----$ Skipping {source}: not a pinterest profile or board url')
+                continue
+            if username not in usernames:
+                queue.add_account(username)
+                usernames.append(username)
+    return usernames
+
+
+def _worker_main(path: str, lease: float, concurrency: int, budgets: dict | None, rotate_user_agent: bool = False, compact: bool = False):
+    from .commons import RATE_LIMITER, SESSIONS
+    SESSIONS.rotate_user_agent = rotate_user_agent
+    for suffix, rate in (budgets or {}).items():
+        RATE_LIMITER.set_budget(suffix, rate)
+    logging.basicConfig(
+        filename=os.path.join(LOG_PATH, 'workers.log'),
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(processName)s %(filename)s:%(lineno)d - %(message)s'
+    )
+    with JobQueue(path) as queue:
+        CrawlWorker(queue, lease=lease, concurrency=concurrency, compact=compact).run()
+
+
+def start_workers(workers: int, path: str = QUEUE_PATH, lease: float = DEFAULT_LEASE, concurrency: int = DEFAULT_CONCURRENCY,
+                  budgets: dict | None = None, rotate_user_agent: bool = False, compact: bool = False):
+    os.makedirs(LOG_PATH, exist_ok=True)
+    workers = max(1, workers)
+    # Budgets are for the whole host, every process paces itself on its share
+    budgets = {suffix: rate / workers for suffix, rate in (budgets or {}).items()} or None
+    processes = [
+        multiprocessing.Process(target=_worker_main, args=(path, lease, concurrency, budgets, rotate_user_agent, compact), name=f'worker-{number}')
+        for number in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def run_workers(workers: int, path: str = QUEUE_PATH, lease: float = DEFAULT_LEASE, concurrency: int = DEFAULT_CONCURRENCY,
+                budgets: dict | None = None, rotate_user_agent: bool = False, compact: bool = False):
+    """
+    Runs `workers` worker processes on this host until the queue is drained, returns the final counts.
+    `budgets` are requests per second by host suffix (see RateLimiter.set_budget) for all processes together.
+    With `rotate_user_agent` every session of the workers gets its own random User-Agent,
+    with `compact` the exported documents are written without indentation.
+    """
+    processes = start_workers(workers, path, lease, concurrency, budgets, rotate_user_agent, compact)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
+    with JobQueue(path) as queue:
+        return queue.counts()
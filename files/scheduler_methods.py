@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+from .metrics_methods import METRICS
+
+import logging, threading
+
+# Jobs at once per host, matched on the end of the hostname like limiter_methods.HOST_LIMITS:
+# all hosts matching a suffix share its slots, so i.pinimg.com and v1.pinimg.com count together.
+HOST_LIMITS = {'pinimg.com': 32}
+# Jobs per host matching no suffix, None for as many as there are workers
+DEFAULT_HOST_LIMIT = None
+
+
+class DownloadScheduler:
+    """
+    One worker pool and work queue for a whole download job.
+
+    Every board feeds its pins into the same pool, so workers never idle at board boundaries. At most
+    `host_limits[suffix]` jobs talk to the hosts ending in `suffix` at a time (`default_host_limit` to any
+    other host): a job over the limit waits in a queue of its host and is handed to the pool when a job of
+    that host finishes, so no worker is ever blocked waiting for a busy host while jobs for other hosts are queued. `submit` blocks once
+    `max_pending` jobs are queued so a producer can not run far ahead of the workers.
+    """
+
+    def __init__(self, max_workers: int = 50, host_limits: dict | None = None, default_host_limit: int | None = DEFAULT_HOST_LIMIT,
+                 max_pending: int | None = None):
+        self.max_workers = max_workers
+        self.host_limits = HOST_LIMITS if host_limits is None else host_limits
+        self.default_host_limit = default_host_limit or max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download')
+        self.pending = threading.BoundedSemaphore(max_pending or max_workers * 4)
+        self.lock = threading.Lock()
+        self.all_done = threading.Condition(self.lock)
+        self.host_active = {}
+        self.host_waiting = {}
+        self.queued = 0
+        self.running = 0
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _slot(self, host: str):
+        """The key `host` is counted under (its matching suffix, or itself) and the limit of that key."""
+        host = (host or '').lower()
+        for suffix, limit in self.host_limits.items():
+            if host == suffix or host.endswith('.' + suffix):
+                return suffix, limit
+        return host, self.default_host_limit
+
+    def _run(self, host: str, future: Future, function, args):
+        if future.set_running_or_notify_cancel():
+            with self.lock:
+                self.running += 1
+            METRICS.add('download_running', 1)
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                METRICS.add('download_running', -1)
+        self._release(host)
+
+    def _release(self, host: str):
+        """Frees the slot of a finished job of `host` for the next job waiting for it."""
+        with self.lock:
+            waiting = self.host_waiting.get(host)
+            if waiting:
+                job = waiting.popleft()
+            else:
+                self.host_active[host] -= 1
+                return
+        self._start(host, *job)
+
+    def _start(self, host: str, future: Future, function, args):
+        try:
+            # Jobs still queued in the pool when it shuts down are cancelled with it
+            self.executor.submit(self._run, host, future, function, args).add_done_callback(
+                lambda task: task.cancelled() and future.cancel()
+            )
+        except RuntimeError:
+            # The pool was shut down, see close
+            future.cancel()
+            self._release(host)
+
+    def _done(self, future):
+        self.pending.release()
+        METRICS.add('download_queue_depth', -1)
+        with self.lock:
+            self.queued -= 1
+            try:
+                self.total += future.result() or 0
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.error(f'Download job failed: {e.args} [{e.__class__.__name__}]')
+            if not self.queued:
+                self.all_done.notify_all()
+
+    def submit(self, host: str, function, *args):
+        """Queues `function(*args)`, whose result is added to `total`. Blocks while the queue is full."""
+        self.pending.acquire()
+        with self.lock:
+            self.queued += 1
+        METRICS.add('download_queue_depth', 1)
+        host, limit = self._slot(host)
+        future = Future()
+        future.add_done_callback(self._done)
+        with self.lock:
+            active = self.host_active.get(host, 0)
+            start = active < limit
+            if start:
+                self.host_active[host] = active + 1
+            else:
+                self.host_waiting.setdefault(host, deque()).append((future, function, args))
+        if start:
+            self._start(host, future, function, args)
+        return future
+
+    @property
+    def depth(self):
+        """Jobs queued or running."""
+        with self.lock:
+            return self.queued
+
+    def join(self):
+        """Waits until every queued job finished and returns the summed results."""
+        with self.lock:
+            while self.queued:
+                self.all_done.wait()
+            return self.total
+
+    def close(self):
+        with self.lock:
+            waiting = [job[0] for jobs in self.host_waiting.values() for job in jobs]
+            self.host_waiting.clear()
+        for future in waiting:
+            future.cancel()
+        self.executor.shutdown(wait=True, cancel_futures=True)
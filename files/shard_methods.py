@@ -0,0 +1,187 @@
+from .store_methods import BlobStore, file_digest, CHUNK_SIZE
+from .manifest_methods import DownloadManifest
+from .quality_methods import sniff_extension
+
+import os, re, glob, sqlite3, tarfile, threading, time
+
+SHARD_DIRNAME = '.shards'
+DEFAULT_SHARD_BYTES = 1024 ** 3
+SHARD_RE = re.compile(r'^shard-(\d+)\.tar$')
+
+
+def read_member(path: str, offset: int, size: int):
+    """The `size` bytes at `offset` of a shard, i.e. one packed file, without reading the tar headers."""
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        data = file.read(size)
+    if len(data) != size:
+        raise EOFError(f'{path} ends before {offset + size}')
+    return data
+
+
+def copy_member(path: str, offset: int, size: int, destination: str):
+    with open(path, 'rb') as source, open(destination, 'wb') as target:
+        source.seek(offset)
+        while size > 0:
+            chunk = source.read(min(CHUNK_SIZE, size))
+            if not chunk:
+                raise EOFError(f'{path} ends before {offset + size}')
+            target.write(chunk)
+            size -= len(chunk)
+
+
+class ShardStore(BlobStore):
+    """
+    A BlobStore that appends media to a few big tar shards (`<root>/shard-<n>.tar`) instead of keeping one
+    file per blob, for accounts with so many pins that inodes, directory listings and backups suffer.
+
+    Every blob is one tar member named after its sha256, so a shard is a plain tar anybody can list and extract.
+    `<root>/index.sqlite` maps a source to its blob and a blob to the shard and byte offset of its data,
+    which is what random reads use (see read_member). Appends are serialized, a shard is closed once it
+    would grow past `max_bytes` and every run starts a new one, so a shard of an interrupted run is never
+    written again: it only lacks the tar end marker and its index rows only point to data already written.
+    """
+
+    packed = True
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_SHARD_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_path = os.path.join(root, 'tmp')
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.in_flight = {}
+        self.stats = {'fetched': 0, 'reused': 0, 'deduplicated': 0}
+        self.tar = None
+        self.shard = None
+
+        os.makedirs(self.tmp_path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False, timeout=30)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS sources (key TEXT PRIMARY KEY, sha256 TEXT NOT NULL)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS members ('
+                'sha256 TEXT PRIMARY KEY, shard TEXT NOT NULL, offset INTEGER NOT NULL, size INTEGER NOT NULL, '
+                'extension TEXT NOT NULL, added_at INTEGER)'
+            )
+
+    def shard_path(self, shard: str):
+        return os.path.join(self.root, shard)
+
+    def member(self, digest: str):
+        """`(shard, offset, size, extension)` of a packed blob whose data is still in its shard, or None."""
+        with self.lock:
+            row = self.connection.execute('SELECT shard, offset, size, extension FROM members WHERE sha256 = ?', (digest,)).fetchone()
+        try:
+            return row if row and os.path.getsize(self.shard_path(row[0])) >= row[1] + row[2] else None
+        except OSError:
+            return None
+
+    def lookup(self, key: str):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT sources.sha256, members.size FROM sources JOIN members USING (sha256) WHERE key = ?', (key,)
+            ).fetchone()
+        return row if row and self.member(row[0]) else None
+
+    def _next_shard(self):
+        numbers = [int(match.group(1)) for match in (SHARD_RE.match(os.path.basename(path)) for path in glob.glob(self.shard_path('shard-*.tar'))) if match]
+        number = max(numbers, default=0) + 1
+        while True:
+            shard = f'shard-{number:05d}.tar'
+            try:
+                # Exclusive, so another process packing into the same root never shares a shard
+                return shard, tarfile.open(self.shard_path(shard), 'x')
+            except FileExistsError:
+                number += 1
+
+    def _append(self, digest: str, path: str, size: int, extension: str):
+        if self.tar is not None and self.tar.offset and self.tar.offset + size > self.max_bytes:
+            self.tar.close()
+            self.tar = None
+        if self.tar is None:
+            self.shard, self.tar = self._next_shard()
+
+        info = tarfile.TarInfo(f'{digest[:2]}/{digest}{extension}')
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        # The data follows the member's header, which is what addfile writes first
+        offset = self.tar.offset + len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+        with open(path, 'rb') as file:
+            self.tar.addfile(info, file)
+        self.tar.fileobj.flush()
+        return self.shard, offset
+
+    def add_file(self, key: str, path: str, digest: str | None = None):
+        """Appends the file at `path` to the open shard (unless identical content is packed already) and indexes it under `key`."""
+        digest = digest or file_digest(path)
+        size = os.path.getsize(path)
+
+        with self.write_lock:
+            if self.member(digest):
+                with self.lock:
+                    self.stats['deduplicated'] += 1
+            else:
+                extension = sniff_extension(path)
+                shard, offset = self._append(digest, path, size, extension)
+                with self.lock, self.connection:
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO members (sha256, shard, offset, size, extension, added_at) VALUES (?, ?, ?, ?, ?, ?)',
+                        (digest, shard, offset, size, extension, int(time.time()))
+                    )
+                    self.stats['fetched'] += 1
+            with self.lock, self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO sources (key, sha256) VALUES (?, ?)', (key, digest))
+        return digest, size
+
+    def extension(self, digest: str, content_type: str | None = None, url: str | None = None):
+        member = self.member(digest)
+        return (member and member[3]) or sniff_extension('', content_type, url)
+
+    def _packed(self, digest: str):
+        member = self.member(digest)
+        if member is None:
+            raise LookupError(f'{digest} is not packed in {self.root}')
+        return self.shard_path(member[0]), member[1], member[2]
+
+    def locate(self, digest: str):
+        """`(shard_path, offset)` of a packed blob, which is what DownloadManifest.record takes."""
+        return self._packed(digest)[:2]
+
+    def read(self, digest: str):
+        return read_member(*self._packed(digest))
+
+    def link(self, digest: str, destination: str):
+        """Extracts a packed blob to `destination`, packed downloads themselves never do that."""
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        copy_member(*self._packed(digest), destination)
+        return 'copy'
+
+    def close(self):
+        with self.write_lock, self.lock:
+            if self.tar is not None:
+                self.tar.close()
+                self.tar = None
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def unpack(root: str, target: str):
+    """
+    Writes every packed file the manifest of the download root `root` has to its path under `target`,
+    the tree a download without packing would have made. Returns `(files, bytes)`.
+    """
+    files = total = 0
+    with DownloadManifest(root) as manifest:
+        for path, shard_path, offset, size in manifest.packed():
+            destination = os.path.join(target, path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            copy_member(shard_path, offset, size, destination)
+            files += 1
+            total += size
+    return files, total
+
@@ -0,0 +1,157 @@
+from .quality_methods import sniff_extension
+from . import codec_methods as codec
+
+import os, hashlib, logging, shutil, threading
+
+STORE_DIRNAME = '.store'
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_file(source: str, destination: str):
+    """Hardlinks `source` to `destination`, falling back to a symlink and then to a copy."""
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(source), destination)
+        return 'symlink'
+    except OSError:
+        pass
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+
+class BlobStore:
+    """
+    Content-addressed store of downloaded media.
+
+    Every blob is kept once under `<root>/<sha256[:2]>/<sha256>`, an append-only index maps the source
+    (an url) to its blob, and board folders only get links to the blobs. Concurrent requests for the
+    same source wait for the first one instead of downloading it again.
+    """
+
+    packed = False
+
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.jsonl')
+        self.tmp_path = os.path.join(root, 'tmp')
+        self.lock = threading.Lock()
+        self.index = {}
+        self.in_flight = {}
+        self.stats = {'fetched': 0, 'reused': 0, 'deduplicated': 0}
+
+        os.makedirs(self.tmp_path, exist_ok=True)
+        self._load_index()
+        self.index_file = open(self.index_path, 'a', encoding='utf-8')
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8', errors='ignore') as file:
+            for line in file:
+                try:
+                    entry = codec.loads(line)
+                    self.index[entry['key']] = (entry['sha256'], entry['size'])
+                except Exception:
+                    # A torn last line of an interrupted run
+                    continue
+
+    def blob_path(self, digest: str):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def lookup(self, key: str):
+        """Returns `(digest, size)` of a stored source, or None."""
+        with self.lock:
+            entry = self.index.get(key)
+        if entry and os.path.exists(self.blob_path(entry[0])):
+            return entry
+        return None
+
+    def get(self, key: str, produce, revalidate=None):
+        """
+        Returns `(digest, size)` of the blob for `key`, calling `produce(temp_path) -> bool` to create it
+        if it is not stored yet. Returns None when producing failed.
+        A stored blob is only reused if `revalidate(key)`, when given, returns True.
+        """
+        while True:
+            entry = self.lookup(key)
+            if entry and (revalidate is None or revalidate(key)):
+                with self.lock:
+                    self.stats['reused'] += 1
+                return entry
+
+            with self.lock:
+                event = self.in_flight.get(key)
+                if event is None:
+                    event = self.in_flight[key] = threading.Event()
+                    break
+            # Someone else is producing it, wait and look again
+            event.wait()
+            revalidate = None
+            if not self.lookup(key):
+                return None
+
+        try:
+            return self._produce(key, produce)
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            event.set()
+
+    def temp_path(self, key: str):
+        # Stable per source so a partial download of an interrupted run can be resumed
+        return os.path.join(self.tmp_path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _produce(self, key: str, produce):
+        temp_path = self.temp_path(key)
+        try:
+            if not produce(temp_path) or not os.path.exists(temp_path):
+                return None
+            return self.add_file(key, temp_path)
+        except Exception as e:
+            logging.error(f'Unable to store {key}: {e.args} [{e.__class__.__name__}]')
+            return None
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def add_file(self, key: str, path: str, digest: str | None = None):
+        """Moves the file at `path` into the store (unless identical content is already there) and indexes it under `key`."""
+        digest = digest or file_digest(path)
+        size = os.path.getsize(path)
+        blob_path = self.blob_path(digest)
+
+        with self.lock:
+            if os.path.exists(blob_path):
+                self.stats['deduplicated'] += 1
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(path, blob_path)
+                self.stats['fetched'] += 1
+            self.index[key] = (digest, size)
+            self.index_file.write(codec.dumps({'key': key, 'sha256': digest, 'size': size}) + '\n')
+            self.index_file.flush()
+        return digest, size
+
+    def extension(self, digest: str, content_type: str | None = None, url: str | None = None):
+        return sniff_extension(self.blob_path(digest), content_type, url)
+
+    def link(self, digest: str, destination: str):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        return link_file(self.blob_path(digest), destination)
+
+    def close(self):
+        with self.lock:
+            if not self.index_file.closed:
+                self.index_file.close()
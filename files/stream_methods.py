@@ -0,0 +1,87 @@
+from .parser_methods import get_simple_user_info, get_simple_pin_info
+from .model_methods import Board
+
+from . import codec_methods as codec
+
+import gzip, threading
+
+CREATED_BOARD = 'created'
+# Accounts with at least this many pins are offered the streaming (JSON Lines) output
+STREAM_PIN_THRESHOLD = 20000
+
+
+def is_stream_file(path: str):
+    return path.endswith('.jsonl') or path.endswith('.jsonl.gz')
+
+
+def open_stream(path: str, mode: str = 'r'):
+    """Opens a JSON Lines file in text mode, gzip-compressed when the name ends with `.gz`."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', errors='ignore')
+    return open(path, mode, encoding='utf-8', errors='ignore')
+
+
+def iter_records(path: str):
+    """
+    Yields the records of a stream file one at a time:
+    one `user` record, `board` records (without pins) and `pin` records whose `board` is the board id or 'created'.
+    """
+    with open_stream(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield codec.loads(line)
+
+
+class JsonlWriter:
+    """Thread-safe writer of one JSON record per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open_stream(path, 'w')
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record_type: str, record: dict):
+        line = codec.dumps({'type': record_type, **record})
+        with self.lock:
+            self.file.write(line + '\n')
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+class StreamSink:
+    """
+    Receives raw pages from the crawler, converts them like `pretty_save_with_correct_data`
+    and writes them out as they arrive instead of keeping them in memory.
+    """
+
+    def __init__(self, writer: JsonlWriter):
+        self.writer = writer
+        self.pin_count = 0
+        self.created_count = 0
+
+    def user(self, raw_user: dict):
+        self.writer.write('user', get_simple_user_info(raw_user))
+
+    def board(self, raw_board: dict):
+        self.writer.write('board', Board.from_raw(raw_board, with_pins=False).to_dict(with_pins=False))
+
+    def pins(self, board_id, raw_pins: list):
+        for pin in raw_pins:
+            info = get_simple_pin_info(pin)
+            if info:
+                self.writer.write('pin', {'board': str(board_id), **info})
+                self.pin_count += 1
+                if str(board_id) == CREATED_BOARD:
+                    self.created_count += 1
@@ -0,0 +1,146 @@
+from requests import RequestException
+from .metrics_methods import METRICS, host_of
+
+import os, re, logging
+
+CHUNK_SIZE = 256 * 1024
+TIMEOUT = (10, 60)
+PART_SUFFIX = '.part'
+VALIDATOR_SUFFIX = '.validator'
+
+
+def parse_content_range(value: str | None):
+    """Returns `(start, total)` of a `Content-Range: bytes start-end/total` header, None when unknown."""
+    match = re.match(r'bytes\s+(\d+|\*)-?(\d*)/(\d+|\*)', value or '')
+    if not match:
+        return None, None
+    start = int(match.group(1)) if match.group(1) != '*' else None
+    total = int(match.group(3)) if match.group(3) != '*' else None
+    return start, total
+
+
+def response_validator(response):
+    """The strong ETag, or else the Last-Modified date, of a response: what If-Range can compare (weak ETags cannot)."""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def read_validator(part_path: str):
+    try:
+        with open(part_path + VALIDATOR_SUFFIX, encoding='utf-8') as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_validator(part_path: str, validator: str | None):
+    validator_path = part_path + VALIDATOR_SUFFIX
+    if validator:
+        with open(validator_path, 'w', encoding='utf-8') as file:
+            file.write(validator)
+    elif os.path.exists(validator_path):
+        os.remove(validator_path)
+
+
+def remove_part(part_path: str):
+    for file_path in (part_path, part_path + VALIDATOR_SUFFIX):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+class IncompleteDownload(IOError):
+    pass
+
+
+class TooLarge(IOError):
+    """The server announced a body bigger than the allowed `max_bytes`."""
+
+
+def stream_download(session, url: str, path: str, chunk_size: int = CHUNK_SIZE, retries: int = 3, headers: dict | None = None,
+                    max_bytes: int | None = None, info: dict | None = None):
+    """
+    Downloads `url` to `path` in `chunk_size` pieces through `path + '.part'`, which is renamed to `path`
+    only once complete. A `.part` left by a failed attempt (or an earlier run) is resumed with an HTTP Range
+    request whose If-Range carries the ETag/Last-Modified its bytes came with (kept in `.part.validator`),
+    so a file changed since then is sent whole and started over. A `.part` without a validator is not
+    resumed. Returns the size of the file, or None if the download failed.
+    Raises TooLarge, before reading the body, when the file is announced bigger than `max_bytes`.
+    The `Content-Type` of the response is put into `info` when given.
+    """
+    part_path = path + PART_SUFFIX
+
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = read_validator(part_path) if offset else None
+        if offset and not validator:
+            # Nothing tells whether the file is still the one these bytes are from
+            remove_part(part_path)
+            offset = 0
+        request_headers = dict(headers or {})
+        # Byte ranges and lengths must refer to the stored bytes, not to a compressed transfer
+        request_headers.setdefault('Accept-Encoding', 'identity')
+        if offset:
+            request_headers['Range'] = f'bytes={offset}-'
+            request_headers['If-Range'] = validator
+
+        try:
+            with session.get(url, headers=request_headers, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code == 416:
+                    # Nothing after `offset`, the part is either complete or bigger than the file
+                    _, total = parse_content_range(response.headers.get('Content-Range'))
+                    if total is not None and total == offset:
+                        break
+                    remove_part(part_path)
+                    continue
+
+                if response.status_code == 206:
+                    start, _ = parse_content_range(response.headers.get('Content-Range'))
+                    if start != offset:
+                        remove_part(part_path)
+                        continue
+                    mode = 'ab'
+                elif response.status_code == 200:
+                    # A first request, a file changed since the part was written or a server ignoring Range: start over
+                    mode, offset = 'wb', 0
+                    write_validator(part_path, response_validator(response))
+                else:
+                    logging.error(f'Unable to download {url}: HTTP {response.status_code}')
+                    return None
+
+                expected = response.headers.get('Content-Length')
+                if max_bytes:
+                    _, total = parse_content_range(response.headers.get('Content-Range'))
+                    if total is None and expected is not None and expected.isdigit():
+                        total = offset + int(expected)
+                    if total is not None and total > max_bytes:
+                        raise TooLarge(f'{url} has {total} bytes, more than {max_bytes}')
+                if info is not None:
+                    info['content_type'] = response.headers.get('Content-Type')
+
+                written = 0
+                try:
+                    with open(part_path, mode) as file:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            if chunk:
+                                file.write(chunk)
+                                written += len(chunk)
+                finally:
+                    METRICS.inc('http_response_bytes_total', written, host=host_of(url))
+
+                if expected is not None and expected.isdigit() and written != int(expected):
+                    raise IncompleteDownload(f'received {written} of {expected} bytes')
+            break
+        except TooLarge:
+            remove_part(part_path)
+            raise
+        except (RequestException, IOError) as e:
+            logging.warning(f'Download of {url} interrupted (attempt {attempt + 1}/{retries + 1}): {e} [{e.__class__.__name__}]')
+    else:
+        logging.error(f'Giving up on {url}, {part_path} is kept for the next run.')
+        return None
+
+    os.replace(part_path, path)
+    write_validator(part_path, None)
+    return os.path.getsize(path)
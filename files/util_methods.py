@@ -1,4 +1,59 @@
-import os
+import os, threading
 
 def clear():
     os.system('cls' if os.name in ['nt'] else 'clear')
+
+
+class NameRegistry:
+    """
+    Hands out unique file names per directory.
+
+    Each directory is listed once with `os.scandir` (or `list_names(directory)` when given, for names that
+    are not files, see DownloadManifest.names), after that names are reserved in memory under a lock,
+    so concurrent workers never pick the same name and the next free `_<n>` suffix is found in O(1).
+    """
+
+    def __init__(self, list_names=None):
+        self.lock = threading.Lock()
+        self.list_names = list_names
+        self.taken = {}
+        self.counters = {}
+
+    def _taken(self, directory: str):
+        taken = self.taken.get(directory)
+        if taken is None:
+            if self.list_names is not None:
+                taken = set(self.list_names(directory))
+            else:
+                try:
+                    with os.scandir(directory) as entries:
+                        taken = {entry.name for entry in entries}
+                except FileNotFoundError:
+                    taken = set()
+            self.taken[directory] = taken
+        return taken
+
+    def reserve(self, directory: str, name: str, extension: str = ''):
+        """Reserves and returns `name` or the first free `name_<n>` (without `extension`) in `directory`."""
+        with self.lock:
+            taken = self._taken(directory)
+            if name + extension not in taken:
+                taken.add(name + extension)
+                return name
+
+            key = (directory, name, extension)
+            counter = self.counters.get(key, 1)
+            while f'{name}_{counter}{extension}' in taken:
+                counter += 1
+            self.counters[key] = counter + 1
+            taken.add(f'{name}_{counter}{extension}')
+            return f'{name}_{counter}'
+
+    def release(self, directory: str, name: str, extension: str = ''):
+        """Gives back a name `reserve` returned that ended up unused, it is the first one handed out again."""
+        with self.lock:
+            self.taken.get(directory, set()).discard(name + extension)
+            base, _, number = name.rpartition('_')
+            key = (directory, base, extension)
+            if number.isdigit() and key in self.counters:
+                self.counters[key] = min(self.counters[key], int(number))
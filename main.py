@@ -1,22 +1,42 @@
-from files.http_methods import get_user, get_created_pins, get_all_boards
-from files.parser_methods import get_username, pretty_save_with_correct_data
+from files.http_methods import get_user, get_user_pins_and_boards
+from files.parser_methods import get_username, pretty_save_with_correct_data, set_logger
 from files.util_methods import clear
-from files.commons import DOWNLOAD_PATH, LOG_PATH
+from files.commons import DOWNLOAD_PATH, LOG_PATH, CACHE_PATH, SESSIONS, RATE_LIMITER
+from files.cache_methods import HttpCache, DEFAULT_TTL, DEFAULT_MAX_BYTES
 from files.download_methods import PinterestDownloader
+from files.quality_methods import QualityPolicy, TIERS
+from files.checkpoint_methods import CrawlCheckpoint
+from files.delta_methods import load_previous_document
+from files.stream_methods import JsonlWriter, StreamSink, is_stream_file, iter_records, STREAM_PIN_THRESHOLD
+from files.pipeline_methods import DownloadSink, TeeSink
+from files.index_methods import MetadataIndex, IndexSink
+from files.archive_methods import ResponseArchive, ArchiveReplay, archive_path
+from files.batch_methods import run_batch, read_sources
+from files.shard_methods import unpack, DEFAULT_SHARD_BYTES
+from files.queue_methods import enqueue_accounts, run_workers, QUEUE_PATH, DEFAULT_LEASE
+from files.crawl_methods import DEFAULT_CONCURRENCY
+from files.scheduler_methods import HOST_LIMITS
+from files.metrics_methods import METRICS, PeriodicExporter
+from files import codec_methods as codec
 
-import os, json
+import os, sys, argparse
 
-def download(filepath: str):
+def download(filepath: str, policy: QualityPolicy | None = None, index: MetadataIndex | None = None, shard_bytes: int | None = None):
     print(f'\tIt will take some time...'.expandtabs(4*3))
-    with open(filepath, 'r', errors='ignore', encoding='utf-8') as file:
-        data = json.load(file)
-    PinterestDownloader().download(data)
+    downloader = PinterestDownloader(policy, shard_bytes=shard_bytes)
+    if index is not None:
+        downloader.download_index(index)
+        return
+    if is_stream_file(filepath):
+        downloader.download_stream(filepath)
+        return
+    downloader.download(codec.load_file(filepath))
 
 def make_logging_path(username: str):
     path = os.path.join(LOG_PATH, username)
     os.makedirs(path, exist_ok=True)
 
-def main():
+def main(policy: QualityPolicy | None = None, archive_responses: bool = False, shard_bytes: int | None = None, compact: bool = False):
 
     while True:
 
@@ -34,40 +54,81 @@ def main():
 
             make_logging_path(username)
 
-            userinfo = get_user(username)
+            archive = ResponseArchive.for_user(username) if archive_responses else None
+            userinfo = get_user(username, archive=archive)
+            if not userinfo.get('username'):
+                if archive:
+                    archive.close()
+                print(f'[LookupError] No such user: {username}')
+                input('# Press enter to continue...')
+                continue
             created_pins, boards = [], []
 
-            clear()
+            download_dir = os.path.join(DOWNLOAD_PATH, userinfo['username'])
+            os.makedirs(download_dir, exist_ok=True)
+            json_path = os.path.join(download_dir, userinfo['username'] + '.json')
 
-            try:
-                created_pins = get_created_pins(userinfo)
-            except Exception as e:
-                print(f'[{e.__class__.__name__}] Error Retriving Created Pins: {e}')
-                input('# Press enter to continue...')
+            previous = load_previous_document(json_path)
+            if previous and input('\t--------> Previous scrape found, only fetch new pins?: '.expandtabs(4)).strip().lower() not in ['yes', 'y']:
+                previous = None
 
-            clear()
+            writer = None
+            if not previous and (userinfo.get('pin_count') or 0) >= STREAM_PIN_THRESHOLD:
+                if input(f'\t--------> {userinfo.get("pin_count")} pins, stream the output to {userinfo["username"]}.jsonl.gz?: '.expandtabs(4)).strip().lower() in ['yes', 'y']:
+                    json_path = os.path.join(download_dir, userinfo['username'] + '.jsonl.gz')
+                    writer = JsonlWriter(json_path)
+                    set_logger(userinfo['username'])
+
+            index = MetadataIndex.for_user(userinfo['username'])
+            index_sink = IndexSink(index, full=previous is None)
+
+            download_sink = None
+            if input('\t--------> Download the pins while scraping?: '.expandtabs(4)).strip().lower() in ['yes', 'y']:
+                downloader = PinterestDownloader(policy, shard_bytes=shard_bytes)
+                downloader.index = index
+                download_sink = DownloadSink(downloader)
 
+            clear()
 
+            checkpoint = CrawlCheckpoint.for_user(username)
             try:
-                boards = get_all_boards(userinfo)
+                created_pins, boards = get_user_pins_and_boards(
+                    userinfo, checkpoint=checkpoint, previous=previous,
+                    sink=TeeSink(index_sink, StreamSink(writer) if writer else None, download_sink),
+                    collect=writer is None, archive=archive
+                )
             except Exception as e:
-                print(f'[{e.__class__.__name__}] Error Retriving Boards: {e}')
+                print(f'[{e.__class__.__name__}] Error Retriving Pins And Boards: {e}')
                 input('# Press enter to continue...')
+            finally:
+                if download_sink:
+                    download_sink.close()
+                # An interrupted crawl must not hide what the last finished one found
+                index_sink.close(checkpoint.is_done('user'))
+                if archive:
+                    archive.close()
 
             clear()
 
-            massive_dict = {key: value for key, value in userinfo.items()}
-            massive_dict['created_pins'] = created_pins
-            massive_dict['boards'] = boards
+            if writer:
+                writer.close()
+                saved = True
+            else:
+                massive_dict = {key: value for key, value in userinfo.items()}
+                massive_dict['created_pins'] = created_pins
+                massive_dict['boards'] = boards
 
-            download_dir = os.path.join(DOWNLOAD_PATH, userinfo.username)
-            os.makedirs(download_dir, exist_ok=True)
+                saved = pretty_save_with_correct_data(massive_dict, json_path, previous, compact)
 
-            pretty_save_with_correct_data(massive_dict, os.path.join(download_dir, userinfo.username + '.json'))
-            print(f'\t----+ Info saved in: {os.path.join(download_dir, userinfo.username+'.json')}'.expandtabs(4))
+            # A finished crawl starts from scratch next time, an interrupted one resumes
+            if saved and checkpoint.is_done('user'):
+                checkpoint.clear()
+            checkpoint.close()
+            print(f'\t----+ Info saved in: {json_path} and {index.path}'.expandtabs(4))
             
-            if input('\t--------> Do you want to download the scraped file?: '.expandtabs(4)).strip().lower() in ['yes', 'y']:
-                download(os.path.join(download_dir, userinfo.username + '.json'))
+            if not download_sink and input('\t--------> Do you want to download the scraped file?: '.expandtabs(4)).strip().lower() in ['yes', 'y']:
+                download(json_path, policy, index, shard_bytes)
+            index.close()
 
             if input('\t--------> Do you want to scrap another user?: '.expandtabs(4)).strip().lower() in ['yes', 'y']:
                 continue
@@ -76,5 +137,135 @@ def main():
         except KeyboardInterrupt:
             break
 
+def export_index(username: str, compact: bool = False):
+    if not MetadataIndex.exists(username):
+        print(f'No metadata index for {username} in {MetadataIndex.path_for(username)}', file=sys.stderr)
+        return 2
+    json_path = os.path.join(DOWNLOAD_PATH, username, username + '.json')
+    with MetadataIndex.for_user(username) as index:
+        index.export_json(json_path, compact)
+        print(f'\t----+ {index.counts()} exported to: {json_path}'.expandtabs(4))
+    return 0
+
+def import_index(filepath: str):
+    data = next(iter_records(filepath)) if is_stream_file(filepath) else codec.load_file(filepath)
+    username = data.get('username') if isinstance(data, dict) else None
+    if not username:
+        print(f'{filepath} is not a saved scrape', file=sys.stderr)
+        return 2
+    with MetadataIndex.for_user(username) as index:
+        index.import_file(filepath)
+        print(f'\t----+ {index.counts()} indexed in: {index.path}'.expandtabs(4))
+    return 0
+
+def replay(username: str, compact: bool = False):
+    path = archive_path(username)
+    if not os.path.exists(path):
+        print(f'No response archive for {username} in {path}, scrape with --archive first', file=sys.stderr)
+        return 2
+
+    make_logging_path(username)
+    print(f'----# Rebuilding {username} from {path}...')
+    with MetadataIndex.for_user(username) as index:
+        index_sink = IndexSink(index)
+        userinfo, created_pins, boards = ArchiveReplay(path).rebuild(sink=index_sink)
+        index_sink.close()
+
+    massive_dict = {key: value for key, value in userinfo.items()}
+    massive_dict['created_pins'] = created_pins
+    massive_dict['boards'] = boards
+    json_path = os.path.join(DOWNLOAD_PATH, username, username + '.json')
+    if not pretty_save_with_correct_data(massive_dict, json_path, compact=compact):
+        return 1
+    print(f'\t----+ {len(created_pins)} created pins and {len(boards)} boards saved in: {json_path}'.expandtabs(4))
+    return 0
+
+def unpack_downloads(username: str):
+    root = os.path.join(DOWNLOAD_PATH, username, 'downloads')
+    if not os.path.exists(root):
+        print(f'Nothing downloaded for {username} in {root}', file=sys.stderr)
+        return 2
+
+    target = os.path.join(DOWNLOAD_PATH, username, 'unpacked')
+    print(f'----# Unpacking the shards of {username} into {target}...')
+    files, size = unpack(root, target)
+    print(f'\t----+ {files} files unpacked [{size/(1024*1024):.2f}MB]'.expandtabs(4))
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='A simple Pintrest Scrapper.')
+    parser.add_argument('--batch', metavar='FILE', help='scrape every profile/board url (or username) in FILE, one per line, "-" for stdin, without any prompt')
+    parser.add_argument('--accounts', type=int, default=4, help='accounts scraped at once in batch mode')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY * 2, help='crawl requests in flight over all accounts in batch mode, per process with --workers')
+    parser.add_argument('--rate', type=float, default=None, help='maximum pinterest.com API requests per second over all accounts, shared by the --workers processes of this host (every host sharing a queue has its own)')
+    parser.add_argument('--download', action='store_true', help='download the media of every account in batch mode')
+    parser.add_argument('--full', action='store_true', help='rescrape everything instead of only fetching pins newer than the last scrape in batch mode')
+    parser.add_argument('--summary', metavar='FILE', help='write the per account results of batch mode to FILE as JSON')
+    parser.add_argument('--metrics', metavar='FILE', help='export request, retry, byte and stage metrics to FILE (Prometheus text for .prom, JSON otherwise)')
+    parser.add_argument('--metrics-interval', type=float, default=0, help='also export the metrics every this many seconds while running')
+    parser.add_argument('--enqueue', metavar='FILE', help=f'add every profile/board url (or username) in FILE ("-" for stdin) to the crawl queue in {QUEUE_PATH}')
+    parser.add_argument('--workers', type=int, default=0, help='crawl the queued accounts with this many worker processes, more hosts can work on a queue in a download directory shared over a file system with working locks')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE, help='seconds a worker holds a job without a heartbeat before others reclaim it')
+    parser.add_argument('--export', metavar='USERNAME', help=f'write the saved document of USERNAME from its metadata index ({MetadataIndex.path_for("USERNAME")}) to USERNAME.json')
+    parser.add_argument('--import', dest='import_file', metavar='FILE', help='add a saved .json or .jsonl(.gz) file to the metadata index of its user')
+    parser.add_argument('--archive', action='store_true', help='append every raw API response to <username>/<username>_responses.jsonl.gz')
+    parser.add_argument('--replay', metavar='USERNAME', help='rebuild the saved document of USERNAME from its response archive without any request')
+    parser.add_argument('--packed', type=float, nargs='?', const=DEFAULT_SHARD_BYTES / (1024 * 1024), default=None, metavar='MB',
+                        help='pack downloaded media into tar shards of about MB megabytes (1024 by default) instead of one file per pin')
+    parser.add_argument('--unpack', metavar='USERNAME', help='extract the packed downloads of USERNAME into <username>/unpacked')
+    parser.add_argument('--cache', action='store_true', help=f'cache responses and media validators in {CACHE_PATH}')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL, help='seconds a cached response is used without revalidation')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='maximum size of cached bodies in MB')
+    parser.add_argument('--quality', default='orig', help=f'image size to download: {", ".join(TIERS)} or any <width>x, also caps the video width')
+    parser.add_argument('--max-width', type=int, default=None, help='maximum width of downloaded images and videos in pixels')
+    parser.add_argument('--media-connections', type=int, default=HOST_LIMITS['pinimg.com'], help='maximum downloads from pinimg.com at once, per account in batch mode')
+    parser.add_argument('--max-file-size', type=float, default=None, help='skip to a smaller variant when a file is bigger than this many MB')
+    parser.add_argument('--compact', action='store_true', help='write the saved .json documents without indentation, smaller and faster to write and load')
+    parser.add_argument('--rotate-user-agent', action='store_true', help='give every session (one per worker thread) its own random User-Agent instead of one for the whole run')
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    cache = HttpCache(CACHE_PATH, args.cache_ttl, args.cache_size * 1024 * 1024) if args.cache else None
+    SESSIONS.enable_cache(cache)
+    SESSIONS.rotate_user_agent = args.rotate_user_agent
+    policy = QualityPolicy(args.quality, args.max_width, int(args.max_file_size * 1024 * 1024) if args.max_file_size else None)
+    shard_bytes = int(args.packed * 1024 * 1024) if args.packed else None
+    HOST_LIMITS['pinimg.com'] = max(1, args.media_connections)
+    if args.rate:
+        RATE_LIMITER.set_budget('pinterest.com', args.rate)
+    exporter = PeriodicExporter(METRICS, args.metrics, args.metrics_interval).start() if args.metrics else None
+    code = 0
+    try:
+        if args.enqueue or args.workers:
+            if args.enqueue:
+                print(f'\t----+ Queued: {", ".join(enqueue_accounts(read_sources(args.enqueue))) or "nothing"}'.expandtabs(4))
+            if args.workers:
+                counts = run_workers(args.workers, lease=args.lease, concurrency=args.concurrency, budgets={'pinterest.com': args.rate} if args.rate else None,
+                                     rotate_user_agent=args.rotate_user_agent, compact=args.compact)
+                print(f'\t----+ Crawl queue: {counts}'.expandtabs(4))
+                code = 1 if counts['failed'] else 0
+        elif args.export:
+            code = export_index(args.export, args.compact)
+        elif args.import_file:
+            code = import_index(args.import_file)
+        elif args.replay:
+            code = replay(args.replay, args.compact)
+        elif args.unpack:
+            code = unpack_downloads(args.unpack)
+        elif args.batch:
+            code = run_batch(
+                args.batch, args.summary, accounts=args.accounts, concurrency=args.concurrency,
+                download=args.download, delta=not args.full, policy=policy, archive=args.archive,
+                shard_bytes=shard_bytes, compact=args.compact
+            )
+        else:
+            main(policy, args.archive, shard_bytes, args.compact)
+    finally:
+        if exporter:
+            exporter.stop()
+            print(f'\t----+ Metrics saved in: {args.metrics}'.expandtabs(4))
+        if cache:
+            print(f'\t----+ HTTP cache: {cache.report()}'.expandtabs(4))
+            cache.close()
+    sys.exit(code)